@@ -0,0 +1,125 @@
+"""Agendador das tarefas diárias de manutenção do banco de dados.
+
+As tarefas (atualização de status de contratos e títulos) rodam uma vez por
+dia, fora do ciclo das requisições: por uma thread em segundo plano iniciada
+junto com a aplicação ou manualmente pelo comando ``flask tarefas-diarias``.
+Um advisory lock do PostgreSQL garante que apenas um processo/servidor
+execute as tarefas por vez, e a tabela ``tarefas_agendadas`` registra a
+última execução de cada uma para que os demais nós não as repitam no mesmo
+dia.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, List, Optional
+
+# Chave arbitrária e fixa do advisory lock ("SIGI" em ASCII)
+ADVISORY_LOCK_KEY = 0x53494749
+
+_tarefas: "OrderedDict[str, Callable]" = OrderedDict()
+
+logger = logging.getLogger(__name__)
+
+
+def registrar_tarefa(nome: str, funcao: Callable) -> Callable:
+    """Registra ``funcao(cur)`` para execução diária sob o nome informado."""
+    _tarefas[nome] = funcao
+    return funcao
+
+
+def tarefas_registradas() -> List[str]:
+    return list(_tarefas)
+
+
+def executar_tarefas(get_connection: Callable, *, forcar: bool = False) -> Dict[str, object]:
+    """Executa as tarefas pendentes do dia em uma única transação.
+
+    Retorna um dicionário com ``status`` (``executado`` ou ``ocupado``, quando
+    outro processo detém o lock) e a lista de tarefas ``executadas``. Com
+    ``forcar=True`` todas as tarefas rodam mesmo que já tenham sido
+    executadas hoje.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (ADVISORY_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return {"status": "ocupado", "executadas": []}
+
+        cur.execute(
+            "SELECT nome FROM tarefas_agendadas WHERE ultima_execucao >= CURRENT_DATE"
+        )
+        concluidas_hoje = {row[0] for row in cur.fetchall()}
+
+        executadas = []
+        for nome, funcao in _tarefas.items():
+            if nome in concluidas_hoje and not forcar:
+                continue
+            funcao(cur)
+            cur.execute(
+                """
+                INSERT INTO tarefas_agendadas (nome, ultima_execucao)
+                VALUES (%s, NOW())
+                ON CONFLICT (nome) DO UPDATE SET ultima_execucao = EXCLUDED.ultima_execucao
+                """,
+                (nome,),
+            )
+            executadas.append(nome)
+        # O commit também libera o advisory lock da transação
+        conn.commit()
+        return {"status": "executado", "executadas": executadas}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+class AgendadorDiario(threading.Thread):
+    """Thread que verifica periodicamente se as tarefas do dia já rodaram."""
+
+    def __init__(self, get_connection: Callable, intervalo: float = 300.0) -> None:
+        super().__init__(name="agendador-diario", daemon=True)
+        self.get_connection = get_connection
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._ultimo_dia: Optional[date] = None
+
+    def run(self) -> None:
+        while not self._parar.is_set():
+            hoje = date.today()
+            if self._ultimo_dia != hoje:
+                try:
+                    resultado = executar_tarefas(self.get_connection)
+                except Exception:
+                    logger.exception("Falha ao executar as tarefas diárias")
+                else:
+                    if resultado["status"] == "executado":
+                        self._ultimo_dia = hoje
+                        if resultado["executadas"]:
+                            logger.info(
+                                "Tarefas diárias executadas: %s",
+                                ", ".join(resultado["executadas"]),
+                            )
+            self._parar.wait(self.intervalo)
+
+    def parar(self) -> None:
+        self._parar.set()
+
+
+_agendador: Optional[AgendadorDiario] = None
+
+
+def iniciar_agendador(get_connection: Callable, intervalo: float = 300.0) -> AgendadorDiario:
+    """Inicia (uma única vez por processo) a thread do agendador."""
+    global _agendador
+    if _agendador is None or not _agendador.is_alive():
+        _agendador = AgendadorDiario(get_connection, intervalo)
+        _agendador.start()
+    return _agendador
@@ -1,5 +1,9 @@
 ﻿# app.py
 # Este é o arquivo principal da sua aplicação Flask.
+# O import deste módulo não deve acessar o banco nem iniciar threads: os
+# comandos da CLI e os processos de conversão de PDF (pdf_processos.py, que
+# reimportam o módulo principal) também o executam. Tarefas de inicialização
+# ficam em ganchos before_request ou são iniciadas sob demanda.
 
 from flask import (
     Flask,
@@ -16,8 +20,7 @@ from flask import (
     g,
 )
 import psycopg2
-from psycopg2 import extras, sql
-from psycopg2.errors import DuplicateObject
+from psycopg2 import extras
 import os
 import posixpath
 from datetime import datetime, timedelta, date
@@ -36,14 +39,47 @@ from openpyxl import Workbook
 from openpyxl.styles import Font
 from openpyxl.utils import get_column_letter
 import uuid
+import click
+import threading
+import time
 
 # Importa a configuração do banco de dados e outras variáveis
-from config import DATABASE_URL, SECRET_KEY, UPLOAD_FOLDER, ALLOWED_EXTENSIONS
+from config import (
+    DATABASE_URL,
+    SECRET_KEY,
+    UPLOAD_FOLDER,
+    ALLOWED_EXTENSIONS,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_IDLE_TIMEOUT,
+    DB_POOL_CHECKOUT_TIMEOUT,
+    PERMISSION_CACHE_TTL,
+    SCHEDULER_ENABLED,
+    SCHEDULER_POLL_INTERVAL,
+    SCHEMA_AUTO_MIGRATE,
+    AUDIT_BATCH_SIZE,
+    AUDIT_FLUSH_INTERVAL_MS,
+    AUDIT_QUEUE_SIZE,
+    AUDIT_FILTER_CACHE_TTL,
+    QUERY_INSTRUMENTATION,
+    QUERY_INSTRUMENTATION_N_PLUS_ONE,
+    QUERY_INSTRUMENTATION_HISTORY,
+    POSICOES_RECALC_INTERVAL,
+    POSICOES_RECALC_ESPERA,
+    BOLETO_PDF_PROCESSOS,
+    BOLETO_NAVEGADOR_PAGINAS,
+    BOLETO_NAVEGADOR_MAX_RENDERS,
+    BOLETO_PDF_CACHE_MB,
+    BOLETO_PDF_CACHE_DIAS,
+    BOLETO_PDF_MOTOR_FALHAS,
+    BOLETO_PDF_MOTOR_ESPERA,
+)
 from caixa_banco import init_app as init_caixa_banco, db
 from contas_receber import init_app as init_contas_receber
 from cobranca import init_app as init_cobrancas
 from cobranca.models import Cobranca
 from contas_receber.models import ContaReceber, Pessoa
+from contas_receber.pdf import seletor_motores
 from caixa_banco.models import (
     ContaCaixa,
     ContaBanco,
@@ -57,9 +93,16 @@ from caixa_banco.services import (
     atualizar_movimento,
     deletar_movimento,
     recalcular_posicoes,
+    processar_posicoes_pendentes,
     calcular_saldos_atualizados,
 )
-from db_utils import decode_psycopg_unicode_error
+from caixa_banco import recalculo as recalculo_posicoes
+from caixa_banco.arquivos import ArquivoJaProcessado
+from db_utils import ConnectionPool, RequestConnection
+import agendador
+import auditoria
+import instrumentacao
+import db_migrations
 from sqlalchemy import func
 from sqlalchemy.orm import load_only
 
@@ -68,6 +111,20 @@ app.config["SECRET_KEY"] = SECRET_KEY
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["DB_POOL_MIN_SIZE"] = DB_POOL_MIN_SIZE
+app.config["DB_POOL_MAX_SIZE"] = DB_POOL_MAX_SIZE
+app.config["DB_POOL_IDLE_TIMEOUT"] = DB_POOL_IDLE_TIMEOUT
+app.config["DB_POOL_CHECKOUT_TIMEOUT"] = DB_POOL_CHECKOUT_TIMEOUT
+app.config["QUERY_INSTRUMENTATION"] = QUERY_INSTRUMENTATION
+app.config["BOLETO_PDF_PROCESSOS"] = BOLETO_PDF_PROCESSOS
+app.config["BOLETO_NAVEGADOR_PAGINAS"] = BOLETO_NAVEGADOR_PAGINAS
+app.config["BOLETO_NAVEGADOR_MAX_RENDERS"] = BOLETO_NAVEGADOR_MAX_RENDERS
+app.config["BOLETO_PDF_CACHE_MB"] = BOLETO_PDF_CACHE_MB
+app.config["BOLETO_PDF_CACHE_DIAS"] = BOLETO_PDF_CACHE_DIAS
+app.config["BOLETO_PDF_MOTOR_FALHAS"] = BOLETO_PDF_MOTOR_FALHAS
+app.config["BOLETO_PDF_MOTOR_ESPERA"] = BOLETO_PDF_MOTOR_ESPERA
+# As tabelas são criadas pelas migrações (flask migrar-banco), não no import
+app.config["SCHEMA_AUTO_CREATE"] = False
 
 # Cria as pastas de uploads se elas não existirem
 if not os.path.exists(UPLOAD_FOLDER):
@@ -113,6 +170,64 @@ def login_required(f):
     return decorated_function
 
 
+# Cache em memória das permissões por usuário: {user_id: (expira_em, master, {(modulo, acao)})}.
+# Cada processo mantém o seu; as alterações feitas em outro worker aparecem
+# após PERMISSION_CACHE_TTL segundos.
+_permission_cache = {}
+_permission_cache_lock = threading.Lock()
+# Gerações incrementadas pelas invalidações (por usuário e de todos): uma
+# leitura do banco iniciada antes de uma invalidação não é guardada no cache.
+_permission_generations = {}
+_permission_generation_all = 0
+
+
+def _load_user_permissions(user_id):
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cur.execute("SELECT tipo_usuario FROM usuarios WHERE id = %s", (user_id,))
+        user = cur.fetchone()
+        is_master = bool(user and user["tipo_usuario"] == "Master")
+        permissoes = set()
+        if user and not is_master:
+            cur.execute(
+                "SELECT modulo, acao FROM permissoes WHERE usuario_id = %s",
+                (user_id,),
+            )
+            permissoes = {(row["modulo"], row["acao"]) for row in cur.fetchall()}
+    finally:
+        cur.close()
+        conn.close()
+    return is_master, frozenset(permissoes)
+
+
+def get_user_permissions(user_id):
+    """Retorna ``(is_master, permissoes)`` do usuário, usando o cache com TTL."""
+    agora = time.monotonic()
+    with _permission_cache_lock:
+        entrada = _permission_cache.get(user_id)
+        geracao = (_permission_generation_all, _permission_generations.get(user_id, 0))
+    if entrada and entrada[0] > agora:
+        return entrada[1], entrada[2]
+    is_master, permissoes = _load_user_permissions(user_id)
+    with _permission_cache_lock:
+        if geracao == (_permission_generation_all, _permission_generations.get(user_id, 0)):
+            _permission_cache[user_id] = (agora + PERMISSION_CACHE_TTL, is_master, permissoes)
+    return is_master, permissoes
+
+
+def invalidate_user_permissions(user_id=None):
+    """Descarta as permissões em cache de um usuário (ou de todos)."""
+    global _permission_generation_all
+    with _permission_cache_lock:
+        if user_id is None:
+            _permission_generation_all += 1
+            _permission_cache.clear()
+        else:
+            _permission_generations[user_id] = _permission_generations.get(user_id, 0) + 1
+            _permission_cache.pop(user_id, None)
+
+
 def permission_required(module, action):
     """Decorador para validar se o usuário autenticado possui a permissão."""
 
@@ -123,29 +238,9 @@ def permission_required(module, action):
                 flash("Você precisa estar logado para acessar esta página.", "info")
                 return redirect(url_for("login"))
 
-            user_id = session["user_id"]
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            try:
-                # Usuários do tipo "Master" possuem todas as permissões
-                cur.execute("SELECT tipo_usuario FROM usuarios WHERE id = %s", (user_id,))
-                user = cur.fetchone()
-                is_master = bool(user and user["tipo_usuario"] == "Master")
-
-                has_permission = True
-                if not is_master:
-                    # Verifica se há permissão específica para o módulo/ação
-                    cur.execute(
-                        """
-                        SELECT COUNT(*) FROM permissoes
-                        WHERE usuario_id = %s AND modulo = %s AND acao = %s
-                        """,
-                        (user_id, module, action),
-                    )
-                    has_permission = cur.fetchone()[0] > 0
-            finally:
-                cur.close()
-                conn.close()
+            # Usuários do tipo "Master" possuem todas as permissões
+            is_master, permissoes = get_user_permissions(session["user_id"])
+            has_permission = is_master or (module, action) in permissoes
 
             if not has_permission:
                 flash(
@@ -440,93 +535,168 @@ PRESTACAO_RECEITA_DESCR = "PRESTACAO ENCERRAMENTO CONTRATO"
 PRESTACAO_DESPESA_DESCR = "PRESTACAO ENCERRAMENTO CONTRATO"
 
 
+# Pool de conexões psycopg2 do processo; usa o mesmo dimensionamento do
+# engine SQLAlchemy configurado em caixa_banco.init_app.
+db_pool = ConnectionPool(
+    DATABASE_URL,
+    min_size=app.config["DB_POOL_MIN_SIZE"],
+    max_size=app.config["DB_POOL_MAX_SIZE"],
+    idle_timeout=app.config["DB_POOL_IDLE_TIMEOUT"],
+    checkout_timeout=app.config["DB_POOL_CHECKOUT_TIMEOUT"],
+)
+
+
 # Função para conectar ao banco de dados
 def get_db_connection():
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-    except UnicodeDecodeError as exc:
-        message = decode_psycopg_unicode_error(exc)
-        raise RuntimeError(f'Database connection failed: {message}') from exc
-    return conn
+    """Retorna a conexão da requisição atual ou uma conexão do pool.
+
+    Dentro de uma requisição, decoradores, auditoria e view compartilham a
+    mesma conexão do ``db_pool`` (guardada em ``g``), retirada na primeira
+    chamada. ``conn.close()`` apenas libera o handle; a conexão volta ao
+    pool em ``release_request_connection``. Ela é separada da conexão da
+    sessão SQLAlchemy, que o pool do engine pode entregar a outra requisição
+    após um ``db.session.commit()``; assim, commits e rollbacks de um lado
+    não afetam o outro. Fora de requisições (inicialização, comandos CLI)
+    cada chamada retira uma conexão própria do pool.
+    """
+    if not has_request_context():
+        return db_pool.getconn()
+    unit = g.get("_db_unit")
+    if unit is None:
+        unit = g._db_unit = RequestConnection(db_pool.getconn)
+    if g.get("_coletor_consultas") is not None:
+        return instrumentacao.ConexaoInstrumentada(unit.handle())
+    return unit.handle()
 
 
-def ensure_status_contrato_enum_values():
-    conn = None
-    cur = None
-    try:
-        conn = get_db_connection()
-        conn.autocommit = True
-        cur = conn.cursor()
-        for value in ("Finalizado", "Renovar"):
-            cur.execute(f"ALTER TYPE status_contrato_enum ADD VALUE IF NOT EXISTS '{value}'")
-    except Exception:
-        pass
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+@app.teardown_request
+def release_request_connection(exc=None):
+    unit = g.pop("_db_unit", None)
+    if unit is not None:
+        unit.release()
 
 
-ensure_status_contrato_enum_values()
+# Instrumentação opcional das consultas (QUERY_INSTRUMENTATION=1): contagem,
+# tempo e suspeitas de N+1 por requisição, no cabeçalho da resposta e em
+# /gerencial/consultas.
+historico_consultas = instrumentacao.HistoricoConsultas(QUERY_INSTRUMENTATION_HISTORY)
 
+if QUERY_INSTRUMENTATION:
+    with app.app_context():
+        instrumentacao.instrumentar_engine(db.engine)
 
-def ensure_status_conta_enum_values():
-    conn = None
-    cur = None
-    try:
-        conn = get_db_connection()
-        conn.autocommit = True
-        cur = conn.cursor()
-        cur.execute("ALTER TYPE status_conta_enum ADD VALUE IF NOT EXISTS 'Negociado'")
-    except Exception:
-        pass
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
 
+@app.before_request
+def iniciar_instrumentacao_consultas():
+    if QUERY_INSTRUMENTATION:
+        g._coletor_consultas = instrumentacao.iniciar_coleta(
+            limiar_repeticao=QUERY_INSTRUMENTATION_N_PLUS_ONE
+        )
+        g._coletor_inicio = time.perf_counter()
+
+
+@app.after_request
+def publicar_instrumentacao_consultas(response):
+    coletor = g.pop("_coletor_consultas", None)
+    if coletor is None:
+        return response
+    instrumentacao.encerrar_coleta()
+    resumo = coletor.resumo(
+        metodo=request.method,
+        caminho=request.path,
+        endpoint=request.endpoint,
+        status=response.status_code,
+        duracao_ms=round((time.perf_counter() - g.pop("_coletor_inicio")) * 1000, 2),
+        quando=datetime.now(),
+    )
+    response.headers["X-DB-Queries"] = str(resumo["quantidade"])
+    response.headers.add(
+        "Server-Timing", f'db;dur={resumo["tempo_ms"]};desc="{resumo["quantidade"]} consultas"'
+    )
+    if resumo["repetidas"]:
+        response.headers["X-DB-N-Plus-One"] = str(len(resumo["repetidas"]))
+    if request.endpoint not in ("static", "gerencial_consultas"):
+        historico_consultas.adicionar(resumo)
+    return response
+
+
+@app.teardown_request
+def encerrar_instrumentacao_consultas(exc=None):
+    # Requisições que terminaram em exceção não passam pelo after_request
+    if g.pop("_coletor_consultas", None) is not None:
+        instrumentacao.encerrar_coleta()
+
+
+def _criar_tabelas_orm():
+    with app.app_context():
+        db.create_all()
+
+
+def aplicar_migracoes_esquema():
+    """Cria as tabelas dos modelos ORM e aplica as migrações SQL pendentes."""
+    # Conexão própria do pool, nunca a da requisição: as migrações alternam
+    # o autocommit e fazem commit
+    return db_migrations.aplicar_migracoes(db_pool.getconn, antes=_criar_tabelas_orm)
+
+
+@app.cli.command("migrar-banco")
+@click.option("--listar", is_flag=True, help="Apenas lista as migrações pendentes.")
+def migrar_banco_command(listar):
+    """Aplica as migrações de esquema pendentes (migrations/*.sql)."""
+    if listar:
+        pendentes = db_migrations.migracoes_pendentes(get_db_connection)
+        for migracao in pendentes:
+            click.echo(f"{migracao.versao:03d}_{migracao.nome}")
+        if not pendentes:
+            click.echo("Nenhuma migração pendente.")
+        return
+    aplicadas = aplicar_migracoes_esquema()
+    for migracao in aplicadas:
+        click.echo(f"Aplicada: {migracao.versao:03d}_{migracao.nome}")
+    if not aplicadas:
+        click.echo("Nenhuma migração pendente.")
 
-ensure_status_conta_enum_values()
 
+def verificar_migracoes():
+    """Confere (uma consulta) se há migrações pendentes e avisa no log.
 
-def ensure_auditoria_table():
-    conn = None
-    cur = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS auditoria_logs (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER,
-                username VARCHAR(150),
-                modulo VARCHAR(150),
-                acao VARCHAR(50),
-                descricao TEXT,
-                ip VARCHAR(45),
-                criado_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            )
-        """
+    As pendentes só são aplicadas aqui com ``SCHEMA_AUTO_MIGRATE=1``; do
+    contrário, rode ``flask --app app migrar-banco``.
+    """
+    pendentes = db_migrations.migracoes_pendentes(db_pool.getconn)
+    if not pendentes:
+        return
+    nomes = ", ".join(f"{m.versao:03d}_{m.nome}" for m in pendentes)
+    if not SCHEMA_AUTO_MIGRATE:
+        app.logger.warning(
+            "Migrações de banco pendentes: %s. Execute 'flask --app app migrar-banco'.",
+            nomes,
         )
-        conn.commit()
-        # Remove coluna "dados" de instalações antigas
-        cur.execute("ALTER TABLE auditoria_logs DROP COLUMN IF EXISTS dados")
-        conn.commit()
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        app.logger.exception("Erro ao garantir tabela de auditoria: %s", e)
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+        return
+    app.logger.info("Aplicando migrações de banco pendentes: %s", nomes)
+    aplicar_migracoes_esquema()
+
 
+_migracoes_verificadas = False
+_migracoes_lock = threading.Lock()
 
-ensure_auditoria_table()
+
+@app.before_request
+def verificar_migracoes_na_inicializacao():
+    # Uma vez por processo, na primeira requisição. O import do app não
+    # acessa o banco: os comandos da CLI (inclusive "migrar-banco --listar")
+    # e os processos de conversão de PDF também importam este módulo.
+    global _migracoes_verificadas
+    if _migracoes_verificadas:
+        return
+    with _migracoes_lock:
+        if _migracoes_verificadas:
+            return
+        _migracoes_verificadas = True
+    try:
+        verificar_migracoes()
+    except Exception:
+        app.logger.exception("Não foi possível verificar as migrações de banco pendentes")
 
 
 def _get_request_ip():
@@ -854,17 +1024,23 @@ def _build_auto_log_description(module, action, view_args, payload):
     return descricao
 
 
+# Registros de auditoria são gravados em lote por uma thread (auditoria.py),
+# sempre em conexões próprias do pool e fora da transação da requisição.
+gravador_auditoria = auditoria.iniciar_gravador(
+    db_pool.getconn,
+    tamanho_lote=AUDIT_BATCH_SIZE,
+    intervalo=AUDIT_FLUSH_INTERVAL_MS / 1000.0,
+    capacidade=AUDIT_QUEUE_SIZE,
+)
+
+
 def log_user_action(acao, modulo, descricao=None, dados=None):
     if not has_request_context():
         return
     if "user_id" not in session:
         return
     setattr(g, "_user_action_logged", True)
-    conn = None
-    cur = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
         descricao_final = descricao or ""
         if dados is not None:
             try:
@@ -877,43 +1053,93 @@ def log_user_action(acao, modulo, descricao=None, dados=None):
                 descricao_final = f"Dados: {dados_serializados}"
         if not descricao_final:
             descricao_final = None
-        cur.execute(
-            """
-            INSERT INTO auditoria_logs (user_id, username, modulo, acao, descricao, ip)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """,
-            (
+        gravador_auditoria.registrar(
+            auditoria.novo_registro(
                 session.get("user_id"),
                 session.get("username"),
                 modulo,
                 acao,
                 descricao_final,
                 _get_request_ip(),
-            ),
+            )
         )
-        conn.commit()
     except Exception as e:
-        if conn:
-            conn.rollback()
         app.logger.exception("Erro ao registrar log de auditoria: %s", e)
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
 
 
 # --- Gerencial ---
 
 
+# Acima deste número estimado de linhas a tela de logs mostra a estimativa do
+# planejador em vez de executar COUNT(*)
+LOGS_CONTAGEM_EXATA_LIMITE = 10000
+
+_logs_filtros_cache = {"valores": None, "expira_em": 0.0}
+_logs_filtros_cache_lock = threading.Lock()
+
+
+def _listar_filtros_logs(cur):
+    """Módulos e ações distintos do log, em cache por AUDIT_FILTER_CACHE_TTL."""
+    agora = time.monotonic()
+    with _logs_filtros_cache_lock:
+        if _logs_filtros_cache["valores"] is not None and _logs_filtros_cache["expira_em"] > agora:
+            return _logs_filtros_cache["valores"]
+    cur.execute(
+        "SELECT DISTINCT modulo FROM auditoria_logs WHERE modulo IS NOT NULL AND modulo <> '' ORDER BY modulo"
+    )
+    modulos = [row[0] for row in cur.fetchall()]
+    cur.execute(
+        "SELECT DISTINCT acao FROM auditoria_logs WHERE acao IS NOT NULL AND acao <> '' ORDER BY acao"
+    )
+    acoes = [row[0] for row in cur.fetchall()]
+    with _logs_filtros_cache_lock:
+        _logs_filtros_cache["valores"] = (modulos, acoes)
+        _logs_filtros_cache["expira_em"] = agora + AUDIT_FILTER_CACHE_TTL
+    return modulos, acoes
+
+
+def _contar_logs(cur, where_clause, params):
+    """Retorna ``(total, aproximado)``; conta exatamente só resultados pequenos."""
+    cur.execute("EXPLAIN (FORMAT JSON) SELECT 1 FROM auditoria_logs" + where_clause, params)
+    plano = cur.fetchone()[0]
+    if isinstance(plano, str):
+        plano = json.loads(plano)
+    estimativa = int(plano[0]["Plan"]["Plan Rows"])
+    if estimativa > LOGS_CONTAGEM_EXATA_LIMITE:
+        return estimativa, True
+    cur.execute("SELECT COUNT(*) FROM auditoria_logs" + where_clause, params)
+    return cur.fetchone()[0] or 0, False
+
+
+def _codificar_cursor_logs(log):
+    return f"{log['criado_em'].isoformat()}_{log['id']}"
+
+
+def _decodificar_cursor_logs(valor):
+    try:
+        criado_em, log_id = valor.rsplit("_", 1)
+        return datetime.fromisoformat(criado_em), int(log_id)
+    except (AttributeError, ValueError):
+        return None
+
+
 @app.route("/gerencial/logs")
 @login_required
 @permission_required("Logs do Sistema", "Visualizar")
 def gerencial_logs():
+    """Lista os logs com paginação por cursor (criado_em, id).
+
+    ``antes`` traz a página seguinte (registros mais antigos que o cursor) e
+    ``depois`` a anterior; o custo não cresce com a profundidade da página.
+    """
     page = request.args.get("page", 1, type=int)
     if page < 1:
         page = 1
     per_page = 50
+    antes = _decodificar_cursor_logs(request.args.get("antes"))
+    depois = None if antes else _decodificar_cursor_logs(request.args.get("depois"))
+    if not antes and not depois:
+        page = 1
 
     username = request.args.get("username", "").strip()
     modulo = request.args.get("modulo", "").strip()
@@ -939,6 +1165,7 @@ def gerencial_logs():
             filtros_sql.append("criado_em >= %s")
             params.append(datetime.strptime(data_inicio, "%Y-%m-%d"))
         except ValueError:
+            filtros_sql.pop()
             flash("Data inicial inválida. Utilize o formato AAAA-MM-DD.", "warning")
 
     if data_fim:
@@ -946,6 +1173,7 @@ def gerencial_logs():
             filtros_sql.append("criado_em < %s")
             params.append(datetime.strptime(data_fim, "%Y-%m-%d") + timedelta(days=1))
         except ValueError:
+            filtros_sql.pop()
             flash("Data final inválida. Utilize o formato AAAA-MM-DD.", "warning")
 
     conn = get_db_connection()
@@ -955,26 +1183,32 @@ def gerencial_logs():
     if filtros_sql:
         where_clause = " WHERE " + " AND ".join(filtros_sql)
 
-    count_sql = "SELECT COUNT(*) FROM auditoria_logs" + where_clause
-    cur.execute(count_sql, params)
-    total = cur.fetchone()[0] or 0
-
-    total_pages = (total + per_page - 1) // per_page if total else 1
-    if page > total_pages:
-        page = total_pages if total_pages > 0 else 1
-
-    offset = (page - 1) * per_page if total else 0
+    total, aproximado = _contar_logs(cur, where_clause, params)
 
+    pagina_sql = list(filtros_sql)
+    query_params = list(params)
+    ordem = "DESC"
+    if antes:
+        pagina_sql.append("(criado_em, id) < (%s, %s)")
+        query_params.extend(antes)
+    elif depois:
+        pagina_sql.append("(criado_em, id) > (%s, %s)")
+        query_params.extend(depois)
+        ordem = "ASC"
     select_sql = (
         "SELECT id, user_id, username, modulo, acao, descricao, ip, criado_em "
         "FROM auditoria_logs"
-        + where_clause
-        + " ORDER BY criado_em DESC LIMIT %s OFFSET %s"
+        + (" WHERE " + " AND ".join(pagina_sql) if pagina_sql else "")
+        + f" ORDER BY criado_em {ordem}, id {ordem} LIMIT %s"
     )
-    query_params = list(params)
-    query_params.extend([per_page, offset])
+    # Uma linha a mais indica se existe outra página na mesma direção
+    query_params.append(per_page + 1)
     cur.execute(select_sql, query_params)
     rows = cur.fetchall()
+    tem_mais = len(rows) > per_page
+    rows = rows[:per_page]
+    if depois:
+        rows.reverse()
 
     logs = []
     for row in rows:
@@ -991,15 +1225,7 @@ def gerencial_logs():
             }
         )
 
-    cur.execute(
-        "SELECT DISTINCT modulo FROM auditoria_logs WHERE modulo IS NOT NULL AND modulo <> '' ORDER BY modulo"
-    )
-    modulos = [row[0] for row in cur.fetchall()]
-
-    cur.execute(
-        "SELECT DISTINCT acao FROM auditoria_logs WHERE acao IS NOT NULL AND acao <> '' ORDER BY acao"
-    )
-    acoes = [row[0] for row in cur.fetchall()]
+    modulos, acoes = _listar_filtros_logs(cur)
 
     cur.close()
     conn.close()
@@ -1013,16 +1239,35 @@ def gerencial_logs():
     }
     query_args = {k: v for k, v in query_args.items() if v}
 
+    has_prev = tem_mais if depois else bool(antes)
+    has_next = bool(depois) or tem_mais
+    if not logs:
+        has_prev = has_next = False
+    total_pages = (total + per_page - 1) // per_page if total else 1
+
     pagination = {
         "page": page,
-        "pages": total_pages,
+        "pages": max(total_pages, page),
         "per_page": per_page,
         "total": total,
-        "has_prev": page > 1,
-        "has_next": page < total_pages and total > 0,
-        "prev_url": url_for("gerencial_logs", page=page - 1, **query_args) if page > 1 else None,
-        "next_url": url_for("gerencial_logs", page=page + 1, **query_args)
-        if page < total_pages and total > 0
+        "aproximado": aproximado,
+        "has_prev": has_prev,
+        "has_next": has_next,
+        "prev_url": url_for(
+            "gerencial_logs",
+            depois=_codificar_cursor_logs(logs[0]),
+            page=page - 1,
+            **query_args,
+        )
+        if has_prev
+        else None,
+        "next_url": url_for(
+            "gerencial_logs",
+            antes=_codificar_cursor_logs(logs[-1]),
+            page=page + 1,
+            **query_args,
+        )
+        if has_next
         else None,
     }
 
@@ -1044,6 +1289,70 @@ def gerencial_logs():
     )
 
 
+@app.route("/gerencial/consultas", methods=["GET", "POST"])
+@login_required
+@permission_required("Logs do Sistema", "Visualizar")
+def gerencial_consultas():
+    """Resumo das consultas SQL das últimas requisições deste processo."""
+    if request.method == "POST":
+        historico_consultas.limpar()
+        flash("Histórico de consultas limpo.", "success")
+        return redirect(url_for("gerencial_consultas"))
+    requisicoes = historico_consultas.listar()
+    if request.args.get("somente_n1"):
+        requisicoes = [r for r in requisicoes if r["repetidas"]]
+    return render_template(
+        "gerencial/consultas/index.html",
+        requisicoes=requisicoes,
+        habilitado=QUERY_INSTRUMENTATION,
+        limiar=QUERY_INSTRUMENTATION_N_PLUS_ONE,
+        somente_n1=bool(request.args.get("somente_n1")),
+    )
+
+
+@app.route("/gerencial/motores-pdf", methods=["GET", "POST"])
+@login_required
+@permission_required("Logs do Sistema", "Visualizar")
+def gerencial_motores_pdf():
+    """Mecanismos de PDF de boletos deste processo; o POST refaz a sondagem.
+
+    Os processos de ``pdf_processos`` (``BOLETO_PDF_PROCESSOS`` > 1) têm
+    seletores próprios, que esta tela não mostra nem sonda de novo. O GET
+    não sonda: antes da primeira conversão os mecanismos aparecem como não
+    sondados.
+    """
+    seletor = seletor_motores()
+    if request.method == "POST":
+        seletor.sondar()
+        flash("Mecanismos de PDF sondados novamente.", "success")
+        return redirect(url_for("gerencial_motores_pdf"))
+    return render_template(
+        "gerencial/motores_pdf/index.html",
+        ativo=seletor.ativo_atual,
+        motores=seletor.estado(),
+        sondado_em=seletor.sondado_em,
+        processos=app.config["BOLETO_PDF_PROCESSOS"],
+    )
+
+
+@app.cli.command("auditoria-retencao")
+@click.option("--meses", default=12, show_default=True, help="Meses de log mantidos em auditoria_logs.")
+@click.option(
+    "--arquivar",
+    "pasta",
+    default=None,
+    help="Exporta cada partição antiga para PASTA/<particao>.csv.gz e a remove do banco.",
+)
+def auditoria_retencao_command(meses, pasta):
+    """Desanexa (ou arquiva) as partições mensais antigas do log de auditoria."""
+    processadas = auditoria.aplicar_retencao(db_pool.getconn, meses, pasta_arquivo=pasta)
+    acao = "Arquivada" if pasta else "Desanexada"
+    for nome in processadas:
+        click.echo(f"{acao}: {nome}")
+    if not processadas:
+        click.echo("Nenhuma partição fora do período de retenção.")
+
+
 # Função auxiliar para verificar extensões de arquivo permitidas
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -1621,993 +1930,226 @@ def processar_prestacao(
         cur.execute(
             """
             INSERT INTO prestacoes_contas_itens (prestacao_id, tipo, descricao, valor)
-            VALUES (%s, 'despesa', %s, %s)
-            """,
-            (
-                prestacao_id,
-                despesa["descricao"],
-                despesa["valor"].quantize(Decimal("0.01")),
-            ),
-        )
-
-    cur.execute(
-        """
-        UPDATE prestacoes_contas
-        SET status = 'Pendente',
-            conta_pagar_id = NULL,
-            conta_receber_id = NULL,
-            atualizado_em = NOW()
-        WHERE id = %s
-        """,
-        (prestacao_id,),
-    )
-
-    return {
-        "prestacao_id": prestacao_id,
-        "totais": {
-            "total_creditos": total_creditos,
-            "total_debitos": total_debitos,
-            "total_despesas": total_despesas,
-            "saldo_final": saldo_final,
-        },
-        "conta_pagar_id": None,
-        "conta_receber_id": None,
-    }
-
-
-def gerar_contas_financeiras_prestacao(cur, prestacao, contrato):
-    """Cria contas financeiras para a prestação ao aprovar."""
-
-    conta_pagar_id = prestacao.get("conta_pagar_id")
-    conta_receber_id = prestacao.get("conta_receber_id")
-    if conta_pagar_id or conta_receber_id:
-        return conta_pagar_id, conta_receber_id
-
-    saldo_final = prestacao.get("saldo_final")
-    if saldo_final is None:
-        return None, None
-
-    saldo_final = Decimal(str(saldo_final)).quantize(Decimal("0.01"))
-    if saldo_final == 0:
-        return None, None
-
-    observacoes = prestacao.get("observacoes")
-    data_encerramento = prestacao.get("data_encerramento")
-    if isinstance(data_encerramento, datetime):
-        data_encerramento = data_encerramento.date()
-
-    titulo = f"Prestação de contas contrato #{contrato['id']}"
-
-    if saldo_final > 0:
-        despesa_id = get_or_create_categoria(cur, "despesas_cadastro", PRESTACAO_DESPESA_DESCR)
-        cur.execute(
-            """
-            INSERT INTO contas_a_pagar (
-                despesa_id, fornecedor_id, titulo, data_vencimento, competencia,
-                valor_previsto, valor_pendente, observacao, status_conta
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'Aberta')
-            RETURNING id
-            """,
-            (
-                despesa_id,
-                contrato["cliente_id"],
-                titulo,
-                data_encerramento,
-                data_encerramento,
-                saldo_final,
-                saldo_final,
-                observacoes if observacoes else None,
-            ),
-        )
-        conta_pagar_id = cur.fetchone()[0]
-        return conta_pagar_id, None
-
-    receita_id = get_or_create_categoria(cur, "receitas_cadastro", PRESTACAO_RECEITA_DESCR)
-    valor_receber = abs(saldo_final)
-    cur.execute(
-        """
-        INSERT INTO contas_a_receber (
-            contrato_id, receita_id, cliente_id, titulo, data_vencimento,
-            valor_previsto, valor_pendente, observacao, status_conta
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'Aberta')
-        RETURNING id
-        """,
-        (
-            contrato["id"],
-            receita_id,
-            contrato["cliente_id"],
-            titulo,
-            data_encerramento,
-            valor_receber,
-            valor_receber,
-            observacoes if observacoes else None,
-        ),
-    )
-    conta_receber_id = cur.fetchone()[0]
-    return None, conta_receber_id
-
-
-def format_currency(value):
-    try:
-        return f"R$ {float(value):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except (TypeError, ValueError):
-        return "R$ 0,00"
-
-
-app.jinja_env.filters["currency"] = format_currency
-
-
-def add_months(date_obj, months):
-    """Retorna a data acrescida do número de meses informado."""
-    month = date_obj.month - 1 + months
-    year = date_obj.year + month // 12
-    month = month % 12 + 1
-    day = min(date_obj.day, calendar.monthrange(year, month)[1])
-    return date_obj.replace(year=year, month=month, day=day)
-
-
-def calcular_status_conta(data_vencimento, data_pagamento, contrato_id, cur):
-    if data_pagamento:
-        return "Paga"
-    data_venc = datetime.strptime(data_vencimento, "%Y-%m-%d").date()
-    status = "Vencida" if data_venc < datetime.today().date() else "Aberta"
-    if contrato_id:
-        cur.execute(
-            "SELECT status_contrato FROM contratos_aluguel WHERE id = %s",
-            (contrato_id,),
-        )
-        contrato = cur.fetchone()
-        if (
-            contrato
-            and contrato.get("status_contrato") in {"Encerrado", "Finalizado", "Renovar"}
-            and status == "Aberta"
-        ):
-            status = "Cancelada"
-    return status
-
-
-def atualizar_status_contas_a_receber(cur):
-    cur.execute(
-        """
-        UPDATE contas_a_receber cr
-           SET status_conta = CASE
-                WHEN cr.status_conta = 'Cancelada'::status_conta_enum THEN 'Cancelada'::status_conta_enum
-                WHEN cr.status_conta = 'Negociado'::status_conta_enum THEN 'Negociado'::status_conta_enum
-                WHEN cr.valor_pago >= cr.valor_previsto AND cr.valor_pago IS NOT NULL THEN 'Paga'::status_conta_enum
-                WHEN cr.valor_pago > 0 THEN 'Parcial'::status_conta_enum
-                WHEN cr.data_vencimento < CURRENT_DATE THEN 'Vencida'::status_conta_enum
-                ELSE 'Aberta'::status_conta_enum
-           END,
-               valor_pendente = CASE
-                   WHEN cr.status_conta = 'Cancelada'::status_conta_enum THEN 0
-                   WHEN cr.status_conta = 'Negociado'::status_conta_enum THEN 0
-                   ELSE cr.valor_previsto - COALESCE(cr.valor_pago,0)
-               END
-        """
-    )
-
-
-def atualizar_status_contas_a_pagar(cur):
-    cur.execute(
-        """
-        UPDATE contas_a_pagar cp
-           SET status_conta = CASE
-                WHEN cp.data_pagamento IS NOT NULL THEN 'Paga'::status_conta_enum
-                WHEN cp.data_vencimento < CURRENT_DATE THEN 'Vencida'::status_conta_enum
-                ELSE 'Aberta'::status_conta_enum
-           END,
-               valor_pendente = GREATEST(cp.valor_previsto - COALESCE(cp.valor_pago, 0), 0)
-        """
-    )
-
-def atualizar_status_contratos(cur):
-    cur.execute(
-        """
-        UPDATE contratos_aluguel
-           SET status_contrato = 'Renovar'::status_contrato_enum
-         WHERE data_fim < CURRENT_DATE
-           AND status_contrato IN ('Ativo', 'Pendente')
-        """
-    )
-
-@app.before_request
-def atualizar_contratos_expirados():
-    endpoint = request.endpoint or ''
-    if endpoint == 'static':
-        return
-    conn = None
-    cur = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        atualizar_status_contratos(cur)
-        conn.commit()
-    except Exception:
-        if conn:
-            conn.rollback()
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
-
-# Garante que a coluna max_contratos exista na tabela imoveis
-def ensure_max_contratos_column():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT 1 FROM information_schema.columns
-        WHERE table_name='imoveis' AND column_name='max_contratos'
-        """
-    )
-    exists = cur.fetchone() is not None
-    if not exists:
-        cur.execute(
-            "ALTER TABLE imoveis ADD COLUMN max_contratos INTEGER DEFAULT 1"
-        )
-        conn.commit()
-    cur.close()
-    conn.close()
-
-
-def ensure_imoveis_video_url_column():
-    """Garante que a coluna video_url exista na tabela imoveis."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT 1 FROM information_schema.columns
-        WHERE table_name='imoveis' AND column_name='video_url'
-        """
-    )
-    exists = cur.fetchone() is not None
-    if not exists:
-        cur.execute("ALTER TABLE imoveis ADD COLUMN video_url TEXT")
-        conn.commit()
-    cur.close()
-    conn.close()
-
-
-def ensure_imovel_status_columns():
-    """Garante que o status e a disponibilidade existam na tabela de imóveis."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT 1 FROM pg_type WHERE typname = 'status_imovel_enum'")
-        if cur.fetchone() is None:
-            cur.execute(
-                "CREATE TYPE status_imovel_enum AS ENUM ('Ativo', 'Vendido', 'Loteado')"
-            )
-        else:
-            cur.execute(
-                """
-                SELECT 1 FROM pg_enum
-                WHERE enumtypid = 'status_imovel_enum'::regtype AND enumlabel = 'Ativo'
-                """
-            )
-            if cur.fetchone() is None:
-                cur.execute("ALTER TYPE status_imovel_enum ADD VALUE 'Ativo'")
-            cur.execute(
-                """
-                SELECT 1 FROM pg_enum
-                WHERE enumtypid = 'status_imovel_enum'::regtype AND enumlabel = 'Vendido'
-                """
-            )
-            if cur.fetchone() is None:
-                cur.execute("ALTER TYPE status_imovel_enum ADD VALUE 'Vendido'")
-            cur.execute(
-                """
-                SELECT 1 FROM pg_enum
-                WHERE enumtypid = 'status_imovel_enum'::regtype AND enumlabel = 'Loteado'
-                """
-            )
-            if cur.fetchone() is None:
-                cur.execute("ALTER TYPE status_imovel_enum ADD VALUE 'Loteado'")
-
-        cur.execute(
-            """
-            SELECT 1 FROM information_schema.columns
-            WHERE table_name='imoveis' AND column_name='status'
-            """
-        )
-        if cur.fetchone() is None:
-            cur.execute(
-                """
-                ALTER TABLE imoveis
-                ADD COLUMN status status_imovel_enum NOT NULL DEFAULT 'Ativo'
-                """
-            )
-        else:
-            cur.execute(
-                "ALTER TABLE imoveis ALTER COLUMN status SET DEFAULT 'Ativo'"
-            )
-
-        cur.execute(
-            """
-            SELECT 1 FROM information_schema.columns
-            WHERE table_name='imoveis' AND column_name='disponivel'
-            """
-        )
-        if cur.fetchone() is None:
-            cur.execute(
-                """
-                ALTER TABLE imoveis
-                ADD COLUMN disponivel BOOLEAN NOT NULL DEFAULT TRUE
-                """
-            )
-        else:
-            cur.execute(
-                "UPDATE imoveis SET disponivel = TRUE WHERE disponivel IS NULL"
-            )
-
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
-
-
-def ensure_imovel_vendas_tables():
-    """Cria tabelas de vendas de imóveis e anexos, se necessário."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS imoveis_vendas (
-                id SERIAL PRIMARY KEY,
-                imovel_id INTEGER NOT NULL REFERENCES imoveis(id),
-                cliente_id INTEGER NOT NULL REFERENCES pessoas(id),
-                usuario_id INTEGER REFERENCES usuarios(id),
-                data_venda DATE NOT NULL,
-                valor_total NUMERIC(15,2) NOT NULL,
-                quantidade_parcelas INTEGER NOT NULL DEFAULT 1,
-                valor_parcela NUMERIC(15,2) NOT NULL,
-                observacao TEXT,
-                data_cadastro TIMESTAMP NOT NULL DEFAULT NOW()
-            )
-            """
-        )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS imovel_venda_anexos (
-                id SERIAL PRIMARY KEY,
-                venda_id INTEGER NOT NULL REFERENCES imoveis_vendas(id) ON DELETE CASCADE,
-                nome_arquivo VARCHAR(255) NOT NULL,
-                caminho_arquivo VARCHAR(500) NOT NULL,
-                data_upload TIMESTAMP NOT NULL DEFAULT NOW()
-            )
-            """
-        )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
-
-
-def ensure_loteamentos_tables():
-    """Cria tabelas de loteamentos e seus lotes, se necessário."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS loteamentos (
-                id SERIAL PRIMARY KEY,
-                imovel_id INTEGER NOT NULL REFERENCES imoveis(id) ON DELETE CASCADE,
-                autorizado BOOLEAN NOT NULL DEFAULT FALSE,
-                quantidade_lotes INTEGER,
-                mascara_lote VARCHAR(120),
-                autorizado_em TIMESTAMP,
-                autorizado_por INTEGER REFERENCES usuarios(id),
-                loteado_em TIMESTAMP,
-                planta_nome_arquivo VARCHAR(255),
-                planta_caminho_arquivo VARCHAR(500)
-            )
-            """
-        )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS loteamentos_lotes (
-                id SERIAL PRIMARY KEY,
-                loteamento_id INTEGER NOT NULL REFERENCES loteamentos(id) ON DELETE CASCADE,
-                imovel_id INTEGER NOT NULL REFERENCES imoveis(id) ON DELETE CASCADE,
-                nome_lote VARCHAR(120) NOT NULL
-            )
-            """
-        )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
-
-
-def ensure_venda_imovel_receita():
-    """Garante a existência da categoria de receita para vendas de imóveis."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            "SELECT id FROM receitas_cadastro WHERE descricao = %s",
-            ("Venda de Imóvel",),
-        )
-        if cur.fetchone() is None:
-            cur.execute(
-                "INSERT INTO receitas_cadastro (descricao) VALUES (%s)",
-                ("Venda de Imóvel",),
-            )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
-
-
-def ensure_finalidade_column():
-    """Garante que o tipo e a coluna de finalidade existam."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # Garante que o tipo enum exista
-    cur.execute("SELECT 1 FROM pg_type WHERE typname = 'finalidade_contrato_enum'")
-    if cur.fetchone() is None:
-        cur.execute(
-            "CREATE TYPE finalidade_contrato_enum AS ENUM ('Comercial', 'Residencial', 'Comodato')"
-        )
-
-    # Garante que a coluna exista na tabela
-    cur.execute(
-        """
-        SELECT 1 FROM information_schema.columns
-        WHERE table_name='contratos_aluguel' AND column_name='finalidade'
-        """
-    )
-    exists = cur.fetchone() is not None
-    if not exists:
-        cur.execute(
-            """
-            ALTER TABLE contratos_aluguel
-            ADD COLUMN finalidade finalidade_contrato_enum NOT NULL DEFAULT 'Residencial'
-            """
-        )
-        cur.execute(
-            "ALTER TABLE contratos_aluguel ALTER COLUMN finalidade DROP DEFAULT"
-        )
-
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-def ensure_calcao_columns():
-    """Garante que as colunas de calção existam em contratos_aluguel."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT column_name FROM information_schema.columns
-        WHERE table_name='contratos_aluguel'
-          AND column_name IN ('quantidade_calcao', 'valor_calcao')
-        """
-    )
-    existing = {row[0] for row in cur.fetchall()}
-    if "quantidade_calcao" not in existing:
-        cur.execute(
-            "ALTER TABLE contratos_aluguel ADD COLUMN quantidade_calcao INTEGER"
-        )
-    if "valor_calcao" not in existing:
-        cur.execute(
-            "ALTER TABLE contratos_aluguel ADD COLUMN valor_calcao NUMERIC(10,2)"
-        )
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-def ensure_contrato_renovacoes_table():
-    """Cria a tabela de histórico de renovações de contrato, se necessário."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS contrato_renovacoes (
-            id SERIAL PRIMARY KEY,
-            contrato_id INTEGER NOT NULL REFERENCES contratos_aluguel(id) ON DELETE CASCADE,
-            data_inicio_anterior DATE,
-            data_fim_anterior DATE,
-            valor_parcela_anterior NUMERIC(10,2),
-            data_inicio_novo DATE NOT NULL,
-            data_fim_novo DATE NOT NULL,
-            valor_parcela_novo NUMERIC(10,2) NOT NULL,
-            observacao TEXT,
-            usuario_id INTEGER REFERENCES usuarios(id),
-            data_renovacao TIMESTAMP NOT NULL DEFAULT NOW()
-        )
-        """
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-def ensure_tipo_pessoa_enum():
-    """Garante que o enum tipo_pessoa_enum contenha 'Cliente/Fornecedor'."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM pg_type WHERE typname = 'tipo_pessoa_enum'")
-    if cur.fetchone():
-        cur.execute(
-            """
-            SELECT 1 FROM pg_enum
-            WHERE enumtypid = 'tipo_pessoa_enum'::regtype AND enumlabel = 'Cliente/Fornecedor'
-            """
-        )
-        if cur.fetchone() is None:
-            cur.execute("ALTER TYPE tipo_pessoa_enum ADD VALUE 'Cliente/Fornecedor'")
-            conn.commit()
-    cur.close()
-    conn.close()
-
-
-# Assegura colunas necessárias no banco de dados
-ensure_max_contratos_column()
-ensure_imoveis_video_url_column()
-ensure_imovel_status_columns()
-ensure_imovel_vendas_tables()
-ensure_loteamentos_tables()
-ensure_venda_imovel_receita()
-ensure_calcao_columns()
-ensure_contrato_renovacoes_table()
-ensure_tipo_pessoa_enum()
- 
-
-
-def ensure_ordens_pagamento_tables():
-    """Cria as tabelas de Ordens de Pagamento (cabecalho e itens) caso não existam."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    # Tabela principal de ordens de pagamento
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS ordens_pagamento (
-            id SERIAL PRIMARY KEY,
-            data_emissao TIMESTAMP NOT NULL DEFAULT NOW(),
-            imovel_id INTEGER REFERENCES imoveis(id),
-            fornecedor_id INTEGER NOT NULL REFERENCES pessoas(id),
-            forma_pagamento VARCHAR(30),
-            data_vencimento DATE,
-            descricao_servico TEXT,
-            valor_servico NUMERIC(12,2) NOT NULL DEFAULT 0,
-            desconto_manual NUMERIC(12,2) NOT NULL DEFAULT 0,
-            subtotal_servicos NUMERIC(12,2) NOT NULL DEFAULT 0,
-            subtotal_produtos NUMERIC(12,2) NOT NULL DEFAULT 0,
-            desconto_produtos NUMERIC(12,2) NOT NULL DEFAULT 0,
-            total NUMERIC(12,2) NOT NULL DEFAULT 0,
-            observacoes TEXT
-        )
-        """
-    )
-    # Garante colunas auxiliares para integração com contas a pagar
-    cur.execute(
-        """
-        SELECT 1 FROM information_schema.columns
-         WHERE table_name='ordens_pagamento' AND column_name='despesa_id'
-        """
-    )
-    if cur.fetchone() is None:
-        cur.execute(
-            "ALTER TABLE ordens_pagamento ADD COLUMN despesa_id INTEGER REFERENCES despesas_cadastro(id)"
-        )
-
-    cur.execute(
-        """
-        SELECT 1 FROM information_schema.columns
-         WHERE table_name='ordens_pagamento' AND column_name='origem_id'
-        """
-    )
-    if cur.fetchone() is None:
-        cur.execute(
-            "ALTER TABLE ordens_pagamento ADD COLUMN origem_id INTEGER REFERENCES origens_cadastro(id)"
-        )
-    # Itens de produtos da OP
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS ordem_pagamento_itens (
-            id SERIAL PRIMARY KEY,
-            ordem_id INTEGER NOT NULL REFERENCES ordens_pagamento(id) ON DELETE CASCADE,
-            codigo_produto VARCHAR(50),
-            descricao_produto TEXT,
-            quantidade NUMERIC(12,2) NOT NULL DEFAULT 0,
-            valor_unitario NUMERIC(12,2) NOT NULL DEFAULT 0,
-            valor_desconto NUMERIC(12,2) NOT NULL DEFAULT 0,
-            valor_total NUMERIC(12,2) NOT NULL DEFAULT 0
-        )
-        """
-    )
-    # Parcelas (títulos) da OP
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS ordem_pagamento_parcelas (
-            id SERIAL PRIMARY KEY,
-            ordem_id INTEGER NOT NULL REFERENCES ordens_pagamento(id) ON DELETE CASCADE,
-            numero INTEGER,
-            data_vencimento DATE NOT NULL,
-            valor NUMERIC(12,2) NOT NULL DEFAULT 0
-        )
-        """
-    )
-    # Relacionamento com contas a pagar para evitar duplicidades
-    cur.execute(
-        "SELECT EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = 'contas_a_pagar')"
-    )
-    if cur.fetchone()[0]:
-        cur.execute(
-            """
-            SELECT 1 FROM information_schema.columns
-             WHERE table_name='contas_a_pagar' AND column_name='ordem_pagamento_id'
-            """
-        )
-        if cur.fetchone() is None:
-            cur.execute(
-                "ALTER TABLE contas_a_pagar ADD COLUMN ordem_pagamento_id INTEGER REFERENCES ordens_pagamento(id)"
-            )
-    conn.commit()
-    
-
-
-def ensure_dre_tables():
-    """Cria as tabelas de DRE caso não existam."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    # Mascaras
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS dre_mascaras (
-            id SERIAL PRIMARY KEY,
-            nome VARCHAR(255) NOT NULL,
-            descricao TEXT,
-            ordem INTEGER NOT NULL DEFAULT 0,
-            eh_formula BOOLEAN NOT NULL DEFAULT FALSE,
-            formula TEXT,
-            ativo BOOLEAN NOT NULL DEFAULT TRUE,
-            data_cadastro TIMESTAMP NOT NULL DEFAULT NOW()
-        )
-        """
-    )
-    # Commit imediato para garantir existência da tabela antes de tentar alterar
-    conn.commit()
-    # Garante coluna 'ordem' para bases já existentes (sem usar IF NOT EXISTS para compatibilidade)
-    try:
-        cur.execute(
-            "SELECT 1 FROM information_schema.columns WHERE table_name='dre_mascaras' AND column_name='ordem'"
-        )
-        tem_ordem = cur.fetchone() is not None
-        if not tem_ordem:
-            cur.execute("ALTER TABLE dre_mascaras ADD COLUMN ordem INTEGER NOT NULL DEFAULT 0")
-    except Exception:
-        # Evita transação abortada caso haja erro em ambiente legado
-        conn.rollback()
-
-    # Garante colunas de fórmula
-    try:
-        cur.execute(
-            "SELECT 1 FROM information_schema.columns WHERE table_name='dre_mascaras' AND column_name='eh_formula'"
-        )
-        tem_eh_formula = cur.fetchone() is not None
-        if not tem_eh_formula:
-            cur.execute("ALTER TABLE dre_mascaras ADD COLUMN eh_formula BOOLEAN NOT NULL DEFAULT FALSE")
-        cur.execute(
-            "SELECT 1 FROM information_schema.columns WHERE table_name='dre_mascaras' AND column_name='formula'"
-        )
-        tem_formula = cur.fetchone() is not None
-        if not tem_formula:
-            cur.execute("ALTER TABLE dre_mascaras ADD COLUMN formula TEXT")
-    except Exception:
-        conn.rollback()
-    
-    # Nós da máscara (hierarquia)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS dre_nos (
-            id SERIAL PRIMARY KEY,
-            mascara_id INTEGER NOT NULL REFERENCES dre_mascaras(id) ON DELETE CASCADE,
-            parent_id INTEGER REFERENCES dre_nos(id) ON DELETE CASCADE,
-            titulo VARCHAR(255) NOT NULL,
-            tipo VARCHAR(20) NOT NULL DEFAULT 'grupo',
-            ordem INTEGER NOT NULL DEFAULT 0,
-            CONSTRAINT dre_nos_tipo_chk CHECK (tipo IN ('grupo','receita','despesa'))
-        )
-        """
-    )
-    # Mapeamentos de categorias de receitas/despesas para nós
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS dre_no_receitas (
-            no_id INTEGER NOT NULL REFERENCES dre_nos(id) ON DELETE CASCADE,
-            receita_id INTEGER NOT NULL REFERENCES receitas_cadastro(id) ON DELETE CASCADE,
-            PRIMARY KEY (no_id, receita_id)
+            VALUES (%s, 'despesa', %s, %s)
+            """,
+            (
+                prestacao_id,
+                despesa["descricao"],
+                despesa["valor"].quantize(Decimal("0.01")),
+            ),
         )
-        """
-    )
+
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS dre_no_despesas (
-            no_id INTEGER NOT NULL REFERENCES dre_nos(id) ON DELETE CASCADE,
-            despesa_id INTEGER NOT NULL REFERENCES despesas_cadastro(id) ON DELETE CASCADE,
-            PRIMARY KEY (no_id, despesa_id)
-        )
-        """
+        UPDATE prestacoes_contas
+        SET status = 'Pendente',
+            conta_pagar_id = NULL,
+            conta_receber_id = NULL,
+            atualizado_em = NOW()
+        WHERE id = %s
+        """,
+        (prestacao_id,),
     )
-    conn.commit()
-    cur.close()
-    conn.close()
 
+    return {
+        "prestacao_id": prestacao_id,
+        "totais": {
+            "total_creditos": total_creditos,
+            "total_debitos": total_debitos,
+            "total_despesas": total_despesas,
+            "saldo_final": saldo_final,
+        },
+        "conta_pagar_id": None,
+        "conta_receber_id": None,
+    }
+
+
+def gerar_contas_financeiras_prestacao(cur, prestacao, contrato):
+    """Cria contas financeiras para a prestação ao aprovar."""
 
-ensure_dre_tables()
-ensure_ordens_pagamento_tables()
+    conta_pagar_id = prestacao.get("conta_pagar_id")
+    conta_receber_id = prestacao.get("conta_receber_id")
+    if conta_pagar_id or conta_receber_id:
+        return conta_pagar_id, conta_receber_id
 
+    saldo_final = prestacao.get("saldo_final")
+    if saldo_final is None:
+        return None, None
 
-def ensure_column_exists(cur, table_name, column_name, definition_sql):
-    """Create a column if it is missing.
+    saldo_final = Decimal(str(saldo_final)).quantize(Decimal("0.01"))
+    if saldo_final == 0:
+        return None, None
 
-    Older versions of PostgreSQL used in some environments do not support
-    ``ADD COLUMN IF NOT EXISTS``. To keep compatibility we check the
-    ``information_schema`` before attempting to add a column. The
-    ``definition_sql`` parameter should contain only the column definition
-    (type, constraints, defaults, etc.).
-    """
+    observacoes = prestacao.get("observacoes")
+    data_encerramento = prestacao.get("data_encerramento")
+    if isinstance(data_encerramento, datetime):
+        data_encerramento = data_encerramento.date()
+
+    titulo = f"Prestação de contas contrato #{contrato['id']}"
+
+    if saldo_final > 0:
+        despesa_id = get_or_create_categoria(cur, "despesas_cadastro", PRESTACAO_DESPESA_DESCR)
+        cur.execute(
+            """
+            INSERT INTO contas_a_pagar (
+                despesa_id, fornecedor_id, titulo, data_vencimento, competencia,
+                valor_previsto, valor_pendente, observacao, status_conta
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'Aberta')
+            RETURNING id
+            """,
+            (
+                despesa_id,
+                contrato["cliente_id"],
+                titulo,
+                data_encerramento,
+                data_encerramento,
+                saldo_final,
+                saldo_final,
+                observacoes if observacoes else None,
+            ),
+        )
+        conta_pagar_id = cur.fetchone()[0]
+        return conta_pagar_id, None
 
+    receita_id = get_or_create_categoria(cur, "receitas_cadastro", PRESTACAO_RECEITA_DESCR)
+    valor_receber = abs(saldo_final)
     cur.execute(
         """
-        SELECT 1
-        FROM information_schema.columns
-        WHERE table_name = %s AND column_name = %s
+        INSERT INTO contas_a_receber (
+            contrato_id, receita_id, cliente_id, titulo, data_vencimento,
+            valor_previsto, valor_pendente, observacao, status_conta
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'Aberta')
+        RETURNING id
         """,
-        (table_name, column_name),
+        (
+            contrato["id"],
+            receita_id,
+            contrato["cliente_id"],
+            titulo,
+            data_encerramento,
+            valor_receber,
+            valor_receber,
+            observacoes if observacoes else None,
+        ),
     )
-    if cur.fetchone():
-        return
+    conta_receber_id = cur.fetchone()[0]
+    return None, conta_receber_id
 
-    cur.execute(
-        sql.SQL("ALTER TABLE {} ADD COLUMN {} {}").format(
-            sql.Identifier(table_name),
-            sql.Identifier(column_name),
-            sql.SQL(definition_sql),
-        )
-    )
 
+def format_currency(value):
+    try:
+        return f"R$ {float(value):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    except (TypeError, ValueError):
+        return "R$ 0,00"
 
 
-def ensure_pessoas_responsavel_columns():
-    """Ensure the pessoas table exposes the responsavel_* columns."""
+app.jinja_env.filters["currency"] = format_currency
 
-    conn = None
-    cur = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        for column, definition in [
-            ("responsavel_nome", "VARCHAR(255)"),
-            ("responsavel_cpf", "VARCHAR(14)"),
-            ("responsavel_endereco", "VARCHAR(255)"),
-            ("responsavel_bairro", "VARCHAR(100)"),
-            ("responsavel_cidade", "VARCHAR(100)"),
-            ("responsavel_estado", "VARCHAR(100)"),
-            ("responsavel_uf", "CHAR(2)"),
-            ("responsavel_estado_civil", "VARCHAR(50)"),
-        ]:
-            ensure_column_exists(cur, "pessoas", column, definition)
-        conn.commit()
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
 
+def add_months(date_obj, months):
+    """Retorna a data acrescida do número de meses informado."""
+    month = date_obj.month - 1 + months
+    year = date_obj.year + month // 12
+    month = month % 12 + 1
+    day = min(date_obj.day, calendar.monthrange(year, month)[1])
+    return date_obj.replace(year=year, month=month, day=day)
 
-ensure_pessoas_responsavel_columns()
 
+def calcular_status_conta(data_vencimento, data_pagamento, contrato_id, cur):
+    if data_pagamento:
+        return "Paga"
+    data_venc = datetime.strptime(data_vencimento, "%Y-%m-%d").date()
+    status = "Vencida" if data_venc < datetime.today().date() else "Aberta"
+    if contrato_id:
+        cur.execute(
+            "SELECT status_contrato FROM contratos_aluguel WHERE id = %s",
+            (contrato_id,),
+        )
+        contrato = cur.fetchone()
+        if (
+            contrato
+            and contrato.get("status_contrato") in {"Encerrado", "Finalizado", "Renovar"}
+            and status == "Aberta"
+        ):
+            status = "Cancelada"
+    return status
 
-def ensure_usuarios_foto_column():
-    conn = None
-    cur = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        ensure_column_exists(cur, "usuarios", "foto_perfil", "VARCHAR(255)")
-        conn.commit()
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
 
+def atualizar_status_contas_a_receber(cur):
+    """Marca como vencidos os títulos em aberto cujo vencimento já passou.
 
-ensure_usuarios_foto_column()
+    ``status_conta`` e ``valor_pendente`` são calculados na gravação pela
+    trigger ``trg_contas_a_receber_status``; resta apenas a virada diária
+    de 'Aberta' para 'Vencida', que usa o índice (status_conta, data_vencimento).
+    """
+    cur.execute(
+        """
+        UPDATE contas_a_receber
+           SET status_conta = 'Vencida'::status_conta_enum
+         WHERE status_conta = 'Aberta'::status_conta_enum
+           AND data_vencimento < CURRENT_DATE
+        """
+    )
 
 
-def ensure_contas_a_pagar_columns():
-    """Guarantee contas_a_pagar exposes valor_pendente and is backfilled."""
+def atualizar_status_contas_a_pagar(cur):
+    """Virada diária de 'Aberta' para 'Vencida' em contas a pagar (ver trigger)."""
+    cur.execute(
+        """
+        UPDATE contas_a_pagar
+           SET status_conta = 'Vencida'::status_conta_enum
+         WHERE status_conta = 'Aberta'::status_conta_enum
+           AND data_vencimento < CURRENT_DATE
+           AND data_pagamento IS NULL
+        """
+    )
 
-    conn = None
-    cur = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        ensure_column_exists(
-            cur,
-            "contas_a_pagar",
-            "valor_pendente",
-            "NUMERIC(10,2) DEFAULT 0",
-        )
-        cur.execute(
-            """
-            UPDATE contas_a_pagar
-               SET valor_pendente = GREATEST(valor_previsto - COALESCE(valor_pago, 0), 0)
-            """
-        )
-        conn.commit()
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+def atualizar_status_contratos(cur):
+    cur.execute(
+        """
+        UPDATE contratos_aluguel
+           SET status_contrato = 'Renovar'::status_contrato_enum
+         WHERE data_fim < CURRENT_DATE
+           AND status_contrato IN ('Ativo', 'Pendente')
+        """
+    )
 
 
-ensure_contas_a_pagar_columns()
+# Tarefas diárias executadas pelo agendador (fora do ciclo das requisições)
+agendador.registrar_tarefa("status_contratos", atualizar_status_contratos)
+agendador.registrar_tarefa("status_contas_a_receber", atualizar_status_contas_a_receber)
+agendador.registrar_tarefa("status_contas_a_pagar", atualizar_status_contas_a_pagar)
+agendador.registrar_tarefa("particoes_auditoria", auditoria.criar_particoes)
 
 
-def ensure_prestacao_enum_credito_extra(conn):
-    """Ensure the enum prestacao_item_tipo includes required values for prestacao de contas."""
-    with conn.cursor() as cur:
-        cur.execute("SELECT 1 FROM pg_type WHERE typname = 'prestacao_item_tipo'")
-        type_exists = cur.fetchone() is not None
-    if not type_exists:
-        return
+@app.cli.command("tarefas-diarias")
+@click.option("--forcar", is_flag=True, help="Executa mesmo que já tenham rodado hoje.")
+def tarefas_diarias_command(forcar):
+    """Executa as tarefas diárias de atualização de status."""
+    resultado = agendador.executar_tarefas(get_db_connection, forcar=forcar)
+    if resultado["status"] == "ocupado":
+        click.echo("Outro processo está executando as tarefas diárias.")
+    elif resultado["executadas"]:
+        click.echo("Tarefas executadas: " + ", ".join(resultado["executadas"]))
+    else:
+        click.echo("Nenhuma tarefa pendente para hoje.")
 
-    required_values = {"credito_extra", "debito_cancelado"}
-    existing_values = set()
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT e.enumlabel
-            FROM pg_enum e
-            JOIN pg_type t ON e.enumtypid = t.oid
-            WHERE t.typname = 'prestacao_item_tipo'
-        """)
-        existing_values = {row[0] for row in cur.fetchall()}
-    missing = sorted(required_values - existing_values)
-    if not missing:
-        return
 
-    conn.commit()
-    previous_autocommit = conn.autocommit
-    try:
-        conn.autocommit = True
-        with conn.cursor() as cur:
-            for value in missing:
-                try:
-                    cur.execute(f"ALTER TYPE prestacao_item_tipo ADD VALUE '{value}'")
-                except DuplicateObject:
-                    pass
-    finally:
-        conn.autocommit = previous_autocommit
+@app.before_request
+def iniciar_agendador_diario():
+    # A thread é iniciada na primeira requisição de cada processo para não
+    # disputar o lock com comandos da CLI (que também importam o app).
+    if SCHEDULER_ENABLED:
+        agendador.iniciar_agendador(get_db_connection, SCHEDULER_POLL_INTERVAL)
 
-def ensure_prestacao_contas_tables():
-    conn = None
-    cur = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            DO $$
-            BEGIN
-                IF NOT EXISTS (
-                    SELECT 1 FROM pg_type WHERE typname = 'prestacao_item_tipo'
-                ) THEN
-                    CREATE TYPE prestacao_item_tipo AS ENUM ('credito', 'debito', 'despesa');
-                END IF;
-            END$$;
-            """
-        )
-        cur.close()
-        # Ensure new enum value exists outside transactional context
-        ensure_prestacao_enum_credito_extra(conn)
-        cur = conn.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS prestacoes_contas (
-                id SERIAL PRIMARY KEY,
-                contrato_id INTEGER NOT NULL REFERENCES contratos_aluguel(id) ON DELETE CASCADE,
-                data_encerramento DATE NOT NULL,
-                total_creditos NUMERIC(10,2) NOT NULL DEFAULT 0,
-                total_debitos NUMERIC(10,2) NOT NULL DEFAULT 0,
-                total_despesas NUMERIC(10,2) NOT NULL DEFAULT 0,
-                saldo_final NUMERIC(10,2) NOT NULL DEFAULT 0,
-                observacoes TEXT,
-                conta_pagar_id INTEGER REFERENCES contas_a_pagar(id),
-                conta_receber_id INTEGER REFERENCES contas_a_receber(id),
-                criado_em TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
-                atualizado_em TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
-            )
-            """
-        )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS prestacoes_contas_itens (
-                id SERIAL PRIMARY KEY,
-                prestacao_id INTEGER NOT NULL REFERENCES prestacoes_contas(id) ON DELETE CASCADE,
-                conta_receber_id INTEGER REFERENCES contas_a_receber(id),
-                tipo prestacao_item_tipo NOT NULL,
-                descricao TEXT NOT NULL,
-                valor NUMERIC(10,2) NOT NULL DEFAULT 0,
-                status_original status_conta_enum,
-                valor_pago_original NUMERIC(10,2),
-                valor_pendente_original NUMERIC(10,2),
-                data_pagamento_original DATE
-            )
-            """
-        )
 
-        for table_name, column_name, definition in [
-            (
-                "prestacoes_contas",
-                "status",
-                "VARCHAR(20) NOT NULL DEFAULT 'Pendente'",
-            ),
-            (
-                "prestacoes_contas",
-                "conta_pagar_id",
-                "INTEGER REFERENCES contas_a_pagar(id)",
-            ),
-            (
-                "prestacoes_contas",
-                "conta_receber_id",
-                "INTEGER REFERENCES contas_a_receber(id)",
-            ),
-            (
-                "prestacoes_contas",
-                "atualizado_em",
-                "TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()",
-            ),
-            (
-                "prestacoes_contas_itens",
-                "status_original",
-                "status_conta_enum",
-            ),
-            (
-                "prestacoes_contas_itens",
-                "valor_pago_original",
-                "NUMERIC(10,2)",
-            ),
-            (
-                "prestacoes_contas_itens",
-                "valor_pendente_original",
-                "NUMERIC(10,2)",
-            ),
-            (
-                "prestacoes_contas_itens",
-                "data_pagamento_original",
-                "DATE",
-            ),
-        ]:
-            ensure_column_exists(cur, table_name, column_name, definition)
-        cur.execute(
-            """
-            UPDATE prestacoes_contas
-            SET status = 'Aprovada'
-            WHERE status = 'Pendente'
-              AND (conta_pagar_id IS NOT NULL OR conta_receber_id IS NOT NULL)
-            """
+@app.before_request
+def iniciar_recalculo_posicoes():
+    # Recalcula em segundo plano as posições marcadas pelos lançamentos
+    if POSICOES_RECALC_INTERVAL > 0:
+        recalculo_posicoes.iniciar_recalculo(
+            app, POSICOES_RECALC_INTERVAL, POSICOES_RECALC_ESPERA
         )
-        conn.commit()
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
-
-
-ensure_prestacao_contas_tables()
 
 
 @app.route("/uploads/<path:filename>")
@@ -2818,9 +2360,6 @@ def index():
 def dashboard():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    atualizar_status_contas_a_receber(cur)
-    atualizar_status_contas_a_pagar(cur)
-    conn.commit()
     cur.execute(
         "SELECT COUNT(*), COALESCE(SUM(valor_previsto), 0) FROM contas_a_receber WHERE status_conta = 'Vencida'"
     )
@@ -6647,9 +6186,6 @@ def contratos_titulos(id):
         if cur.fetchone() is None:
             return jsonify({"error": "Contrato nao encontrado."}), 404
 
-        atualizar_status_contas_a_receber(cur)
-        conn.commit()
-
         cur.execute(
             """
             SELECT id, titulo, data_vencimento, valor_previsto, valor_pago, valor_pendente, status_conta
@@ -6735,8 +6271,6 @@ def contratos_encerrar(id):
                 data_encerramento,
                 prestacao_payload,
             )
-        else:
-            atualizar_status_contas_a_receber(cur)
 
         cur.execute(
             """
@@ -7163,8 +6697,6 @@ def contrato_info(contrato_id):
 def contas_a_receber_list():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    atualizar_status_contas_a_receber(cur)
-    conn.commit()
     # Coleta filtros (GET)
     venc_inicio = request.args.get("venc_inicio")
     venc_fim = request.args.get("venc_fim")
@@ -7344,8 +6876,6 @@ def contas_a_receber_add():
 def contas_a_receber_view(id):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    atualizar_status_contas_a_receber(cur)
-    conn.commit()
     cur.execute(
         """
         SELECT cr.*, p.razao_social_nome AS cliente, r.descricao AS receita, o.descricao AS origem
@@ -7437,8 +6967,6 @@ def contas_a_receber_edit(id):
         except Exception as e:
             conn.rollback()
             flash(f"Erro ao atualizar conta: {e}", "danger")
-    atualizar_status_contas_a_receber(cur)
-    conn.commit()
     cur.execute("SELECT * FROM contas_a_receber WHERE id = %s", (id,))
     conta = cur.fetchone()
     cur.execute("SELECT id, descricao FROM receitas_cadastro ORDER BY descricao")
@@ -7469,8 +6997,6 @@ def contas_a_receber_edit(id):
 def contas_a_receber_ajustar_vencimentos():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    atualizar_status_contas_a_receber(cur)
-    conn.commit()
 
     def carregar_titulos(cliente_id):
         cur.execute(
@@ -7559,7 +7085,6 @@ def contas_a_receber_ajustar_vencimentos():
                         "UPDATE contas_a_receber SET data_vencimento=%s WHERE id=%s",
                         (nova_data, titulo_id),
                     )
-                atualizar_status_contas_a_receber(cur)
                 conn.commit()
                 flash(
                     f"Vencimentos atualizados para {len(atualizacoes)} titulo(s).",
@@ -8075,8 +7600,6 @@ def contas_a_receber_replicar(id):
 def contas_a_receber_pagar(id):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    atualizar_status_contas_a_receber(cur)
-    conn.commit()
     cur.execute(
         """
         SELECT cr.*, p.razao_social_nome AS cliente_nome
@@ -8169,8 +7692,6 @@ def contas_a_receber_pagar(id):
 def contas_a_pagar_list():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    atualizar_status_contas_a_pagar(cur)
-    conn.commit()
 
     # Filtros
     data_inicio = request.args.get("data_inicio")
@@ -8350,8 +7871,6 @@ def contas_a_pagar_add():
 def contas_a_pagar_view(id):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    atualizar_status_contas_a_pagar(cur)
-    conn.commit()
     cur.execute(
         """
         SELECT cp.*, p.razao_social_nome AS fornecedor, d.descricao AS despesa,
@@ -8624,8 +8143,6 @@ def contas_a_pagar_replicar(id):
 def contas_a_pagar_pagar(id):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    atualizar_status_contas_a_pagar(cur)
-    conn.commit()
     cur.execute(
         """
         SELECT cp.*, p.razao_social_nome AS fornecedor
@@ -10238,8 +9755,12 @@ def banco_importar_cnab(conta_id):
     if not arquivo:
         flash("Selecione um arquivo CNAB.", "danger")
     else:
-        resultados = importar_cnab(arquivo, conta_id, "banco")
-        flash(f"{len(resultados)} lançamentos importados.", "success")
+        try:
+            resultados = importar_cnab(arquivo, conta_id, "banco")
+        except ArquivoJaProcessado as e:
+            flash(str(e), "warning")
+        else:
+            flash(f"{len(resultados)} lançamentos importados.", "success")
     return redirect(url_for("bancos_list"))
 
 
@@ -10379,6 +9900,7 @@ def cobrancas_delete(id):
 @login_required
 @permission_required("Posicoes", "Consultar")
 def posicoes_list():
+    processar_posicoes_pendentes()
     posicoes = PosicaoDiaria.query.order_by(PosicaoDiaria.data.desc()).all()
     contas_caixa = {c.id: c.nome for c in ContaCaixa.query.all()}
     contas_banco = {
@@ -10569,7 +10091,6 @@ def carregar_dados_relatorio_contas_pagar(form):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=extras.DictCursor)
     try:
-        atualizar_status_contas_a_pagar(cur)
         dados = consultar_relatorio_contas_pagar(
             cur,
             data_inicio,
@@ -11939,7 +11460,6 @@ def relatorio_contas_a_pagar_periodo():
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=extras.DictCursor)
-    atualizar_status_contas_a_pagar(cur)
 
     query = (
         "SELECT cp.id, cp.titulo, p.razao_social_nome AS fornecedor, d.descricao AS despesa, "
@@ -12593,6 +12113,9 @@ def relatorio_financeiro_fluxo_caixa():
     caixas_ids = [int(x) for x in request.form.getlist("caixas_ids") if str(x).strip()]
     bancos_ids = [int(x) for x in request.form.getlist("bancos_ids") if str(x).strip()]
 
+    # O saldo inicial vem das posições diárias: aplica os recálculos pendentes
+    processar_posicoes_pendentes()
+
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=extras.DictCursor)
 
@@ -12739,6 +12262,9 @@ def relatorio_financeiro_fluxo_caixa_visualizar():
     caixas_ids = [int(x) for x in request.form.getlist("caixas_ids") if str(x).strip()]
     bancos_ids = [int(x) for x in request.form.getlist("bancos_ids") if str(x).strip()]
 
+    # O saldo inicial vem das posições diárias: aplica os recálculos pendentes
+    processar_posicoes_pendentes()
+
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=extras.DictCursor)
 
@@ -15038,6 +14564,7 @@ def usuarios_edit(id):
                     (username, tipo, status, foto_path, id),
                 )
             conn.commit()
+            invalidate_user_permissions(id)
             if new_photo_path and previous_photo and previous_photo != new_photo_path:
                 remove_uploaded_file(previous_photo)
             if id == session.get("user_id"):
@@ -15071,6 +14598,7 @@ def usuarios_delete(id):
         row = cur.fetchone()
         cur.execute("DELETE FROM usuarios WHERE id = %s", (id,))
         conn.commit()
+        invalidate_user_permissions(id)
         if row and row[0]:
             remove_uploaded_file(row[0])
         flash("Usuário excluído com sucesso!", "success")
@@ -15100,6 +14628,7 @@ def usuarios_permissoes(id):
                         (id, module, action),
                     )
         conn.commit()
+        invalidate_user_permissions(id)
         flash("Permissões atualizadas com sucesso!", "success")
 
     cur.execute("SELECT modulo, acao FROM permissoes WHERE usuario_id = %s", (id,))
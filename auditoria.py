@@ -0,0 +1,297 @@
+"""Gravação assíncrona, em lotes, do log de auditoria (``auditoria_logs``).
+
+``log_user_action`` apenas enfileira o registro; uma thread em segundo plano
+grava os registros acumulados com um único INSERT de várias linhas a cada
+``intervalo`` segundos ou a cada ``tamanho_lote`` registros, o que ocorrer
+primeiro. A fila é limitada: quando está cheia o registro é gravado de forma
+síncrona, para não perder eventos nem crescer a memória sem limite. Ao
+encerrar o processo (``atexit``) a fila é esvaziada.
+
+A tabela é particionada por mês (``auditoria_logs_AAAAMM``, ver
+``migrations/023_auditoria_logs_particionada.sql``). ``criar_particoes``
+roda diariamente no agendador e ``aplicar_retencao`` desanexa (e
+opcionalmente arquiva) as partições antigas.
+"""
+
+from __future__ import annotations
+
+import atexit
+import gzip
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import date, datetime, timezone
+from typing import Callable, List, Optional, Sequence, Tuple
+
+COLUNAS = ("user_id", "username", "modulo", "acao", "descricao", "ip", "criado_em")
+
+Registro = Tuple[object, ...]
+
+logger = logging.getLogger(__name__)
+
+# Marcador colocado na fila por ``parar`` para encerrar a thread
+_FIM = object()
+
+_PARTICAO = re.compile(r"^auditoria_logs_(\d{4})(\d{2})$")
+
+
+def novo_registro(user_id, username, modulo, acao, descricao, ip) -> Registro:
+    """Monta o registro com o horário do evento (não o da gravação)."""
+    return (user_id, username, modulo, acao, descricao, ip, datetime.now(timezone.utc))
+
+
+def gravar_registros(get_connection: Callable, registros: Sequence[Registro]) -> None:
+    """Grava os registros com um único INSERT de várias linhas."""
+    if not registros:
+        return
+    linha = "(" + ", ".join(["%s"] * len(COLUNAS)) + ")"
+    comando = (
+        f"INSERT INTO auditoria_logs ({', '.join(COLUNAS)}) VALUES "
+        + ", ".join([linha] * len(registros))
+    )
+    parametros = [valor for registro in registros for valor in registro]
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(comando, parametros)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+class GravadorAuditoria:
+    """Fila limitada drenada por uma thread que grava os registros em lotes.
+
+    ``get_connection`` deve devolver uma conexão própria (do pool), nunca a
+    conexão compartilhada da requisição, pois o gravador faz commit.
+    """
+
+    def __init__(
+        self,
+        get_connection: Callable,
+        *,
+        tamanho_lote: int = 100,
+        intervalo: float = 0.2,
+        capacidade: int = 10000,
+    ) -> None:
+        self.get_connection = get_connection
+        self.tamanho_lote = max(int(tamanho_lote), 1)
+        self.intervalo = float(intervalo)
+        self._fila: "queue.Queue[Registro]" = queue.Queue(maxsize=max(int(capacidade), 1))
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def registrar(self, registro: Registro) -> None:
+        """Enfileira o registro; com a fila cheia grava na hora."""
+        self._garantir_thread()
+        try:
+            self._fila.put_nowait(registro)
+        except queue.Full:
+            logger.warning("Fila de auditoria cheia; gravando registro de forma síncrona")
+            self._gravar([registro])
+
+    def esvaziar(self) -> None:
+        """Bloqueia até que todos os registros enfileirados sejam gravados."""
+        if self._thread is None or not self._thread.is_alive():
+            self._drenar()
+            return
+        self._fila.join()
+
+    def parar(self, timeout: float = 5.0) -> None:
+        """Encerra a thread gravando o que ainda estiver na fila."""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            try:
+                self._fila.put(_FIM, timeout=timeout)
+            except queue.Full:
+                pass
+            thread.join(timeout)
+        self._drenar()
+
+    def _garantir_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._executar, name="gravador-auditoria", daemon=True
+            )
+            self._thread.start()
+
+    def _executar(self) -> None:
+        fim = False
+        while not fim:
+            primeiro = self._fila.get()
+            if primeiro is _FIM:
+                self._fila.task_done()
+                return
+            lote = [primeiro]
+            limite = time.monotonic() + self.intervalo
+            while len(lote) < self.tamanho_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    item = self._fila.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if item is _FIM:
+                    self._fila.task_done()
+                    fim = True
+                    break
+                lote.append(item)
+            try:
+                self._gravar(lote)
+            finally:
+                for _ in lote:
+                    self._fila.task_done()
+
+    def _drenar(self) -> None:
+        """Grava, na thread atual, o que restou na fila."""
+        while True:
+            lote: List[Registro] = []
+            while len(lote) < self.tamanho_lote:
+                try:
+                    item = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _FIM:
+                    self._fila.task_done()
+                    continue
+                lote.append(item)
+            if not lote:
+                return
+            try:
+                self._gravar(lote)
+            finally:
+                for _ in lote:
+                    self._fila.task_done()
+
+    def _gravar(self, lote: Sequence[Registro]) -> None:
+        try:
+            gravar_registros(self.get_connection, lote)
+        except Exception:
+            logger.exception("Erro ao gravar %d registro(s) de auditoria", len(lote))
+
+
+_gravador: Optional[GravadorAuditoria] = None
+
+
+def iniciar_gravador(get_connection: Callable, **opcoes) -> GravadorAuditoria:
+    """Cria o gravador do processo e agenda o esvaziamento da fila na saída."""
+    global _gravador
+    if _gravador is None:
+        _gravador = GravadorAuditoria(get_connection, **opcoes)
+        atexit.register(_gravador.parar)
+    return _gravador
+
+
+def _somar_meses(mes: date, meses: int) -> date:
+    indice = mes.year * 12 + mes.month - 1 + meses
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def criar_particoes(cur, meses_a_frente: int = 2) -> None:
+    """Garante as partições do mês corrente e dos próximos meses."""
+    inicio = date.today().replace(day=1)
+    for deslocamento in range(meses_a_frente + 1):
+        cur.execute(
+            "SELECT auditoria_logs_criar_particao(%s)",
+            (_somar_meses(inicio, deslocamento),),
+        )
+
+
+def _particoes_por_mes(nomes) -> List[Tuple[str, date]]:
+    particoes = []
+    for nome in nomes:
+        encontrado = _PARTICAO.match(nome)
+        if encontrado:
+            particoes.append((nome, date(int(encontrado.group(1)), int(encontrado.group(2)), 1)))
+    return sorted(particoes, key=lambda particao: particao[1])
+
+
+def listar_particoes(cur) -> List[Tuple[str, date]]:
+    """Partições mensais anexadas a ``auditoria_logs``, da mais antiga à mais nova."""
+    cur.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'auditoria_logs'::regclass
+        """
+    )
+    return _particoes_por_mes(nome for (nome,) in cur.fetchall())
+
+
+def listar_particoes_desanexadas(cur) -> List[Tuple[str, date]]:
+    """Tabelas ``auditoria_logs_AAAAMM`` já desanexadas (por ``aplicar_retencao``)."""
+    cur.execute(
+        """
+        SELECT c.relname
+        FROM pg_class c
+        WHERE c.relkind = 'r'
+          AND NOT c.relispartition
+          AND c.relname ~ '^auditoria_logs_[0-9]{6}$'
+          AND c.relnamespace = (
+              SELECT relnamespace FROM pg_class WHERE oid = 'auditoria_logs'::regclass
+          )
+        """
+    )
+    return _particoes_por_mes(nome for (nome,) in cur.fetchall())
+
+
+def aplicar_retencao(
+    get_connection: Callable,
+    meses: int,
+    *,
+    pasta_arquivo: Optional[str] = None,
+    hoje: Optional[date] = None,
+) -> List[str]:
+    """Desanexa as partições anteriores aos últimos ``meses`` meses.
+
+    As partições desanexadas continuam no banco como tabelas comuns, fora
+    das consultas de ``auditoria_logs``. Com ``pasta_arquivo`` cada uma é
+    exportada para ``<pasta>/<particao>.csv.gz`` e então removida, inclusive
+    as que execuções anteriores, sem ``pasta_arquivo``, apenas desanexaram.
+    Retorna os nomes das partições processadas.
+    """
+    if meses < 1:
+        raise ValueError("A retenção deve ser de pelo menos um mês")
+    limite = _somar_meses((hoje or date.today()).replace(day=1), -meses)
+    if pasta_arquivo:
+        os.makedirs(pasta_arquivo, exist_ok=True)
+    conn = get_connection()
+    cur = conn.cursor()
+    processadas = []
+    try:
+        antigas = [(nome, mes, True) for nome, mes in listar_particoes(cur) if mes < limite]
+        if pasta_arquivo:
+            antigas += [
+                (nome, mes, False) for nome, mes in listar_particoes_desanexadas(cur) if mes < limite
+            ]
+            antigas.sort(key=lambda particao: particao[1])
+        for nome, _, anexada in antigas:
+            if anexada:
+                cur.execute(f'ALTER TABLE auditoria_logs DETACH PARTITION "{nome}"')
+            if pasta_arquivo:
+                destino = os.path.join(pasta_arquivo, f"{nome}.csv.gz")
+                with gzip.open(destino, "wt", encoding="utf-8") as arquivo:
+                    cur.copy_expert(f'COPY "{nome}" TO STDOUT WITH CSV HEADER', arquivo)
+                cur.execute(f'DROP TABLE "{nome}"')
+            conn.commit()
+            processadas.append(nome)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+    return processadas
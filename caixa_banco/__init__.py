@@ -7,8 +7,31 @@ from db_utils import decode_psycopg_unicode_error
 db = SQLAlchemy()
 
 
+def _pool_engine_options(app):
+    """Deriva as opções de pool do engine a partir de ``DB_POOL_*``.
+
+    Assim o SQLAlchemy respeita o mesmo limite de conexões por processo
+    usado por ``get_db_connection``. Todas as ``DB_POOL_MAX_SIZE`` conexões
+    ficam no pool (sem overflow, que o SQLAlchemy fecha na devolução). O
+    QueuePool não tem tempo de ociosidade: ``DB_POOL_IDLE_TIMEOUT`` vale
+    apenas para o pool do psycopg2. SQLite (testes) mantém o pool padrão.
+    """
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if uri.startswith('sqlite') or 'DB_POOL_MAX_SIZE' not in app.config:
+        return {}
+    return {
+        'pool_size': max(int(app.config['DB_POOL_MAX_SIZE']), 1),
+        'max_overflow': 0,
+        'pool_timeout': app.config.get('DB_POOL_CHECKOUT_TIMEOUT', 30),
+        'pool_pre_ping': True,
+    }
+
+
 def init_app(app):
     """Inicializa a extensão e registra as rotas."""
+    engine_options = dict(_pool_engine_options(app))
+    engine_options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
     db.init_app(app)
 
     # Importa e registra o blueprint apenas após init_app para evitar
@@ -16,7 +39,10 @@ def init_app(app):
     from .routes import bp as caixa_banco_bp
     app.register_blueprint(caixa_banco_bp, url_prefix="/api")
 
-    # Garante que as tabelas existam
+    # Garante que as tabelas existam. A aplicação principal desliga
+    # SCHEMA_AUTO_CREATE e cria as tabelas pelas migrações (flask migrar-banco).
+    if not app.config.get('SCHEMA_AUTO_CREATE', True):
+        return
     with app.app_context():
         try:
             db.create_all()
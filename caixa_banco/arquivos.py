@@ -0,0 +1,123 @@
+"""Registro dos arquivos bancários importados (extratos e retornos CNAB).
+
+Cada arquivo importado fica em ``arquivo_processado`` com o SHA-256 do seu
+conteúdo, e cada linha aproveitada em ``registro_processado``. Reenviar o
+mesmo arquivo é recusado antes da leitura (``ArquivoJaProcessado``); um
+arquivo que repete parte de outro processa apenas os registros inéditos.
+
+A chave de um registro é o hash da linha combinado com a ordem da sua
+ocorrência no arquivo, para que linhas idênticas dentro do mesmo arquivo
+continuem sendo registros distintos.
+"""
+
+import hashlib
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, ArquivoProcessado, RegistroProcessado
+
+_TAMANHO_BLOCO = 1024 * 1024
+# Quantidade de chaves consultadas por vez em ``registros_processados``
+_LOTE_CONSULTA = 1000
+
+
+class ArquivoJaProcessado(ValueError):
+    """O arquivo enviado já foi importado."""
+
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        super().__init__(
+            f"Arquivo já importado em {arquivo.processado_em:%d/%m/%Y %H:%M}"
+            + (f" ({arquivo.nome})" if arquivo.nome else '')
+        )
+
+
+def sha256_conteudo(origem):
+    """SHA-256 do conteúdo (texto, bytes, stream ou ``FileStorage``).
+
+    Streams são lidos em blocos e voltam ao início para a leitura seguinte.
+    """
+    if isinstance(origem, str):
+        return hashlib.sha256(origem.encode('utf-8')).hexdigest()
+    if isinstance(origem, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(origem).hexdigest()
+    stream = getattr(origem, 'stream', origem)
+    inicio = stream.tell()
+    digest = hashlib.sha256()
+    while True:
+        bloco = stream.read(_TAMANHO_BLOCO)
+        if not bloco:
+            break
+        digest.update(bloco.encode('utf-8') if isinstance(bloco, str) else bloco)
+    stream.seek(inicio)
+    return digest.hexdigest()
+
+
+def verificar_arquivo(tipo, sha256):
+    """Levanta ``ArquivoJaProcessado`` se o conteúdo já foi importado."""
+    arquivo = ArquivoProcessado.query.filter_by(tipo=tipo, sha256=sha256).first()
+    if arquivo is not None:
+        raise ArquivoJaProcessado(arquivo)
+
+
+class ChavesRegistros:
+    """Gera as chaves dos registros de um arquivo, na ordem de leitura."""
+
+    def __init__(self):
+        self._ocorrencias = {}
+
+    def chave(self, digest):
+        ocorrencia = self._ocorrencias.get(digest, 0)
+        self._ocorrencias[digest] = ocorrencia + 1
+        if not ocorrencia:
+            return digest
+        return hashlib.sha256(f'{digest}#{ocorrencia}'.encode('ascii')).hexdigest()
+
+
+def registros_processados(tipo, chaves):
+    """Subconjunto de ``chaves`` já registrado por importações anteriores."""
+    chaves = list(chaves)
+    encontradas = set()
+    for inicio in range(0, len(chaves), _LOTE_CONSULTA):
+        encontradas.update(
+            db.session.execute(
+                select(RegistroProcessado.chave).where(
+                    RegistroProcessado.tipo == tipo,
+                    RegistroProcessado.chave.in_(chaves[inicio:inicio + _LOTE_CONSULTA]),
+                )
+            ).scalars()
+        )
+    return encontradas
+
+
+def registrar_arquivo(tipo, sha256, nome=None):
+    """Grava o arquivo no registro (sem commit) e o devolve.
+
+    Dois envios simultâneos do mesmo arquivo passam ambos por
+    ``verificar_arquivo``; o segundo esbarra na restrição única e também
+    recebe ``ArquivoJaProcessado``. O INSERT é feito num savepoint para que
+    a transação da requisição continue utilizável.
+    """
+    arquivo = ArquivoProcessado(tipo=tipo, sha256=sha256, nome=nome, registros=0)
+    try:
+        with db.session.begin_nested():
+            db.session.add(arquivo)
+    except IntegrityError:
+        existente = ArquivoProcessado.query.filter_by(tipo=tipo, sha256=sha256).first()
+        if existente is None:
+            raise
+        raise ArquivoJaProcessado(existente) from None
+    return arquivo
+
+
+def registrar_registros(arquivo, chaves):
+    """Grava as chaves dos registros aproveitados do arquivo (sem commit)."""
+    chaves = list(chaves)
+    if not chaves:
+        return
+    db.session.execute(
+        insert(RegistroProcessado),
+        [{'tipo': arquivo.tipo, 'chave': chave, 'arquivo_id': arquivo.id} for chave in chaves],
+    )
+    arquivo.registros = (arquivo.registros or 0) + len(chaves)
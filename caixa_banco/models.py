@@ -67,6 +67,11 @@ class MovimentoFinanceiro(db.Model):
     despesa_id = db.Column(db.Integer)
     receita_id = db.Column(db.Integer)
 
+    __table_args__ = (
+        db.Index('idx_movimento_origem_data', 'conta_origem_tipo', 'conta_origem_id', 'data_movimento'),
+        db.Index('idx_movimento_destino_data', 'conta_destino_tipo', 'conta_destino_id', 'data_movimento'),
+    )
+
 
 class Conciliacao(db.Model):
     __tablename__ = 'conciliacao'
@@ -93,4 +98,46 @@ class PosicaoDiaria(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('conta_id', 'conta_tipo', 'data', name='uq_posicao_conta_data'),
-    )
\ No newline at end of file
+    )
+
+
+class PosicaoPendente(db.Model):
+    """Conta com posições diárias a recalcular a partir de ``data_inicio``.
+
+    Os lançamentos apenas marcam (ou antecipam) a data; o recálculo é feito
+    uma vez por conta por ``processar_posicoes_pendentes``.
+    """
+
+    __tablename__ = 'posicao_pendente'
+
+    conta_tipo = db.Column(db.String(10), primary_key=True)  # 'caixa' ou 'banco'
+    conta_id = db.Column(db.Integer, primary_key=True)
+    data_inicio = db.Column(db.Date, nullable=False)
+    atualizado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ArquivoProcessado(db.Model):
+    """Arquivo bancário (extrato ou retorno) já importado, pelo SHA-256 do conteúdo."""
+
+    __tablename__ = 'arquivo_processado'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)  # 'extrato' ou 'retorno'
+    sha256 = db.Column(db.String(64), nullable=False)
+    nome = db.Column(db.String(255))
+    registros = db.Column(db.Integer, nullable=False, default=0)
+    processado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('tipo', 'sha256', name='uq_arquivo_processado_sha256'),
+    )
+
+
+class RegistroProcessado(db.Model):
+    """Registro (linha) de arquivo bancário já importado."""
+
+    __tablename__ = 'registro_processado'
+
+    tipo = db.Column(db.String(20), primary_key=True)
+    chave = db.Column(db.String(64), primary_key=True)
+    arquivo_id = db.Column(db.Integer, db.ForeignKey('arquivo_processado.id'), nullable=False)
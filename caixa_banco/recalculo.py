@@ -0,0 +1,61 @@
+"""Recálculo em segundo plano das posições diárias marcadas como pendentes.
+
+Os lançamentos (``criar_movimento`` e afins) apenas gravam em
+``posicao_pendente`` a menor data a recalcular de cada conta. Esta thread
+processa periodicamente as marcas que não mudaram nos últimos ``espera``
+segundos, de modo que uma sequência de lançamentos (baixa de vários títulos,
+importação de extrato) resulta em um único recálculo por conta. As telas que
+leem as posições chamam ``processar_posicoes_pendentes`` antes da consulta.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from .services import processar_posicoes_pendentes
+
+logger = logging.getLogger(__name__)
+
+
+class RecalculoPosicoes(threading.Thread):
+    """Thread que recalcula as posições das contas com marcas pendentes."""
+
+    def __init__(self, app, intervalo: float = 10.0, espera: float = 5.0) -> None:
+        super().__init__(name="recalculo-posicoes", daemon=True)
+        self.app = app
+        self.intervalo = intervalo
+        self.espera = espera
+        self._parar = threading.Event()
+
+    def executar_uma_vez(self) -> int:
+        limite = datetime.utcnow() - timedelta(seconds=self.espera)
+        with self.app.app_context():
+            return processar_posicoes_pendentes(ate=limite)
+
+    def run(self) -> None:
+        while not self._parar.wait(self.intervalo):
+            try:
+                quantidade = self.executar_uma_vez()
+            except Exception:
+                logger.exception("Falha ao recalcular as posições pendentes")
+            else:
+                if quantidade:
+                    logger.info("%d posições diárias recalculadas", quantidade)
+
+    def parar(self) -> None:
+        self._parar.set()
+
+
+_recalculo: Optional[RecalculoPosicoes] = None
+
+
+def iniciar_recalculo(app, intervalo: float = 10.0, espera: float = 5.0) -> RecalculoPosicoes:
+    """Inicia (uma única vez por processo) a thread de recálculo."""
+    global _recalculo
+    if _recalculo is None or not _recalculo.is_alive():
+        _recalculo = RecalculoPosicoes(app, intervalo, espera)
+        _recalculo.start()
+    return _recalculo
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from datetime import date
+from .arquivos import ArquivoJaProcessado
 from .models import db, ContaCaixa, ContaBanco, MovimentoFinanceiro
 from .services import criar_movimento, importar_cnab, recalcular_posicoes, calcular_saldos_atualizados
 
@@ -145,7 +146,10 @@ def importar_cnab_endpoint():
     if not arquivo or not conta_id or not conta_tipo:
         return jsonify({'error': 'arquivo, conta_id e conta_tipo são obrigatórios'}), 400
 
-    resultados = importar_cnab(arquivo, int(conta_id), conta_tipo)
+    try:
+        resultados = importar_cnab(arquivo, int(conta_id), conta_tipo)
+    except ArquivoJaProcessado as e:
+        return jsonify({'error': str(e)}), 409
     return jsonify(resultados), 201
 
 
@@ -1,265 +1,527 @@
-from datetime import datetime, date, timedelta
-from decimal import Decimal
-from io import StringIO
-from sqlalchemy import text, func, case
-from .models import db, ContaCaixa, ContaBanco, MovimentoFinanceiro, Conciliacao, PosicaoDiaria
-
-
-def _get_conta(tipo, conta_id):
-    if tipo == 'caixa':
-        return ContaCaixa.query.get(conta_id)
-    return ContaBanco.query.get(conta_id)
-
-
-def atualizar_saldo(tipo, conta_id, valor):
-    conta = _get_conta(tipo, conta_id)
-    if conta:
-        conta.saldo_atual = (conta.saldo_atual or Decimal('0')) + Decimal(valor)
-        db.session.commit()
-
-
-def criar_movimento(data):
-    movimento = MovimentoFinanceiro(**data)
-    db.session.add(movimento)
-    db.session.flush()  # garante id para conciliacoes
-
-    valor = movimento.valor
-    if movimento.tipo == 'entrada':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, valor)
-    elif movimento.tipo == 'saida':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, -valor)
-    elif movimento.tipo == 'transferencia':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, -valor)
-        if movimento.conta_destino_id:
-            atualizar_saldo(movimento.conta_destino_tipo, movimento.conta_destino_id, valor)
-
-    db.session.commit()
-    # Recalcula posições a partir da data do movimento
-    recalcular_posicoes(movimento.data_movimento)
-    return movimento
-
-
-def atualizar_movimento(movimento, data):
-    """Atualiza um movimento existente ajustando saldos."""
-    # Reverte efeito anterior
-    valor_antigo = movimento.valor
-    data_antiga = movimento.data_movimento
-    if movimento.tipo == 'entrada':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, -valor_antigo)
-    elif movimento.tipo == 'saida':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, valor_antigo)
-    elif movimento.tipo == 'transferencia':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, valor_antigo)
-        if movimento.conta_destino_id:
-            atualizar_saldo(movimento.conta_destino_tipo, movimento.conta_destino_id, -valor_antigo)
-
-    data_mov = data.get('data_movimento')
-    if isinstance(data_mov, str):
-        try:
-            data['data_movimento'] = datetime.strptime(data_mov, '%Y-%m-%d').date()
-        except ValueError:
-            data['data_movimento'] = data_antiga
-
-    for key, value in data.items():
-        setattr(movimento, key, value)
-    db.session.flush()
-
-    valor_novo = movimento.valor
-    if movimento.tipo == 'entrada':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, valor_novo)
-    elif movimento.tipo == 'saida':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, -valor_novo)
-    elif movimento.tipo == 'transferencia':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, -valor_novo)
-        if movimento.conta_destino_id:
-            atualizar_saldo(movimento.conta_destino_tipo, movimento.conta_destino_id, valor_novo)
-
-    db.session.commit()
-    # Recalcula posições a partir da menor data envolvida
-    data_ref = min(data_antiga, movimento.data_movimento)
-    recalcular_posicoes(data_ref)
-    return movimento
-
-
-def deletar_movimento(movimento):
-    """Exclui um movimento ajustando os saldos."""
-    valor = movimento.valor
-    if movimento.tipo == 'entrada':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, -valor)
-    elif movimento.tipo == 'saida':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, valor)
-    elif movimento.tipo == 'transferencia':
-        atualizar_saldo(movimento.conta_origem_tipo, movimento.conta_origem_id, valor)
-        if movimento.conta_destino_id:
-            atualizar_saldo(movimento.conta_destino_tipo, movimento.conta_destino_id, -valor)
-    # Se o movimento estiver vinculado a uma conta a receber, desfaz o pagamento
-    if movimento.documento and movimento.documento.startswith('CR-'):
-        try:
-            conta_id = int(movimento.documento.split('CR-')[1])
-        except ValueError:
-            conta_id = None
-        if conta_id:
-            db.session.execute(
-                text(
-                    """
-                    UPDATE contas_a_receber
-                       SET data_pagamento = NULL,
-                           valor_pago = NULL,
-                           valor_desconto = 0,
-                           valor_multa = 0,
-                           valor_juros = 0,
-                           valor_pendente = valor_previsto,
-                           status_conta = 'Aberta'
-                     WHERE id = :conta_id
-                    """
-                ),
-                {"conta_id": conta_id},
-            )
-    # Se o movimento estiver vinculado a uma conta a pagar, desfaz o pagamento
-    if movimento.documento and movimento.documento.startswith('CP-'):
-        try:
-            conta_id = int(movimento.documento.split('CP-')[1])
-        except ValueError:
-            conta_id = None
-        if conta_id:
-            db.session.execute(
-                text(
-                    """
-                    UPDATE contas_a_pagar
-                       SET data_pagamento = NULL,
-                           valor_pago = NULL,
-                           valor_desconto = 0,
-                           valor_multa = 0,
-                           valor_juros = 0,
-                           status_conta = 'Aberta'
-                     WHERE id = :conta_id
-                    """
-                ),
-                {"conta_id": conta_id},
-            )
-    data_ref = movimento.data_movimento
-    db.session.delete(movimento)
-    db.session.commit()
-    # Recalcula posições após exclusão
-    recalcular_posicoes(data_ref)
-
-
-def parse_cnab240(content):
-    """Parse simplificado de CNAB240. Retorna lista de dicts com data e valor."""
-    registros = []
-    for line in StringIO(content).read().splitlines():
-        if len(line) < 160:
-            continue
-        try:
-            data = datetime.strptime(line[143:151], '%Y%m%d').date()
-            valor = int(line[152:167]) / 100.0
-            registros.append({'data_movimento': data, 'valor': valor, 'historico': line[70:90].strip()})
-        except Exception:
-            continue
-    return registros
-
-
-def importar_cnab(file_storage, conta_id, conta_tipo):
-    content = file_storage.read().decode('utf-8', errors='ignore')
-    registros = parse_cnab240(content)
-    resultados = []
-    for r in registros:
-        existente = MovimentoFinanceiro.query.filter_by(
-            data_movimento=r['data_movimento'], valor=r['valor']
-        ).first()
-        if existente:
-            conciliacao = Conciliacao(movimento=existente, arquivo_lancamento=file_storage.filename, status='conciliado', data_conciliacao=datetime.utcnow())
-            db.session.add(conciliacao)
-            resultados.append({'movimento_id': existente.id, 'status': 'conciliado'})
-        else:
-            dados = {
-                'conta_origem_id': conta_id,
-                'conta_origem_tipo': conta_tipo,
-                'data_movimento': r['data_movimento'],
-                'tipo': 'entrada',
-                'valor': r['valor'],
-                'categoria': 'CNAB',
-                'historico': r.get('historico')
-            }
-            movimento = criar_movimento(dados)
-            conciliacao = Conciliacao(movimento=movimento, arquivo_lancamento=file_storage.filename, status='conciliado', data_conciliacao=datetime.utcnow())
-            db.session.add(conciliacao)
-            resultados.append({'movimento_id': movimento.id, 'status': 'conciliado'})
-    db.session.commit()
-    return resultados
-
-
-def recalcular_posicoes(data_inicio=None):
-    """Recalcula as posições diárias a partir de uma data."""
+from datetime import datetime, date
+from decimal import Decimal
+from sqlalchemy import bindparam, case, delete, func, insert, select, text, update
+from cnab240 import LancamentoExtrato, ler_registros
+from .arquivos import (
+    ChavesRegistros,
+    registrar_arquivo,
+    registrar_registros,
+    registros_processados,
+    sha256_conteudo,
+    verificar_arquivo,
+)
+from .models import db, ContaCaixa, ContaBanco, MovimentoFinanceiro, Conciliacao, PosicaoPendente
+
+
+def efeitos_no_saldo(movimento, sinal=1):
+    """Variação do saldo de cada conta ``(tipo, id)`` causada pelo movimento.
+
+    Entradas creditam a origem, saídas a debitam e transferências debitam a
+    origem e creditam o destino. ``sinal=-1`` devolve o estorno.
+    """
+    valor = Decimal(str(movimento.valor)) * sinal
+    efeitos = {}
+
+    def somar(tipo, conta_id, delta):
+        efeitos[(tipo, conta_id)] = efeitos.get((tipo, conta_id), Decimal('0')) + delta
+
+    if movimento.tipo == 'entrada':
+        somar(movimento.conta_origem_tipo, movimento.conta_origem_id, valor)
+    elif movimento.tipo == 'saida':
+        somar(movimento.conta_origem_tipo, movimento.conta_origem_id, -valor)
+    elif movimento.tipo == 'transferencia':
+        somar(movimento.conta_origem_tipo, movimento.conta_origem_id, -valor)
+        if movimento.conta_destino_id:
+            somar(movimento.conta_destino_tipo, movimento.conta_destino_id, valor)
+    return efeitos
+
+
+def _somar_efeitos(*grupos):
+    total = {}
+    for efeitos in grupos:
+        for conta, delta in efeitos.items():
+            total[conta] = total.get(conta, Decimal('0')) + delta
+    return total
+
+
+def aplicar_efeitos_saldo(efeitos):
+    """Aplica as variações com ``saldo_atual = saldo_atual + :delta``.
+
+    O incremento é feito pelo banco, sem ler o saldo antes, e as contas são
+    atualizadas sempre na mesma ordem para que lançamentos concorrentes não
+    se bloqueiem mutuamente. Não faz commit.
+    """
+    por_tipo = {}
+    for (tipo, conta_id), delta in sorted(efeitos.items()):
+        if delta:
+            por_tipo.setdefault(tipo, []).append({'b_id': conta_id, 'b_delta': delta})
+    for tipo, linhas in sorted(por_tipo.items()):
+        tabela = (ContaCaixa if tipo == 'caixa' else ContaBanco).__table__
+        db.session.execute(
+            update(tabela)
+            .where(tabela.c.id == bindparam('b_id'))
+            .values(saldo_atual=func.coalesce(tabela.c.saldo_atual, 0) + bindparam('b_delta')),
+            linhas,
+        )
+
+
+def lancar_movimentos(lista, commit=True):
+    """Grava vários movimentos e seus efeitos nos saldos em uma transação.
+
+    Os saldos recebem um único incremento por conta com a soma dos
+    movimentos e cada conta é marcada para recálculo das posições a partir
+    da sua menor data. Com ``commit=False`` o chamador confirma a transação
+    (para gravar junto outros registros, como conciliações). Retorna os
+    movimentos criados, na ordem recebida.
+    """
+    movimentos = [MovimentoFinanceiro(**dados) for dados in lista]
+    if not movimentos:
+        return movimentos
+    db.session.add_all(movimentos)
+    db.session.flush()  # garante id para conciliacoes
+
+    aplicar_efeitos_saldo(_somar_efeitos(*(efeitos_no_saldo(m) for m in movimentos)))
+    inicio_por_conta = {}
+    for movimento in movimentos:
+        for conta in contas_do_movimento(movimento):
+            atual = inicio_por_conta.get(conta)
+            if atual is None or movimento.data_movimento < atual:
+                inicio_por_conta[conta] = movimento.data_movimento
+    por_data = {}
+    for conta, data_inicio in inicio_por_conta.items():
+        por_data.setdefault(data_inicio, set()).add(conta)
+    for data_inicio, contas in sorted(por_data.items()):
+        marcar_posicoes_pendentes(data_inicio, contas)
+
+    if commit:
+        db.session.commit()
+    return movimentos
+
+
+def criar_movimento(data):
+    return lancar_movimentos([data])[0]
+
+
+def atualizar_movimento(movimento, data):
+    """Atualiza um movimento existente ajustando saldos."""
+    data_antiga = movimento.data_movimento
+    contas_antigas = contas_do_movimento(movimento)
+    # Estorna o efeito anterior
+    estorno = efeitos_no_saldo(movimento, sinal=-1)
+
+    data_mov = data.get('data_movimento')
+    if isinstance(data_mov, str):
+        try:
+            data['data_movimento'] = datetime.strptime(data_mov, '%Y-%m-%d').date()
+        except ValueError:
+            data['data_movimento'] = data_antiga
+
+    for key, value in data.items():
+        setattr(movimento, key, value)
+    db.session.flush()
+
+    aplicar_efeitos_saldo(_somar_efeitos(estorno, efeitos_no_saldo(movimento)))
+    # Marca as posições a partir da menor data envolvida, nas contas de antes
+    # e de depois da alteração
+    data_ref = min(data_antiga, movimento.data_movimento)
+    marcar_posicoes_pendentes(data_ref, contas_antigas | contas_do_movimento(movimento))
+    db.session.commit()
+    return movimento
+
+
+def deletar_movimento(movimento):
+    """Exclui um movimento ajustando os saldos."""
+    aplicar_efeitos_saldo(efeitos_no_saldo(movimento, sinal=-1))
+    # Se o movimento estiver vinculado a uma conta a receber, desfaz o pagamento
+    if movimento.documento and movimento.documento.startswith('CR-'):
+        try:
+            conta_id = int(movimento.documento.split('CR-')[1])
+        except ValueError:
+            conta_id = None
+        if conta_id:
+            db.session.execute(
+                text(
+                    """
+                    UPDATE contas_a_receber
+                       SET data_pagamento = NULL,
+                           valor_pago = NULL,
+                           valor_desconto = 0,
+                           valor_multa = 0,
+                           valor_juros = 0,
+                           valor_pendente = valor_previsto,
+                           status_conta = 'Aberta'
+                     WHERE id = :conta_id
+                    """
+                ),
+                {"conta_id": conta_id},
+            )
+    # Se o movimento estiver vinculado a uma conta a pagar, desfaz o pagamento
+    if movimento.documento and movimento.documento.startswith('CP-'):
+        try:
+            conta_id = int(movimento.documento.split('CP-')[1])
+        except ValueError:
+            conta_id = None
+        if conta_id:
+            db.session.execute(
+                text(
+                    """
+                    UPDATE contas_a_pagar
+                       SET data_pagamento = NULL,
+                           valor_pago = NULL,
+                           valor_desconto = 0,
+                           valor_multa = 0,
+                           valor_juros = 0,
+                           status_conta = 'Aberta'
+                     WHERE id = :conta_id
+                    """
+                ),
+                {"conta_id": conta_id},
+            )
+    # Marca as posições das contas do movimento a partir da sua data
+    marcar_posicoes_pendentes(movimento.data_movimento, contas_do_movimento(movimento))
+    db.session.delete(movimento)
+    db.session.commit()
+
+
+def parse_cnab240(content):
+    """Parse simplificado de CNAB240. Gera dicts com data, valor e histórico.
+
+    ``content`` pode ser o texto do arquivo ou o próprio stream do upload,
+    lido linha a linha. ``hash_registro`` é o ``Registro.digest`` da linha
+    (sem lote e número sequencial).
+    """
+    for registro in ler_registros(content, leiaute=LancamentoExtrato):
+        if len(registro) < 160:
+            continue
+        data = registro.data_lancamento
+        valor = registro.valor_lancamento
+        if data is None or valor is None:
+            continue
+        yield {
+            'data_movimento': data,
+            'valor': float(valor),
+            'historico': registro.historico,
+            'hash_registro': registro.digest,
+        }
+
+
+def _chave_conciliacao(data_movimento, valor):
+    return data_movimento, Decimal(str(valor)).quantize(Decimal('0.01'))
+
+
+def importar_cnab(file_storage, conta_id, conta_tipo):
+    """Importa um extrato CNAB240 conciliando-o com os movimentos existentes.
+
+    Os movimentos do período do extrato são carregados com uma única
+    consulta e indexados por (data, valor); as linhas sem correspondente
+    viram movimentos novos, gravados com ``lancar_movimentos`` junto com as
+    conciliações em uma só transação.
+
+    Um arquivo já importado levanta ``ArquivoJaProcessado`` antes da leitura
+    e as linhas já importadas por outro arquivo são ignoradas.
+    """
+    sha256 = sha256_conteudo(file_storage)
+    verificar_arquivo('extrato', sha256)
+    chaves = ChavesRegistros()
+    registros = []
+    for r in parse_cnab240(file_storage):
+        r['chave'] = chaves.chave(r['hash_registro'])
+        registros.append(r)
+    processados = registros_processados('extrato', [r['chave'] for r in registros])
+    registros = [r for r in registros if r['chave'] not in processados]
+    arquivo = registrar_arquivo('extrato', sha256, file_storage.filename)
+    if not registros:
+        db.session.commit()
+        return []
+
+    datas = [r['data_movimento'] for r in registros]
+    existentes = {}
+    candidatos = db.session.execute(
+        select(MovimentoFinanceiro.id, MovimentoFinanceiro.data_movimento, MovimentoFinanceiro.valor)
+        .where(MovimentoFinanceiro.data_movimento.between(min(datas), max(datas)))
+        .order_by(MovimentoFinanceiro.id)
+    )
+    for movimento_id, data_movimento, valor in candidatos:
+        existentes.setdefault(_chave_conciliacao(data_movimento, valor), movimento_id)
+
+    # Cada linha aponta para um movimento existente ou para a posição do
+    # movimento novo em ``novos``; linhas repetidas no próprio extrato são
+    # conciliadas com o movimento criado pela primeira delas.
+    novos = []
+    destinos = []
+    for r in registros:
+        chave = _chave_conciliacao(r['data_movimento'], r['valor'])
+        if chave not in existentes:
+            existentes[chave] = ('novo', len(novos))
+            novos.append({
+                'conta_origem_id': conta_id,
+                'conta_origem_tipo': conta_tipo,
+                'data_movimento': r['data_movimento'],
+                'tipo': 'entrada',
+                'valor': r['valor'],
+                'categoria': 'CNAB',
+                'historico': r.get('historico')
+            })
+        destinos.append(existentes[chave])
+
+    criados = lancar_movimentos(novos, commit=False)
+    ids = [
+        criados[destino[1]].id if isinstance(destino, tuple) else destino
+        for destino in destinos
+    ]
+    agora = datetime.utcnow()
+    db.session.execute(
+        insert(Conciliacao),
+        [
+            {
+                'movimento_id': movimento_id,
+                'arquivo_lancamento': file_storage.filename,
+                'status': 'conciliado',
+                'data_conciliacao': agora,
+            }
+            for movimento_id in ids
+        ],
+    )
+    registrar_registros(arquivo, [r['chave'] for r in registros])
+    db.session.commit()
+    return [{'movimento_id': movimento_id, 'status': 'conciliado'} for movimento_id in ids]
+
+
+# Início do recálculo de cada conta: a data pedida ou, se anterior, a data do
+# saldo inicial da conta.
+_INICIO_CONTA = (
+    "CASE WHEN :data_inicio < COALESCE({c}.data_saldo_inicial, :data_inicio) "
+    "THEN :data_inicio ELSE COALESCE({c}.data_saldo_inicial, :data_inicio) END"
+)
+
+_SQL_REMOVER_POSICOES = f"""
+    DELETE FROM posicao_diaria
+    WHERE (conta_tipo = 'caixa' {{filtro_caixa}} AND data >= (
+              SELECT {_INICIO_CONTA.format(c='c')} FROM conta_caixa c
+              WHERE c.id = posicao_diaria.conta_id))
+       OR (conta_tipo = 'banco' {{filtro_banco}} AND data >= (
+              SELECT {_INICIO_CONTA.format(c='b')} FROM conta_banco b
+              WHERE b.id = posicao_diaria.conta_id))
+"""
+
+_SQL_DIAS = {
+    'postgresql': """
+    dias AS (
+        SELECT p.conta_tipo, p.conta_id, CAST(g.dia AS DATE) AS dia
+        FROM partida p
+        CROSS JOIN LATERAL generate_series(
+            CAST(p.primeiro_dia AS TIMESTAMP), CAST(:data_fim AS TIMESTAMP), INTERVAL '1 day'
+        ) AS g(dia)
+    )""",
+    # SQLite (testes) não tem generate_series
+    'default': """
+    dias(conta_tipo, conta_id, dia) AS (
+        SELECT conta_tipo, conta_id, primeiro_dia FROM partida WHERE primeiro_dia <= :data_fim
+        UNION ALL
+        SELECT conta_tipo, conta_id, date(dia, '+1 day') FROM dias WHERE dia < :data_fim
+    )""",
+}
+
+_SQL_INSERIR_POSICOES = """
+INSERT INTO posicao_diaria (conta_id, conta_tipo, data, saldo)
+WITH RECURSIVE contas AS (
+    SELECT 'caixa' AS conta_tipo, c.id AS conta_id, c.saldo_inicial,
+           COALESCE(c.data_saldo_inicial, :data_inicio) AS base, {inicio_caixa} AS inicio
+    FROM conta_caixa c
+    WHERE 1 = 1 {filtro_caixa}
+    UNION ALL
+    SELECT 'banco', b.id, b.saldo_inicial,
+           COALESCE(b.data_saldo_inicial, :data_inicio), {inicio_banco}
+    FROM conta_banco b
+    WHERE 1 = 1 {filtro_banco}
+),
+partida AS (
+    -- Com posição anterior ao início, continua dela; senão parte do saldo
+    -- inicial na data do saldo inicial
+    SELECT c.conta_tipo, c.conta_id,
+           CASE WHEN a.data IS NULL THEN c.base ELSE c.inicio END AS primeiro_dia,
+           COALESCE(a.saldo, c.saldo_inicial, 0) AS saldo_partida
+    FROM contas c
+    LEFT JOIN posicao_diaria a
+      ON a.conta_tipo = c.conta_tipo AND a.conta_id = c.conta_id
+     AND a.data = (
+            SELECT MAX(pd.data) FROM posicao_diaria pd
+            WHERE pd.conta_tipo = c.conta_tipo AND pd.conta_id = c.conta_id
+              AND pd.data < c.inicio
+         )
+),
+{dias},
+deltas AS (
+    SELECT p.conta_tipo, p.conta_id, m.data_movimento AS dia,
+           CASE WHEN m.tipo = 'entrada' THEN m.valor
+                WHEN m.tipo IN ('saida', 'transferencia') THEN -m.valor
+                ELSE 0 END AS valor
+    FROM partida p
+    JOIN movimento_financeiro m
+      ON m.conta_origem_tipo = p.conta_tipo AND m.conta_origem_id = p.conta_id
+     AND m.data_movimento >= p.primeiro_dia AND m.data_movimento <= :data_fim
+    UNION ALL
+    SELECT p.conta_tipo, p.conta_id, m.data_movimento, m.valor
+    FROM partida p
+    JOIN movimento_financeiro m
+      ON m.tipo = 'transferencia'
+     AND m.conta_destino_tipo = p.conta_tipo AND m.conta_destino_id = p.conta_id
+     AND m.data_movimento >= p.primeiro_dia AND m.data_movimento <= :data_fim
+),
+diarios AS (
+    SELECT conta_tipo, conta_id, dia, SUM(valor) AS valor
+    FROM deltas
+    GROUP BY conta_tipo, conta_id, dia
+)
+SELECT d.conta_id, d.conta_tipo, d.dia,
+       p.saldo_partida + SUM(COALESCE(m.valor, 0)) OVER (
+           PARTITION BY d.conta_tipo, d.conta_id ORDER BY d.dia
+       )
+FROM dias d
+JOIN partida p ON p.conta_tipo = d.conta_tipo AND p.conta_id = d.conta_id
+LEFT JOIN diarios m ON m.conta_tipo = d.conta_tipo AND m.conta_id = d.conta_id AND m.dia = d.dia
+"""
+
+
+def _sql_posicoes(sql, datas, listas=()):
+    return text(sql).bindparams(
+        *[bindparam(nome, type_=db.Date) for nome in datas],
+        *[bindparam(nome, expanding=True) for nome in listas],
+    )
+
+
+def contas_do_movimento(movimento):
+    """Contas ``(tipo, id)`` cujo saldo o movimento altera."""
+    contas = {(movimento.conta_origem_tipo, movimento.conta_origem_id)}
+    if movimento.tipo == 'transferencia' and movimento.conta_destino_id:
+        contas.add((movimento.conta_destino_tipo, movimento.conta_destino_id))
+    return contas
+
+
+def _insert_upsert():
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def marcar_posicoes_pendentes(data_inicio, contas):
+    """Marca as contas para recálculo das posições a partir de ``data_inicio``.
+
+    A marca de cada conta só é antecipada, nunca adiada, de modo que vários
+    lançamentos seguidos resultam em um único recálculo a partir da menor
+    data. Não faz commit: a marca é gravada na mesma transação do
+    lançamento.
+    """
+    if not contas:
+        return
+    agora = datetime.utcnow()
+    insert_dialeto = _insert_upsert()
+    comando = insert_dialeto(PosicaoPendente).values(
+        [
+            {'conta_tipo': tipo, 'conta_id': conta_id, 'data_inicio': data_inicio, 'atualizado_em': agora}
+            for tipo, conta_id in sorted(contas)
+        ]
+    )
+    comando = comando.on_conflict_do_update(
+        index_elements=['conta_tipo', 'conta_id'],
+        set_={
+            'data_inicio': case(
+                (comando.excluded.data_inicio < PosicaoPendente.data_inicio, comando.excluded.data_inicio),
+                else_=PosicaoPendente.data_inicio,
+            ),
+            'atualizado_em': comando.excluded.atualizado_em,
+        },
+    )
+    db.session.execute(comando)
+
+
+def processar_posicoes_pendentes(ate=None):
+    """Recalcula as posições das contas marcadas por ``marcar_posicoes_pendentes``.
+
+    Cada conta é recalculada uma única vez, a partir da sua data marcada.
+    Com ``ate`` (datetime UTC) só são processadas as marcas sem alteração
+    desde então, o que deixa para depois as contas ainda recebendo
+    lançamentos. A marca é removida na mesma transação do recálculo; se
+    outro processo já a removeu (ou a antecipou nesse meio tempo) a conta é
+    deixada para ele ou para a próxima execução. Retorna a quantidade de
+    posições gravadas.
+    """
+    consulta = select(PosicaoPendente.conta_tipo, PosicaoPendente.conta_id, PosicaoPendente.data_inicio)
+    if ate is not None:
+        consulta = consulta.where(PosicaoPendente.atualizado_em <= ate)
+    por_data = {}
+    for tipo, conta_id, data_inicio in db.session.execute(consulta).all():
+        por_data.setdefault(data_inicio, set()).add((tipo, conta_id))
+
+    total = 0
+    for data_inicio in sorted(por_data):
+        contas = set()
+        for tipo, conta_id in sorted(por_data[data_inicio]):
+            removidas = db.session.execute(
+                delete(PosicaoPendente).where(
+                    PosicaoPendente.conta_tipo == tipo,
+                    PosicaoPendente.conta_id == conta_id,
+                    PosicaoPendente.data_inicio == data_inicio,
+                )
+            ).rowcount
+            if removidas:
+                contas.add((tipo, conta_id))
+        if not contas:
+            continue
+        try:
+            total += recalcular_posicoes(data_inicio, contas=contas)
+        except Exception:
+            db.session.rollback()
+            raise
+    return total
+
+
+def recalcular_posicoes(data_inicio=None, contas=None):
+    """Recalcula as posições diárias a partir de uma data.
+
+    Para cada conta de caixa/banco as posições a partir do início são
+    apagadas e regravadas com um único ``INSERT ... SELECT``: uma linha por
+    dia (``generate_series``) com o saldo acumulado (``SUM() OVER``) dos
+    movimentos de origem e destino. ``contas`` limita o recálculo a pares
+    ``(tipo, id)``; sem ele todas as contas são recalculadas. Retorna a
+    quantidade de posições gravadas.
+    """
     if data_inicio is None:
         data_inicio = date.today()
-    data_fim = date.today()
-
-    contas = [("caixa", c) for c in ContaCaixa.query.all()] + [
-        ("banco", b) for b in ContaBanco.query.all()
-    ]
-
-    total = 0
-    for tipo, conta in contas:
-        base = conta.data_saldo_inicial or data_inicio
-        inicio = min(data_inicio, base)
-        # Remove posições existentes a partir da data de início
-        PosicaoDiaria.query.filter_by(conta_id=conta.id, conta_tipo=tipo).filter(PosicaoDiaria.data >= inicio).delete()
-        db.session.flush()
-
-        # Busca última posição antes do início para obter saldo inicial
-        pos_anterior = (
-            PosicaoDiaria.query.filter_by(conta_id=conta.id, conta_tipo=tipo)
-            .filter(PosicaoDiaria.data < inicio)
-            .order_by(PosicaoDiaria.data.desc())
-            .first()
-        )
-        if pos_anterior:
-            saldo = float(pos_anterior.saldo)
-            current = pos_anterior.data + timedelta(days=1)
-        else:
-            saldo = float(conta.saldo_inicial or 0)
-            current = base
-
-        if current < inicio:
-            current = inicio
-
-        while current <= data_fim:
-            # Movimentos na origem
-            movs_origem = MovimentoFinanceiro.query.filter_by(
-                conta_origem_id=conta.id,
-                conta_origem_tipo=tipo,
-                data_movimento=current,
-            ).all()
-            for m in movs_origem:
-                if m.tipo == "entrada":
-                    saldo += float(m.valor)
-                elif m.tipo == "saida":
-                    saldo -= float(m.valor)
-                elif m.tipo == "transferencia":
-                    saldo -= float(m.valor)
-
-            # Movimentos na conta destino (transferências)
-            movs_destino = MovimentoFinanceiro.query.filter_by(
-                conta_destino_id=conta.id,
-                conta_destino_tipo=tipo,
-                data_movimento=current,
-            ).all()
-            for m in movs_destino:
-                if m.tipo == "transferencia":
-                    saldo += float(m.valor)
-
-            db.session.add(
-                PosicaoDiaria(
-                    conta_id=conta.id,
-                    conta_tipo=tipo,
-                    data=current,
-                    saldo=saldo,
-                )
-            )
-            total += 1
-            current += timedelta(days=1)
-
+    parametros = {'data_inicio': data_inicio, 'data_fim': date.today()}
+
+    filtros = {'filtro_caixa': '', 'filtro_banco': ''}
+    listas = []
+    if contas is not None:
+        contas = set(contas)
+        if not contas:
+            return 0
+        for tipo in ('caixa', 'banco'):
+            parametros[f'ids_{tipo}'] = sorted(i for t, i in contas if t == tipo)
+            filtros[f'filtro_{tipo}'] = f'AND {{coluna}} IN :ids_{tipo}'
+            listas.append(f'ids_{tipo}')
+
+    dialeto = db.session.get_bind().dialect.name
+    inserir = _SQL_INSERIR_POSICOES.format(
+        inicio_caixa=_INICIO_CONTA.format(c='c'),
+        inicio_banco=_INICIO_CONTA.format(c='b'),
+        filtro_caixa=filtros['filtro_caixa'].format(coluna='c.id'),
+        filtro_banco=filtros['filtro_banco'].format(coluna='b.id'),
+        dias=_SQL_DIAS.get(dialeto, _SQL_DIAS['default']).strip(),
+    )
+    remover = _SQL_REMOVER_POSICOES.format(
+        filtro_caixa=filtros['filtro_caixa'].format(coluna='conta_id'),
+        filtro_banco=filtros['filtro_banco'].format(coluna='conta_id'),
+    )
+    db.session.execute(
+        _sql_posicoes(remover, ['data_inicio'], listas),
+        {k: v for k, v in parametros.items() if k != 'data_fim'},
+    )
+    total = db.session.execute(
+        _sql_posicoes(inserir, ['data_inicio', 'data_fim'], listas), parametros
+    ).rowcount
     db.session.commit()
     return total
 
@@ -0,0 +1,312 @@
+"""Leitura incremental de arquivos CNAB240 (extratos e retornos bancários).
+
+``ler_registros`` percorre o arquivo linha a linha direto do stream enviado,
+sem carregar o conteúdo inteiro: cada linha vira um ``Registro`` que guarda
+os bytes originais e só decodifica os campos efetivamente lidos. As posições
+dos campos seguem a convenção de fatias do Python (início inclusivo, fim
+exclusivo), como nos leiautes usados em ``caixa_banco`` e ``contas_receber``.
+
+Cada registro é devolvido com a classe do seu tipo (``HeaderArquivo``,
+``HeaderLote``, ``SegmentoP``/``Q``/``R``/``T``/``U``, ``TrailerLote``,
+``TrailerArquivo``), que declara os campos lidos pela aplicação como
+atributos, por exemplo ``registro.nosso_numero`` num ``SegmentoP``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from typing import IO, Iterator, Optional, Type, Union
+
+TAMANHO_REGISTRO = 240
+
+# Tipo de registro (posição 8 do leiaute FEBRABAN)
+TIPOS = {
+    '0': 'header_arquivo',
+    '1': 'header_lote',
+    '3': 'detalhe',
+    '5': 'trailer_lote',
+    '9': 'trailer_arquivo',
+}
+
+# Lote (posições 4-7) e número sequencial do registro no lote (9-13): o banco
+# renumera ambos em cada arquivo, por isso ficam fora de ``Registro.digest``
+CAMPOS_SEQUENCIAIS = ((3, 7), (8, 13))
+
+_BOM = b'\xef\xbb\xbf'
+_NAO_DIGITO = re.compile(r'\D')
+
+Origem = Union[str, bytes, IO]
+
+
+class Campo:
+    """Campo de um leiaute, lido do registro só quando acessado.
+
+    ``conversao`` é o método de ``Registro`` que decodifica o trecho
+    (``alfa``, ``digitos``, ``valor`` ou ``data``); ``extras`` são os seus
+    argumentos adicionais (casas decimais, formato da data).
+    """
+
+    __slots__ = ('conversao', 'inicio', 'fim', 'extras')
+
+    def __init__(self, conversao: str, inicio: int, fim: int, *extras) -> None:
+        self.conversao = conversao
+        self.inicio = inicio
+        self.fim = fim
+        self.extras = extras
+
+    def __get__(self, registro, dono=None):
+        if registro is None:
+            return self
+        return getattr(Registro, self.conversao)(registro, self.inicio, self.fim, *self.extras)
+
+
+class Registro:
+    """Uma linha do arquivo, decodificada sob demanda campo a campo."""
+
+    __slots__ = ('linha', 'numero', 'codificacao')
+
+    def __init__(self, linha: Union[bytes, str], numero: int, codificacao: str = 'utf-8') -> None:
+        self.linha = linha
+        self.numero = numero
+        self.codificacao = codificacao
+
+    def __len__(self) -> int:
+        return len(self.linha)
+
+    def __repr__(self) -> str:
+        return f'<Registro {self.numero} {self.categoria}>'
+
+    def texto(self, inicio: int, fim: int) -> str:
+        """Conteúdo bruto do campo, sem remover espaços."""
+        trecho = self.linha[inicio:fim]
+        if isinstance(trecho, bytes):
+            return trecho.decode(self.codificacao, errors='ignore')
+        return trecho
+
+    def alfa(self, inicio: int, fim: int) -> str:
+        return self.texto(inicio, fim).strip()
+
+    def digitos(self, inicio: int, fim: int) -> str:
+        return _NAO_DIGITO.sub('', self.texto(inicio, fim))
+
+    def valor(self, inicio: int, fim: int, casas: int = 2) -> Optional[Decimal]:
+        """Valor numérico com ``casas`` decimais implícitas; ``None`` se vazio."""
+        digitos = self.digitos(inicio, fim)
+        if not digitos:
+            return None
+        return Decimal(digitos).scaleb(-casas)
+
+    def data(self, inicio: int, fim: int, formato: str = '%d%m%Y') -> Optional[date]:
+        """Data do campo; ``None`` se vazia, zerada ou inválida."""
+        texto = self.texto(inicio, fim).strip()
+        if not texto or not texto.strip('0'):
+            return None
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            return None
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 da linha sem ``CAMPOS_SEQUENCIAIS``, para identificar registros
+        já processados.
+
+        O mesmo lançamento repetido em outro arquivo (um extrato ou retorno
+        que se sobrepõe ao anterior) chega com outro lote e outro número
+        sequencial; sem esses campos ele produz o mesmo ``digest``.
+        """
+        linha = self.linha if isinstance(self.linha, bytes) else self.linha.encode(self.codificacao)
+        digest = hashlib.sha256()
+        anterior = 0
+        for inicio, fim in CAMPOS_SEQUENCIAIS:
+            digest.update(linha[anterior:inicio])
+            digest.update(b' ' * (fim - inicio))
+            anterior = fim
+        digest.update(linha[anterior:])
+        return digest.hexdigest()
+
+    @property
+    def tipo(self) -> str:
+        return self.texto(7, 8)
+
+    @property
+    def segmento(self) -> str:
+        """Letra do segmento (P, Q, R, T, U, E...) dos registros de detalhe."""
+        return self.texto(13, 14) if self.tipo == '3' else ''
+
+    @property
+    def categoria(self) -> str:
+        if self.segmento:
+            return f'segmento_{self.segmento}'
+        return TIPOS.get(self.tipo, 'desconhecido')
+
+    banco = Campo('digitos', 0, 3)
+    lote = Campo('digitos', 3, 7)
+
+
+class HeaderArquivo(Registro):
+    __slots__ = ()
+
+    nome_empresa = Campo('alfa', 72, 102)
+    nome_banco = Campo('alfa', 102, 132)
+    data_geracao = Campo('data', 143, 151)
+    numero_sequencial = Campo('digitos', 157, 163)
+
+
+class HeaderLote(Registro):
+    __slots__ = ()
+
+    operacao = Campo('alfa', 8, 9)
+    data_gravacao = Campo('data', 191, 199)
+
+
+class Detalhe(Registro):
+    """Registro de detalhe (tipo 3) de um segmento sem leiaute próprio aqui."""
+
+    __slots__ = ()
+
+    sequencial = Campo('digitos', 8, 13)
+    movimento = Campo('digitos', 15, 17)
+
+
+class SegmentoP(Detalhe):
+    __slots__ = ()
+
+    nosso_numero = Campo('alfa', 37, 57)
+    vencimento = Campo('data', 77, 85)
+    valor_titulo = Campo('valor', 85, 100)
+
+
+class SegmentoQ(Detalhe):
+    __slots__ = ()
+
+    inscricao_pagador = Campo('digitos', 18, 33)
+    nome_pagador = Campo('alfa', 33, 73)
+
+
+class SegmentoR(Detalhe):
+    __slots__ = ()
+
+    valor_multa = Campo('valor', 74, 89)
+
+
+class SegmentoT(Detalhe):
+    """Segmento T no leiaute dos retornos já tratados pela aplicação."""
+
+    __slots__ = ()
+
+    nosso_numero = Campo('alfa', 4, 24)
+    valor_pago = Campo('valor', 24, 37)
+
+
+class SegmentoU(Detalhe):
+    __slots__ = ()
+
+    valor_pago = Campo('valor', 77, 92)
+    valor_liquido = Campo('valor', 92, 107)
+    data_ocorrencia = Campo('data', 137, 145)
+    data_credito = Campo('data', 145, 153)
+
+
+class TrailerLote(Registro):
+    __slots__ = ()
+
+    quantidade_registros = Campo('digitos', 17, 23)
+    valor_total = Campo('valor', 23, 41)
+
+
+class TrailerArquivo(Registro):
+    __slots__ = ()
+
+    quantidade_lotes = Campo('digitos', 17, 23)
+    quantidade_registros = Campo('digitos', 23, 29)
+
+
+class LancamentoExtrato(Registro):
+    """Linha do extrato no leiaute simplificado importado por ``caixa_banco``.
+
+    Não depende do tipo de registro: ``ler_registros(..., leiaute=LancamentoExtrato)``
+    lê todas as linhas com estes campos.
+    """
+
+    __slots__ = ()
+
+    historico = Campo('alfa', 70, 90)
+    data_lancamento = Campo('data', 143, 151, '%Y%m%d')
+    valor_lancamento = Campo('valor', 152, 167)
+
+
+CLASSES = {
+    '0': HeaderArquivo,
+    '1': HeaderLote,
+    '5': TrailerLote,
+    '9': TrailerArquivo,
+}
+
+SEGMENTOS = {
+    'P': SegmentoP,
+    'Q': SegmentoQ,
+    'R': SegmentoR,
+    'T': SegmentoT,
+    'U': SegmentoU,
+}
+
+
+def _classe(linha: Union[bytes, str]):
+    tipo = linha[7:8]
+    if isinstance(tipo, bytes):
+        tipo = tipo.decode('ascii', errors='ignore')
+    if tipo != '3':
+        return CLASSES.get(tipo, Registro)
+    segmento = linha[13:14]
+    if isinstance(segmento, bytes):
+        segmento = segmento.decode('ascii', errors='ignore')
+    return SEGMENTOS.get(segmento, Detalhe)
+
+
+def _linhas(origem: Origem) -> Iterator[Union[bytes, str]]:
+    if isinstance(origem, (bytes, bytearray, memoryview)):
+        origem = io.BytesIO(origem)
+    elif isinstance(origem, str):
+        origem = io.StringIO(origem)
+    elif hasattr(origem, 'stream'):
+        # FileStorage do Werkzeug
+        origem = origem.stream
+    while True:
+        linha = origem.readline()
+        if not linha:
+            return
+        yield linha
+
+
+def ler_registros(
+    origem: Origem,
+    codificacao: str = 'utf-8',
+    leiaute: Optional[Type[Registro]] = None,
+) -> Iterator[Registro]:
+    """Itera os registros não vazios de ``origem``.
+
+    ``origem`` pode ser o conteúdo (``str``/``bytes``), um arquivo aberto ou
+    o ``FileStorage`` de um upload; apenas uma linha é mantida
+    em memória por vez. Cada registro vem com a classe do seu tipo e
+    segmento, ou com ``leiaute`` quando informado.
+    """
+    numero = 0
+    for linha in _linhas(origem):
+        numero += 1
+        if isinstance(linha, bytes):
+            if numero == 1 and linha.startswith(_BOM):
+                linha = linha[len(_BOM):]
+            linha = linha.rstrip(b'\r\n')
+        else:
+            if numero == 1:
+                linha = linha.lstrip('\ufeff')
+            linha = linha.rstrip('\r\n')
+        if not linha.strip():
+            continue
+        yield (leiaute or _classe(linha))(linha, numero, codificacao)
+
@@ -3,5 +3,7 @@ from caixa_banco import db
 def init_app(app):
     # Ensure models are registered and tables created
     from . import models  # noqa: F401
+    if not app.config.get('SCHEMA_AUTO_CREATE', True):
+        return
     with app.app_context():
         db.create_all()
\ No newline at end of file
@@ -5,9 +5,11 @@ from sqlalchemy import inspect, text
 def init_app(app):
     from .routes import bp as contas_bp
     app.register_blueprint(contas_bp, url_prefix='/api')
+    if not app.config.get('SCHEMA_AUTO_CREATE', True):
+        # Colunas nosso_numero/valor_pendente: migrations/019_contas_valor_pendente.sql
+        return
     with app.app_context():
         db.create_all()
-        db.create_all()
 
         # Ensure the 'nosso_numero' column exists in older databases
         inspector = inspect(db.engine)
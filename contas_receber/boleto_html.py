@@ -0,0 +1,278 @@
+"""HTML dos boletos, com o template e os recursos carregados uma vez.
+
+``RenderizadorBoleto`` guarda, por aplicação e template, o template já
+compilado, o logo do banco (extraído do próprio template) e a decisão sobre
+injetar as regras de impressão; cada boleto renderiza apenas o contexto do
+título. ``render_many`` resolve empresa, conta e pagadores de um lote de uma
+vez (uma consulta para os clientes) e prepara o contexto comum do Flask uma
+única vez para todo o lote.
+"""
+
+from __future__ import annotations
+
+import base64
+import threading
+import weakref
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from flask import current_app
+
+from caixa_banco.models import ContaBanco
+from .boleto_utils import CalculadoraCodigos, codigo_barras_html, digits
+from .models import EmpresaLicenciada, Pessoa
+
+TEMPLATE_BOLETO = "financeiro/contas_a_receber/boleto.html"
+
+_ESTILOS_PDF = (
+    "<style>@page { size: A4; margin: 0; } "
+    "html, body { margin: 0; padding: 0; }""</style>"
+)
+
+_ESTILO_LOTE = (
+    "<style>.boleto-lote { page-break-after: always; break-after: page; } "
+    ".boleto-lote:last-child { page-break-after: auto; break-after: auto; }</style>"
+)
+
+
+def _resolver_entidades(titulo, empresa=None, conta=None, cliente=None):
+    """Garante que todas as entidades necessárias estejam disponíveis."""
+
+    empresa_resolvida = empresa or EmpresaLicenciada.query.first()
+    conta_resolvida = conta or ContaBanco.query.first()
+    cliente_resolvido = cliente or Pessoa.query.get(titulo.cliente_id)
+
+    if not all([empresa_resolvida, conta_resolvida, cliente_resolvido]):
+        raise ValueError("Dados incompletos para gerar o boleto")
+
+    return empresa_resolvida, conta_resolvida, cliente_resolvido
+
+
+def _montar_contexto_boleto(titulo, empresa, conta, cliente, calculadora=None):
+    """Contexto do template; ``calculadora`` reaproveita a conta já processada no lote."""
+
+    calculadora = calculadora or CalculadoraCodigos(conta)
+    codigo = calculadora.codigo(
+        titulo.nosso_numero or "",
+        str(titulo.id),
+        titulo.data_vencimento or date.today(),
+        float(titulo.valor_previsto),
+    )
+    linha = codigo.linha_digitavel
+    barcode_num = codigo.codigo_barras
+
+    banco_bruto = getattr(conta, "banco", "") or ""
+    banco_digitos = digits(banco_bruto)
+    codigo_banco = (banco_digitos[:3] or "000").zfill(3)
+    dv_banco = banco_digitos[3:4]
+    if dv_banco:
+        codigo_banco = f"{codigo_banco}-{dv_banco}"
+
+    contexto = dict(
+        titulo=titulo,
+        empresa=empresa,
+        conta=conta,
+        cliente=cliente,
+        linha_digitavel=linha,
+        barcode=codigo_barras_html(barcode_num),
+        codigo_banco=codigo_banco,
+    )
+    return contexto, barcode_num
+
+
+def _inject_pdf_styles(html: str) -> str:
+    """Garante que o HTML possua regras de impressão adequadas."""
+
+    if "@page" in html:
+        return html
+
+    closing_head = "</head>"
+    if closing_head in html:
+        return html.replace(closing_head, _ESTILOS_PDF + closing_head, 1)
+    return _ESTILOS_PDF + html
+
+
+def _extract_logo_bytes(template_name: str = TEMPLATE_BOLETO) -> bytes:
+    """Logo do banco embutido (``data:image/jpeg;base64``) no template do boleto."""
+
+    ambiente = current_app.jinja_env
+    try:
+        conteudo, _, _ = ambiente.loader.get_source(ambiente, template_name)
+    except Exception:
+        return b""
+    marcador = "data:image/jpeg;base64,"
+    inicio = conteudo.find(marcador)
+    if inicio == -1:
+        return b""
+    inicio += len(marcador)
+    fim = conteudo.find('"', inicio)
+    if fim == -1:
+        return b""
+    encoded = conteudo[inicio:fim]
+    try:
+        return base64.b64decode(encoded)
+    except Exception:
+        return b""
+
+
+def _separar_corpo(html: str) -> Tuple[str, str, str]:
+    """Divide o documento em (início até ``<body>``, corpo, ``</body>`` em diante)."""
+
+    abertura = html.find("<body")
+    fim = html.rfind("</body>")
+    if abertura == -1 or fim == -1:
+        return "", html, ""
+    inicio = html.find(">", abertura) + 1
+    return html[:inicio], html[inicio:fim], html[fim:]
+
+
+class RenderizadorBoleto:
+    """Template e recursos de um template de boleto, carregados uma vez."""
+
+    def __init__(self, app, template_name: str = TEMPLATE_BOLETO) -> None:
+        self.app = app
+        self.template_name = template_name
+        self._lock = threading.Lock()
+        self._template = None
+        self._logo_b64: Optional[str] = None
+        # Decidido no primeiro HTML para PDF: o template já traz ``@page``?
+        self._tem_regras_impressao: Optional[bool] = None
+
+    @property
+    def template(self):
+        if self.app.jinja_env.auto_reload:
+            # Em desenvolvimento o Jinja verifica se o arquivo mudou
+            return self.app.jinja_env.get_template(self.template_name)
+        if self._template is None:
+            with self._lock:
+                if self._template is None:
+                    self._template = self.app.jinja_env.get_template(self.template_name)
+        return self._template
+
+    @property
+    def logo_b64(self) -> str:
+        if self._logo_b64 is None:
+            logo = _extract_logo_bytes(self.template_name)
+            self._logo_b64 = base64.b64encode(logo).decode("utf-8") if logo else ""
+        return self._logo_b64
+
+    def _contexto_base(self, is_pdf: bool) -> Dict[str, object]:
+        contexto = {"is_pdf": is_pdf, "logo_banco_b64": self.logo_b64, "now": datetime.now}
+        self.app.update_template_context(contexto)
+        return contexto
+
+    def _renderizar(self, base, titulo, empresa, conta, cliente, calculadora=None) -> str:
+        contexto, _ = _montar_contexto_boleto(titulo, empresa, conta, cliente, calculadora)
+        html = self.template.render({**base, **contexto})
+        if base["is_pdf"]:
+            if self._tem_regras_impressao is None:
+                self._tem_regras_impressao = "@page" in html
+            if not self._tem_regras_impressao:
+                html = _inject_pdf_styles(html)
+        return html
+
+    def render(self, titulo, empresa=None, conta=None, cliente=None, *, is_pdf: bool = False) -> str:
+        """HTML de um boleto."""
+        empresa, conta, cliente = _resolver_entidades(titulo, empresa, conta, cliente)
+        return self._renderizar(self._contexto_base(is_pdf), titulo, empresa, conta, cliente)
+
+    def render_many(
+        self,
+        titulos: Iterable,
+        empresa=None,
+        conta=None,
+        clientes: Optional[Dict[int, object]] = None,
+        *,
+        is_pdf: bool = True,
+        erros: Optional[Dict[object, str]] = None,
+    ) -> Iterator[Tuple[object, str]]:
+        """Itera ``(titulo, html)`` dos títulos, na ordem recebida.
+
+        ``clientes`` (``{cliente_id: Pessoa}``) é completado com uma consulta
+        para os pagadores que faltarem; a conta bancária é processada uma vez
+        para os códigos de barras de todo o lote. Com ``erros``, um título que
+        não pode ser renderizado é registrado (``{id: mensagem}``) e omitido;
+        sem ele, o erro é propagado.
+        """
+        titulos = list(titulos)
+        clientes = dict(clientes or {})
+        faltantes = {t.cliente_id for t in titulos} - set(clientes)
+        if faltantes:
+            clientes.update(
+                (pessoa.id, pessoa) for pessoa in Pessoa.query.filter(Pessoa.id.in_(faltantes))
+            )
+        empresa = empresa or EmpresaLicenciada.query.first()
+        conta = conta or ContaBanco.query.first()
+        base = self._contexto_base(is_pdf)
+        calculadora = CalculadoraCodigos(conta) if conta else None
+        for titulo in titulos:
+            try:
+                cliente = clientes.get(titulo.cliente_id)
+                if not all([empresa, conta, cliente]):
+                    raise ValueError("Dados incompletos para gerar o boleto")
+                html = self._renderizar(base, titulo, empresa, conta, cliente, calculadora)
+            except Exception as exc:
+                if erros is None:
+                    raise
+                erros[titulo.id] = str(exc) or exc.__class__.__name__
+                continue
+            yield titulo, html
+
+
+_renderizadores: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_renderizadores_lock = threading.Lock()
+
+
+def renderizador(template_name: str = TEMPLATE_BOLETO) -> RenderizadorBoleto:
+    """Renderizador da aplicação atual para ``template_name``."""
+    app = current_app._get_current_object()
+    with _renderizadores_lock:
+        por_template = _renderizadores.setdefault(app, {})
+        if template_name not in por_template:
+            por_template[template_name] = RenderizadorBoleto(app, template_name)
+        return por_template[template_name]
+
+
+def render_boleto_html(
+    titulo,
+    *,
+    empresa=None,
+    conta=None,
+    cliente=None,
+    is_pdf=False,
+    template_name=TEMPLATE_BOLETO,
+):
+    """Renderiza o boleto em HTML reutilizando o mesmo template da visualização."""
+
+    return renderizador(template_name).render(titulo, empresa, conta, cliente, is_pdf=is_pdf)
+
+
+def html_pdf_boleto(titulo, empresa=None, conta=None, cliente=None) -> str:
+    """HTML do boleto pronto para conversão em PDF."""
+
+    return renderizador().render(titulo, empresa, conta, cliente, is_pdf=True)
+
+
+def html_pdf_boletos(titulos, empresa=None, conta=None, clientes=None, erros=None) -> str:
+    """HTML único com os boletos de ``titulos``, um por página.
+
+    O cabeçalho (CSS e regras de impressão) é emitido uma única vez, de modo
+    que o documento inteiro é convertido em PDF por uma só chamada a
+    ``converter_html_pdf``. Títulos cujo HTML não pode ser montado são
+    omitidos e registrados em ``erros`` (``{id: mensagem}``).
+    """
+
+    cabecalho = rodape = None
+    corpos = []
+    for _, html in renderizador().render_many(titulos, empresa, conta, clientes, erros=erros):
+        inicio, corpo, fim = _separar_corpo(html)
+        if cabecalho is None:
+            cabecalho, rodape = inicio, fim
+        corpos.append(f'<div class="boleto-lote">{corpo}</div>')
+    if cabecalho is None:
+        return ""
+    if "</head>" in cabecalho:
+        cabecalho = cabecalho.replace("</head>", _ESTILO_LOTE + "</head>", 1)
+    else:
+        cabecalho = _ESTILO_LOTE + cabecalho
+    return cabecalho + "".join(corpos) + rodape
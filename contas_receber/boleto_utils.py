@@ -1,7 +1,8 @@
 import re
 from datetime import date, datetime
+from functools import lru_cache
 from itertools import cycle
-from typing import Union
+from typing import List, NamedTuple, Tuple, Union
 
 
 DateLike = Union[date, datetime]
@@ -29,20 +30,28 @@ def _valor_formatado(valor: float | None) -> str:
     return f"{centavos:010d}"[:10]
 
 
-def _montar_campo_livre(conta, nosso_numero: str, documento: str) -> str:
+def _campos_conta(conta) -> Tuple[str, str, str, str]:
+    """Banco, agência, conta e carteira já normalizados para o código de barras."""
+    banco = (digits(getattr(conta, "banco", "")) or "000")[:3].zfill(3)
     agencia = digits(getattr(conta, "agencia", ""))[:4].zfill(4)
     conta_num = digits(getattr(conta, "conta", ""))[:8].zfill(8)
     carteira = digits(getattr(conta, "carteira", "17") or "17")[:2].zfill(2)
+    return banco, agencia, conta_num, carteira
+
+
+def _campo_livre(campos_conta: Tuple[str, str, str, str], nosso_numero: str, documento: str) -> str:
+    _, agencia, conta_num, carteira = campos_conta
     nosso = digits(nosso_numero) or digits(documento)
     nosso = nosso[:11].zfill(11)
     return (carteira + agencia + nosso + conta_num)[:25].ljust(25, "0")
 
 
+def _montar_campo_livre(conta, nosso_numero: str, documento: str) -> str:
+    return _campo_livre(_campos_conta(conta), nosso_numero, documento)
+
+
 def _dv_mod11(numero: str) -> str:
-    pesos = cycle(range(2, 10))
-    soma = 0
-    for digito, peso in zip(reversed(numero), pesos):
-        soma += int(digito) * peso
+    soma = sum(int(digito) * peso for digito, peso in zip(reversed(numero), cycle(range(2, 10))))
     resto = soma % 11
     dv = 11 - resto
     if dv in (0, 10, 11):
@@ -50,32 +59,36 @@ def _dv_mod11(numero: str) -> str:
     return str(dv)
 
 
+# Soma dos algarismos do dobro de cada dígito (parcela com peso 2 do mod10)
+_DOBRO_MOD10 = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+
 def _dv_mod10(numero: str) -> str:
     soma = 0
-    peso = 2
+    dobrar = True
     for digito in reversed(numero):
-        parcial = int(digito) * peso
-        soma += parcial // 10 + parcial % 10
-        peso = 1 if peso == 2 else 2
+        soma += _DOBRO_MOD10[int(digito)] if dobrar else int(digito)
+        dobrar = not dobrar
     return str((10 - (soma % 10)) % 10)
 
 
-def _codigo_barras_base(conta, nosso_numero: str, documento: str, vencimento: DateLike, valor: float) -> str:
-    banco = (digits(getattr(conta, "banco", "")) or "000")[:3].zfill(3)
+def _codigo_com_campos(campos_conta, nosso_numero: str, documento: str, vencimento, valor) -> str:
+    banco = campos_conta[0]
     moeda = "9"
     fator = _fator_vencimento(vencimento)
     valor_str = _valor_formatado(valor)
-    campo_livre = _montar_campo_livre(conta, nosso_numero, documento)
+    campo_livre = _campo_livre(campos_conta, nosso_numero, documento)
 
     parcial = banco + moeda + fator + valor_str + campo_livre
     dv = _dv_mod11(parcial)
     return banco + moeda + dv + fator + valor_str + campo_livre
 
 
-def linha_digitavel(conta, nosso_numero: str, vencimento: DateLike, valor: float, documento: str = "") -> str:
-    """Generate the "linha digitável" string for the boleto."""
+def _codigo_barras_base(conta, nosso_numero: str, documento: str, vencimento: DateLike, valor: float) -> str:
+    return _codigo_com_campos(_campos_conta(conta), nosso_numero, documento, vencimento, valor)
 
-    codigo = _codigo_barras_base(conta, nosso_numero, documento, vencimento, valor)
+
+def _linha_do_codigo(codigo: str) -> str:
     banco_moeda = codigo[:4]
     fator = codigo[5:9]
     valor_str = codigo[9:19]
@@ -96,49 +109,83 @@ def linha_digitavel(conta, nosso_numero: str, vencimento: DateLike, valor: float
     return f"{campo1_fmt} {campo2_fmt} {campo3_fmt} {codigo[4]} {fator}{valor_str}"
 
 
+def linha_digitavel(conta, nosso_numero: str, vencimento: DateLike, valor: float, documento: str = "") -> str:
+    """Generate the "linha digitável" string for the boleto."""
+
+    return _linha_do_codigo(_codigo_barras_base(conta, nosso_numero, documento, vencimento, valor))
+
+
 def codigo_barras_numero(conta, nosso_numero: str, documento: str, valor: float, vencimento: DateLike | None = None) -> str:
     """Return the 44-digit numeric string encoded in the boleto barcode."""
 
     return _codigo_barras_base(conta, nosso_numero, documento, vencimento or date.today(), valor)
 
 
-def codigo_barras_html(numero: str) -> str:
-    """Generate the ITF barcode spans used by the boleto template."""
-    padroes = {
-        "0": "nnwwn",
-        "1": "wnnnw",
-        "2": "nwnnw",
-        "3": "wwnnn",
-        "4": "nnwnw",
-        "5": "wnwnn",
-        "6": "nwwnn",
-        "7": "nnnww",
-        "8": "wnnwn",
-        "9": "nwnwn",
-    }
+class CodigoBoleto(NamedTuple):
+    codigo_barras: str
+    linha_digitavel: str
+
+
+class CalculadoraCodigos:
+    """Codes for many titles of the same account; the account is parsed once."""
+
+    def __init__(self, conta) -> None:
+        self.campos_conta = _campos_conta(conta)
+
+    def codigo(self, nosso_numero: str, documento: str, vencimento: DateLike | None, valor: float) -> CodigoBoleto:
+        codigo = _codigo_com_campos(self.campos_conta, nosso_numero, documento, vencimento, valor)
+        return CodigoBoleto(codigo, _linha_do_codigo(codigo))
+
+
+_PADROES_ITF = {
+    "0": "nnwwn",
+    "1": "wnnnw",
+    "2": "nwnnw",
+    "3": "wwnnn",
+    "4": "nnwnw",
+    "5": "wnwnn",
+    "6": "nwwnn",
+    "7": "nnnww",
+    "8": "wnnwn",
+    "9": "nwnwn",
+}
+# (largura, espaço?) das barras de início e de fim do ITF
+_INICIO_ITF = tuple((ch, bool(idx % 2)) for idx, ch in enumerate("nnnn"))
+_FIM_ITF = tuple((ch, bool(idx % 2)) for idx, ch in enumerate("wnn"))
+
 
+def _elementos_par(par: str):
+    for barra, espaco in zip(_PADROES_ITF[par[0]], _PADROES_ITF[par[1]]):
+        yield barra, False
+        yield espaco, True
+
+
+def _span_bar(largura: str, espaco: bool = False) -> str:
+    classe = largura
+    if espaco:
+        classe += " s"
+    return f"<span class='{classe}'></span>"
+
+
+# HTML de cada par de dígitos, montado uma vez: o código vira 22 concatenações
+_PARES_HTML = {
+    f"{a}{b}": "".join(_span_bar(*elemento) for elemento in _elementos_par(f"{a}{b}"))
+    for a in _PADROES_ITF
+    for b in _PADROES_ITF
+}
+_INICIO_HTML = "".join(_span_bar(*elemento) for elemento in _INICIO_ITF)
+_FIM_HTML = "".join(_span_bar(*elemento) for elemento in _FIM_ITF)
+
+
+def _pares(numero: str) -> List[str]:
     numero = digits(numero)
     if len(numero) % 2:
         numero = "0" + numero
+    return [numero[i:i + 2] for i in range(0, len(numero), 2)]
 
-    def span_bar(largura: str, espaco: bool = False) -> str:
-        classe = largura
-        if espaco:
-            classe += " s"
-        return f"<span class='{classe}'></span>"
-
-    partes = []
-    for idx, ch in enumerate("nnnn"):
-        partes.append(span_bar(ch, espaco=bool(idx % 2)))
-
-    for i in range(0, len(numero), 2):
-        barras = padroes[numero[i]]
-        espacos = padroes[numero[i + 1]]
-        for b, e in zip(barras, espacos):
-            partes.append(span_bar(b))
-            partes.append(span_bar(e, espaco=True))
 
-    for idx, ch in enumerate("wnn"):
-        partes.append(span_bar(ch, espaco=bool(idx % 2)))
+@lru_cache(maxsize=4096)
+def codigo_barras_html(numero: str) -> str:
+    """Generate the ITF barcode spans used by the boleto template."""
 
-    return "".join(partes)
+    return _INICIO_HTML + "".join(_PARES_HTML[par] for par in _pares(numero)) + _FIM_HTML
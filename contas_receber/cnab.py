@@ -1,11 +1,16 @@
-﻿import re
+﻿import io
+import re
 import unicodedata
 from dataclasses import dataclass
 from datetime import date, datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
-from typing import List, Optional
+from itertools import chain
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from cnab240 import TAMANHO_REGISTRO, SegmentoP, SegmentoT, ler_registros
 
 ALLOWED_ALFA_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 /-.")
+_NAO_DIGITO = re.compile(r'\D')
 
 
 @dataclass
@@ -28,356 +33,431 @@ class Titulo:
     uso_empresa: str = ''
 
 
+def _digits(value: Optional[str]) -> str:
+    return _NAO_DIGITO.sub('', value or '')
+
+
+# Mantém os caracteres permitidos, troca vírgula por espaço e descarta o resto
+_TABELA_ALFA = {
+    codigo: chr(codigo) if chr(codigo) in ALLOWED_ALFA_CHARS else (' ' if chr(codigo) == ',' else None)
+    for codigo in range(128)
+}
+
+
+def _alfa(value, length: int) -> str:
+    if not value:
+        return ' ' * length
+    texto = str(value).upper()
+    if not texto.isascii():
+        # Sem os acentos (caracteres combinantes após a decomposição) e
+        # demais caracteres fora do ASCII, que não são permitidos
+        texto = unicodedata.normalize('NFKD', str(value)).upper().encode('ascii', 'ignore').decode('ascii')
+    texto = texto.translate(_TABELA_ALFA).strip()
+    return texto[:length].ljust(length)
+
+
+def _num(value, length: int) -> str:
+    digits = _NAO_DIGITO.sub('', str(value)) if value not in (None, '') else ''
+    if not digits:
+        digits = '0'
+    return digits[-length:].rjust(length, '0')
+
+
+def _decimal(value, length: int, decimals: int = 2) -> str:
+    quant = Decimal('1').scaleb(-decimals)
+    valor = Decimal(value or 0).quantize(quant, rounding=ROUND_HALF_UP)
+    sem_ponto = f"{valor:.{decimals}f}".replace('.', '')
+    return sem_ponto[-length:].rjust(length, '0')
+
+
+def _date(value: Optional[date], length: int = 8) -> str:
+    if not value:
+        return '00000000'
+    return value.strftime('%d%m%Y')
+
+
+def _texto(value, length: int) -> str:
+    return str(value or '')[:length].ljust(length)
+
+
+# Tipos de campo: N numérico (zeros à esquerda), A alfanumérico (maiúsculas
+# sem acento, espaços à direita), V valor com 2 casas implícitas, D data
+# DDMMAAAA e X texto já formatado pelo writer
+FORMATOS = {'N': _num, 'A': _alfa, 'V': _decimal, 'D': _date, 'X': _texto}
+
+
+class Campo(NamedTuple):
+    """Campo do leiaute: posição inicial (1 a 240, como no manual), tamanho e tipo.
+
+    ``fixo`` é o valor de campos constantes (``''`` para brancos ou zeros).
+    """
+
+    nome: str
+    inicio: int
+    tamanho: int
+    tipo: str
+    fixo: Optional[str] = None
+
+
+class RegistroPreparado:
+    """Registro com as partes constantes já formatadas."""
+
+    __slots__ = ('nome', 'partes')
+
+    def __init__(self, nome: str, partes) -> None:
+        self.nome = nome
+        self.partes = tuple(partes)
+
+    def formatar(self, **valores) -> str:
+        try:
+            return ''.join([
+                parte if parte.__class__ is str else parte[1](valores[parte[0]], parte[2])
+                for parte in self.partes
+            ])
+        except KeyError as exc:
+            raise ValueError(f'{self.nome}: campo {exc.args[0]} nao informado') from None
+
+
+class Leiaute:
+    """Tabela de campos de um registro de 240 posições, validada na criação."""
+
+    def __init__(self, nome: str, campos: Iterable[Campo]) -> None:
+        self.nome = nome
+        self.campos = tuple(campos)
+        posicao = 1
+        for campo in self.campos:
+            if campo.inicio != posicao:
+                raise ValueError(f'{nome}: campo {campo.nome} deveria iniciar na posicao {posicao}')
+            if campo.tipo not in FORMATOS:
+                raise ValueError(f'{nome}: tipo {campo.tipo!r} invalido no campo {campo.nome}')
+            posicao += campo.tamanho
+        if posicao != TAMANHO_REGISTRO + 1:
+            raise ValueError(f'{nome}: registro com {posicao - 1} posicoes')
+
+    def preparar(self, **valores) -> RegistroPreparado:
+        """Formata os campos fixos e os de ``valores``; os demais vêm em ``formatar``."""
+        desconhecidos = set(valores) - {campo.nome for campo in self.campos}
+        if desconhecidos:
+            raise ValueError(f'{self.nome}: campos desconhecidos {sorted(desconhecidos)}')
+        partes = []
+        constante = []
+        for campo in self.campos:
+            formato = FORMATOS[campo.tipo]
+            if campo.fixo is not None:
+                constante.append(formato(campo.fixo, campo.tamanho))
+            elif campo.nome in valores:
+                constante.append(formato(valores[campo.nome], campo.tamanho))
+            else:
+                if constante:
+                    partes.append(''.join(constante))
+                    constante = []
+                partes.append((campo.nome, formato, campo.tamanho))
+        if constante:
+            partes.append(''.join(constante))
+        return RegistroPreparado(self.nome, partes)
+
+
+def _controle(lote: str, registro: str) -> List[Campo]:
+    return [
+        Campo('banco', 1, 3, 'N'),
+        Campo('lote', 4, 4, 'N', lote),
+        Campo('registro', 8, 1, 'N', registro),
+    ]
+
+
+def _detalhe(segmento: str) -> List[Campo]:
+    return _controle('1', '3') + [
+        Campo('sequencial', 9, 5, 'N'),
+        Campo('segmento', 14, 1, 'X', segmento),
+        Campo('cnab', 15, 1, 'A', ''),
+        Campo('movimento', 16, 2, 'N', '01'),
+    ]
+
+
+def _empresa_conta(inicio: int, tamanho_inscricao: int) -> List[Campo]:
+    """Inscrição da empresa, convênio, agência e conta (headers de arquivo e lote)."""
+    campos = [
+        Campo('tipo_inscricao', inicio, 1, 'X'),
+        Campo('inscricao', inicio + 1, tamanho_inscricao, 'N'),
+    ]
+    inicio += 1 + tamanho_inscricao
+    return campos + [
+        Campo('convenio', inicio, 20, 'X'),
+        Campo('agencia', inicio + 20, 5, 'N'),
+        Campo('agencia_dv', inicio + 25, 1, 'A'),
+        Campo('conta', inicio + 26, 12, 'N'),
+        Campo('conta_dv', inicio + 38, 1, 'A'),
+        Campo('agencia_conta_dv', inicio + 39, 1, 'A', ''),
+        Campo('nome_empresa', inicio + 40, 30, 'A'),
+    ]
+
+
+HEADER_ARQUIVO = Leiaute('header_arquivo', _controle('0', '0') + [
+    Campo('cnab', 9, 9, 'A', ''),
+    *_empresa_conta(18, 14),
+    Campo('nome_banco', 103, 30, 'A'),
+    Campo('cnab_2', 133, 10, 'A', ''),
+    Campo('codigo_remessa', 143, 1, 'N', '1'),
+    Campo('data_geracao', 144, 8, 'D'),
+    Campo('hora_geracao', 152, 6, 'X'),
+    Campo('numero_sequencial', 158, 6, 'X'),
+    Campo('versao_leiaute', 164, 3, 'N', '083'),
+    Campo('densidade', 167, 5, 'N', '1600'),
+    Campo('reservado_banco', 172, 20, 'A', ''),
+    Campo('reservado_empresa', 192, 20, 'A', ''),
+    Campo('cnab_3', 212, 29, 'A', ''),
+])
+
+HEADER_LOTE = Leiaute('header_lote', _controle('1', '1') + [
+    Campo('tipo_operacao', 9, 1, 'X', 'R'),
+    Campo('tipo_servico', 10, 2, 'N', '01'),
+    Campo('uso_exclusivo', 12, 2, 'A', ''),
+    Campo('versao_leiaute', 14, 3, 'N', '042'),
+    Campo('cnab', 17, 1, 'A', ''),
+    *_empresa_conta(18, 15),
+    Campo('mensagem_1', 104, 40, 'A', ''),
+    Campo('mensagem_2', 144, 40, 'A', ''),
+    Campo('numero_remessa', 184, 8, 'N', '1'),
+    Campo('data_gravacao', 192, 8, 'D'),
+    Campo('data_credito', 200, 8, 'N', ''),
+    Campo('cnab_2', 208, 33, 'A', ''),
+])
+
+SEGMENTO_P = Leiaute('segmento_P', _detalhe('P') + [
+    Campo('agencia', 18, 5, 'N'),
+    Campo('agencia_dv', 23, 1, 'A'),
+    Campo('conta', 24, 12, 'N'),
+    Campo('conta_dv', 36, 1, 'A'),
+    Campo('agencia_conta_dv', 37, 1, 'A', ''),
+    Campo('nosso_numero', 38, 20, 'X'),
+    Campo('carteira', 58, 1, 'X'),
+    Campo('forma_cadastramento', 59, 1, 'N', '1'),
+    Campo('tipo_documento', 60, 1, 'N', '1'),
+    Campo('emissao_boleto', 61, 1, 'N', '2'),
+    Campo('distribuicao', 62, 1, 'N', '2'),
+    Campo('numero_documento', 63, 15, 'A'),
+    Campo('vencimento', 78, 8, 'D'),
+    Campo('valor', 86, 15, 'V'),
+    Campo('agencia_cobradora', 101, 5, 'N', ''),
+    Campo('agencia_cobradora_dv', 106, 1, 'A', ''),
+    Campo('especie', 107, 2, 'N'),
+    Campo('aceite', 109, 1, 'X', 'N'),
+    Campo('data_emissao', 110, 8, 'D'),
+    Campo('codigo_juros', 118, 1, 'X'),
+    Campo('data_juros', 119, 8, 'D'),
+    Campo('valor_juros', 127, 15, 'V'),
+    Campo('codigo_desconto', 142, 1, 'N', ''),
+    Campo('data_desconto', 143, 8, 'N', ''),
+    Campo('valor_desconto', 151, 15, 'N', ''),
+    Campo('valor_iof', 166, 15, 'N', ''),
+    Campo('valor_abatimento', 181, 15, 'N', ''),
+    Campo('uso_empresa', 196, 25, 'A'),
+    Campo('codigo_protesto', 221, 1, 'X'),
+    Campo('prazo_protesto', 222, 2, 'N'),
+    Campo('codigo_baixa', 224, 1, 'N', ''),
+    Campo('prazo_baixa', 225, 3, 'N', ''),
+    Campo('codigo_moeda', 228, 2, 'N', '09'),
+    Campo('contrato', 230, 10, 'N'),
+    Campo('uso_livre', 240, 1, 'A', ''),
+])
+
+SEGMENTO_Q = Leiaute('segmento_Q', _detalhe('Q') + [
+    Campo('tipo_inscricao', 18, 1, 'X'),
+    Campo('inscricao', 19, 15, 'N'),
+    Campo('nome', 34, 40, 'A'),
+    Campo('endereco', 74, 40, 'A'),
+    Campo('bairro', 114, 15, 'A'),
+    Campo('cep', 129, 5, 'N'),
+    Campo('cep_sufixo', 134, 3, 'N'),
+    Campo('cidade', 137, 15, 'A'),
+    Campo('uf', 152, 2, 'A'),
+    Campo('sacador_tipo_inscricao', 154, 1, 'N', ''),
+    Campo('sacador_inscricao', 155, 15, 'N', ''),
+    Campo('sacador_nome', 170, 40, 'A', ''),
+    Campo('banco_correspondente', 210, 3, 'N', ''),
+    Campo('nosso_numero_correspondente', 213, 20, 'A', ''),
+    Campo('cnab_2', 233, 8, 'A', ''),
+])
+
+SEGMENTO_R = Leiaute('segmento_R', _detalhe('R') + [
+    Campo('codigo_desconto_2', 18, 1, 'N', ''),
+    Campo('data_desconto_2', 19, 8, 'N', ''),
+    Campo('valor_desconto_2', 27, 15, 'N', ''),
+    Campo('codigo_desconto_3', 42, 1, 'N', ''),
+    Campo('data_desconto_3', 43, 8, 'N', ''),
+    Campo('valor_desconto_3', 51, 15, 'N', ''),
+    Campo('codigo_multa', 66, 1, 'X'),
+    Campo('data_multa', 67, 8, 'D'),
+    Campo('valor_multa', 75, 15, 'V'),
+    Campo('informacao_pagador', 90, 10, 'A', ''),
+    Campo('mensagem_3', 100, 40, 'A', ''),
+    Campo('mensagem_4', 140, 40, 'A', ''),
+    Campo('cnab_2', 180, 20, 'A', ''),
+    Campo('ocorrencias', 200, 8, 'N', ''),
+    Campo('banco_debito', 208, 3, 'N', ''),
+    Campo('agencia_debito', 211, 5, 'N', ''),
+    Campo('agencia_debito_dv', 216, 1, 'A', ''),
+    Campo('conta_debito', 217, 12, 'N', ''),
+    Campo('conta_debito_dv', 229, 1, 'N', ''),
+    Campo('agencia_conta_debito_dv', 230, 1, 'A', ''),
+    Campo('aviso_debito', 231, 1, 'N', ''),
+    Campo('cnab_3', 232, 9, 'A', ''),
+])
+
+TRAILER_LOTE = Leiaute('trailer_lote', _controle('1', '5') + [
+    Campo('cnab', 9, 9, 'A', ''),
+    Campo('quantidade_registros', 18, 6, 'N'),
+    Campo('valor_total', 24, 18, 'V'),
+    Campo('quantidade_moeda', 42, 18, 'N', ''),
+    Campo('aviso', 60, 6, 'N', ''),
+    Campo('cnab_2', 66, 165, 'A', ''),
+    Campo('ocorrencias', 231, 10, 'A', ''),
+])
+
+TRAILER_ARQUIVO = Leiaute('trailer_arquivo', _controle('9999', '9') + [
+    Campo('cnab', 9, 9, 'A', ''),
+    Campo('quantidade_lotes', 18, 6, 'N', '1'),
+    Campo('quantidade_registros', 24, 6, 'N'),
+    Campo('quantidade_contas', 30, 6, 'N', ''),
+    Campo('cnab_2', 36, 205, 'A', ''),
+])
+
+
 class CNAB240Writer:
+    """Remessa CNAB240 de cobrança (um lote), gerada registro a registro.
+
+    Os campos da empresa e da conta são formatados uma vez por remessa em
+    ``Leiaute.preparar``; em cada título só os campos dele são montados. Os
+    títulos são consumidos sob demanda e as quantidades e o total dos
+    trailers acumulados no caminho, então ``escrever`` grava remessas de
+    qualquer tamanho sem manter as linhas em memória.
+    """
+
     def __init__(self, empresa, conta):
         self.empresa = empresa
         self.conta = conta
 
-    def gerar(self, titulos: List[Titulo]) -> str:
-        if not titulos:
+    def gerar(self, titulos: Iterable[Titulo]) -> str:
+        """Conteúdo completo da remessa."""
+        arquivo = io.StringIO(newline='')
+        self.escrever(arquivo, titulos)
+        return arquivo.getvalue()
+
+    def escrever(self, arquivo: IO[str], titulos: Iterable[Titulo]) -> None:
+        """Grava a remessa em ``arquivo`` (texto; abra com ``newline=''``)."""
+        arquivo.writelines(linha + '\r\n' for linha in self.registros(titulos))
+
+    def registros(self, titulos: Iterable[Titulo]) -> Iterator[str]:
+        """Linhas da remessa, sem a quebra de linha."""
+        titulos = iter(titulos)
+        primeiro = next(titulos, None)
+        if primeiro is None:
             raise ValueError('Nenhum titulo informado para gerar a remessa')
 
         timestamp = datetime.now()
-        linhas = [
-            self._header_arquivo(timestamp),
-            self._header_lote(timestamp),
-        ]
+        hoje = timestamp.date()
+        header_arquivo, header_lote, segmento_p, segmento_q, segmento_r, trailer_lote, trailer_arquivo = (
+            self._preparar(timestamp)
+        )
+        yield header_arquivo.formatar()
+        yield header_lote.formatar()
 
-        sequencial = 1
+        sequencial = 0
         total_valor = Decimal('0.00')
-        for titulo in titulos:
+        for titulo in chain((primeiro,), titulos):
             valor = Decimal(str(titulo.valor or 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
             total_valor += valor
-            linhas.append(self._segmento_p(sequencial, titulo, valor, timestamp))
-            sequencial += 1
-            linhas.append(self._segmento_q(sequencial, titulo))
-            sequencial += 1
-            linhas.append(self._segmento_r(sequencial, titulo, valor, timestamp))
-            sequencial += 1
-
-        registros_lote = len(titulos) * 3 + 2
-        linhas.append(self._trailer_lote(registros_lote, total_valor))
-        total_registros = len(titulos) * 3 + 4
-        linhas.append(self._trailer_arquivo(total_registros))
-        return '\r\n'.join(linhas) + '\r\n'
-
-    def _header_arquivo(self, timestamp: datetime) -> str:
-        banco = self._num(self._digits(getattr(self.conta, 'banco', '')), 3)
-        lote = '0000'
-        registro = '0'
-        cnab = ' ' * 9
-        tipo_inscricao = self._tipo_inscricao(getattr(self.empresa, 'documento', ''))
-        inscricao = self._num(self._digits(getattr(self.empresa, 'documento', '')), 14)
-        convenio = self._convenio()
-        agencia_num, agencia_dv = self._split_num_dv(getattr(self.conta, 'agencia', ''))
-        conta_num, conta_dv = self._split_num_dv(getattr(self.conta, 'conta', ''))
-        nome_empresa = self._alfa(getattr(self.empresa, 'razao_social_nome', ''), 30)
-        nome_banco = self._alfa(getattr(self.conta, 'nome_banco', '') or 'BANCO DO BRASIL S.A.', 30)
-        codigo_remessa = '1'
-        data_geracao = timestamp.strftime('%d%m%Y')
-        hora_geracao = timestamp.strftime('%H%M%S')
-        numero_sequencial = timestamp.strftime('%H%M%S')
-        layout_version = '083'
-        densidade = '01600'
-        reservado_banco = ' ' * 20
-        reservado_empresa = ' ' * 20
-        cnab_final = ' ' * 29
-        return (
-            banco
-            + lote
-            + registro
-            + cnab
-            + tipo_inscricao
-            + inscricao
-            + convenio
-            + self._num(agencia_num, 5)
-            + self._alfa(agencia_dv or ' ', 1)
-            + self._num(conta_num, 12)
-            + self._alfa(conta_dv or ' ', 1)
-            + ' '
-            + nome_empresa
-            + nome_banco
-            + ' ' * 10
-            + codigo_remessa
-            + data_geracao
-            + hora_geracao
-            + numero_sequencial
-            + layout_version
-            + densidade
-            + reservado_banco
-            + reservado_empresa
-            + cnab_final
-        )
+            yield segmento_p.formatar(sequencial=sequencial + 1, **self._campos_p(titulo, valor, hoje))
+            yield segmento_q.formatar(sequencial=sequencial + 2, **self._campos_q(titulo))
+            yield segmento_r.formatar(sequencial=sequencial + 3, **self._campos_r(titulo, hoje))
+            sequencial += 3
 
-    def _header_lote(self, timestamp: datetime) -> str:
-        banco = self._num(self._digits(getattr(self.conta, 'banco', '')), 3)
-        lote = '0001'
-        registro = '1'
-        tipo_operacao = 'R'
-        tipo_servico = '01'
-        uso_exclusivo = ' ' * 2
-        layout_lote = '042'
-        cnab = ' '
-        tipo_inscricao = self._tipo_inscricao(getattr(self.empresa, 'documento', ''))
-        inscricao = self._num(self._digits(getattr(self.empresa, 'documento', '')), 15)
-        convenio = self._convenio()
-        agencia_num, agencia_dv = self._split_num_dv(getattr(self.conta, 'agencia', ''))
-        conta_num, conta_dv = self._split_num_dv(getattr(self.conta, 'conta', ''))
-        nome_empresa = self._alfa(getattr(self.empresa, 'razao_social_nome', ''), 30)
-        mensagem1 = ' ' * 40
-        mensagem2 = ' ' * 40
-        numero_remessa = '00000001'
-        data_gravacao = timestamp.strftime('%d%m%Y')
-        data_credito = '00000000'
-        uso_final = ' ' * 33
-        return (
-            banco
-            + lote
-            + registro
-            + tipo_operacao
-            + tipo_servico
-            + uso_exclusivo
-            + layout_lote
-            + cnab
-            + tipo_inscricao
-            + inscricao
-            + convenio
-            + self._num(agencia_num, 5)
-            + self._alfa(agencia_dv or ' ', 1)
-            + self._num(conta_num, 12)
-            + self._alfa(conta_dv or ' ', 1)
-            + ' '
-            + nome_empresa
-            + mensagem1
-            + mensagem2
-            + numero_remessa
-            + data_gravacao
-            + data_credito
-            + uso_final
-        )
+        yield trailer_lote.formatar(quantidade_registros=sequencial + 2, valor_total=total_valor)
+        yield trailer_arquivo.formatar(quantidade_registros=sequencial + 4)
 
-    def _segmento_p(self, sequencial: int, titulo: Titulo, valor: Decimal, timestamp: datetime) -> str:
-        banco = self._num(self._digits(getattr(self.conta, 'banco', '')), 3)
-        lote = '0001'
-        registro = '3'
-        seq = self._num(sequencial, 5)
-        segmento = 'P'
-        cnab = ' '
-        movimento = '01'
+    def _preparar(self, timestamp: datetime) -> Tuple[RegistroPreparado, ...]:
+        banco = getattr(self.conta, 'banco', '')
+        documento = getattr(self.empresa, 'documento', '')
         agencia_num, agencia_dv = self._split_num_dv(getattr(self.conta, 'agencia', ''))
         conta_num, conta_dv = self._split_num_dv(getattr(self.conta, 'conta', ''))
-        nosso_numero = self._nosso_numero(titulo)
-        carteira = self._carteira_codigo()
-        forma_cadastramento = '1'
-        tipo_documento = '1'
-        emissao_boleto = '2'
-        distribuicao = '2'
-        numero_documento = self._alfa(titulo.numero_documento or titulo.nosso_numero, 15)
-        data_vencimento = self._date(titulo.data_vencimento or timestamp.date())
-        valor_titulo = self._decimal(valor, 15, 2)
-        agencia_cobradora = '00000'
-        dv_cobradora = ' '
-        especie = self._num(self._digits(getattr(self.conta, 'especie_documento', '')) or '02', 2)
-        aceite = 'N'
-        data_emissao = self._date(titulo.data_emissao or timestamp.date())
-        codigo_juros, data_juros, valor_juros = self._juros_fields(titulo, valor, timestamp)
-        codigo_desconto = '0'
-        data_desconto = '00000000'
-        valor_desconto = '0' * 15
-        valor_iof = '0' * 15
-        valor_abatimento = '0' * 15
-        uso_empresa = self._alfa(titulo.uso_empresa or numero_documento.strip(), 25)
+        conta = dict(agencia=agencia_num, agencia_dv=agencia_dv, conta=conta_num, conta_dv=conta_dv)
+        empresa = dict(
+            conta,
+            tipo_inscricao=self._tipo_inscricao(documento),
+            inscricao=documento,
+            convenio=self._convenio(),
+            nome_empresa=getattr(self.empresa, 'razao_social_nome', ''),
+        )
         codigo_protesto, prazo_protesto = self._protesto_fields()
-        codigo_baixa = '0'
-        prazo_baixa = '000'
-        codigo_moeda = '09'
-        numero_contrato = self._num(self._digits(getattr(self.conta, 'contrato', '')), 10)
-        uso_livre = ' '
+        hora = timestamp.strftime('%H%M%S')
         return (
-            banco
-            + lote
-            + registro
-            + seq
-            + segmento
-            + cnab
-            + movimento
-            + self._num(agencia_num, 5)
-            + self._alfa(agencia_dv or ' ', 1)
-            + self._num(conta_num, 12)
-            + self._alfa(conta_dv or ' ', 1)
-            + ' '
-            + nosso_numero
-            + carteira
-            + forma_cadastramento
-            + tipo_documento
-            + emissao_boleto
-            + distribuicao
-            + numero_documento
-            + data_vencimento
-            + valor_titulo
-            + agencia_cobradora
-            + dv_cobradora
-            + especie
-            + aceite
-            + data_emissao
-            + codigo_juros
-            + data_juros
-            + valor_juros
-            + codigo_desconto
-            + data_desconto
-            + valor_desconto
-            + valor_iof
-            + valor_abatimento
-            + uso_empresa
-            + codigo_protesto
-            + prazo_protesto
-            + codigo_baixa
-            + prazo_baixa
-            + codigo_moeda
-            + numero_contrato
-            + uso_livre
+            HEADER_ARQUIVO.preparar(
+                banco=banco,
+                nome_banco=getattr(self.conta, 'nome_banco', '') or 'BANCO DO BRASIL S.A.',
+                data_geracao=timestamp,
+                hora_geracao=hora,
+                numero_sequencial=hora,
+                **empresa,
+            ),
+            HEADER_LOTE.preparar(banco=banco, data_gravacao=timestamp, **empresa),
+            SEGMENTO_P.preparar(
+                banco=banco,
+                carteira=self._carteira_codigo(),
+                especie=_digits(getattr(self.conta, 'especie_documento', '')) or '02',
+                codigo_protesto=codigo_protesto,
+                prazo_protesto=prazo_protesto,
+                contrato=getattr(self.conta, 'contrato', ''),
+                **conta,
+            ),
+            SEGMENTO_Q.preparar(banco=banco),
+            SEGMENTO_R.preparar(banco=banco),
+            TRAILER_LOTE.preparar(banco=banco),
+            TRAILER_ARQUIVO.preparar(banco=banco),
         )
 
-    def _segmento_q(self, sequencial: int, titulo: Titulo) -> str:
-        banco = self._num(self._digits(getattr(self.conta, 'banco', '')), 3)
-        lote = '0001'
-        registro = '3'
-        seq = self._num(sequencial, 5)
-        segmento = 'Q'
-        cnab = ' '
-        movimento = '01'
-        tipo_inscricao = titulo.tipo_inscricao_pagador if titulo.tipo_inscricao_pagador in {'1', '2'} else self._tipo_inscricao(titulo.documento_pagador)
-        inscricao = self._num(self._digits(titulo.documento_pagador), 15)
-        nome = self._alfa(titulo.nome_pagador, 40)
-        endereco = self._alfa(titulo.endereco_pagador, 40)
-        bairro = self._alfa(titulo.bairro_pagador, 15)
-        cep = self._digits(titulo.cep_pagador)[:8]
-        cep_base = self._num(cep[:5], 5)
-        cep_sufixo = self._num(cep[5:], 3)
-        cidade = self._alfa(titulo.cidade_pagador, 15)
-        uf = self._alfa(titulo.uf_pagador, 2)
-        sacador_tipo = '0'
-        sacador_numero = '0' * 15
-        sacador_nome = ' ' * 40
-        banco_corresp = '000'
-        nosso_numero_corresp = ' ' * 20
-        cnab_final = ' ' * 8
-        return (
-            banco
-            + lote
-            + registro
-            + seq
-            + segmento
-            + cnab
-            + movimento
-            + tipo_inscricao
-            + inscricao
-            + nome
-            + endereco
-            + bairro
-            + cep_base
-            + cep_sufixo
-            + cidade
-            + uf
-            + sacador_tipo
-            + sacador_numero
-            + sacador_nome
-            + banco_corresp
-            + nosso_numero_corresp
-            + cnab_final
+    def _campos_p(self, titulo: Titulo, valor: Decimal, hoje: date) -> dict:
+        numero_documento = titulo.numero_documento or titulo.nosso_numero
+        codigo_juros, data_juros, valor_juros = self._juros_fields(titulo, valor, hoje)
+        return dict(
+            nosso_numero=self._nosso_numero(titulo),
+            numero_documento=numero_documento,
+            vencimento=titulo.data_vencimento or hoje,
+            valor=valor,
+            data_emissao=titulo.data_emissao or hoje,
+            codigo_juros=codigo_juros,
+            data_juros=data_juros,
+            valor_juros=valor_juros,
+            uso_empresa=titulo.uso_empresa or _alfa(numero_documento, 15).strip(),
         )
 
-    def _segmento_r(self, sequencial: int, titulo: Titulo, valor: Decimal, timestamp: datetime) -> str:
-        banco = self._num(self._digits(getattr(self.conta, 'banco', '')), 3)
-        lote = '0001'
-        registro = '3'
-        seq = self._num(sequencial, 5)
-        segmento = 'R'
-        cnab = ' '
-        movimento = '01'
-        zeros_15 = '0' * 15
-        codigo_multa = '0'
-        data_multa = '00000000'
-        valor_multa = zeros_15
-        multa = Decimal(str(titulo.multa or 0))
-        if multa > 0:
-            codigo_multa = '2'
-            base_data = titulo.data_vencimento or timestamp.date()
-            data_multa = self._date(base_data + timedelta(days=1))
-            valor_multa = self._decimal(multa, 15, 2)
-        info_pagador = ' ' * 10
-        mensagem3 = ' ' * 40
-        mensagem4 = ' ' * 40
-        cnab_bloco = ' ' * 20
-        ocorrencias = '0' * 8
-        banco_debito = '000'
-        agencia_debito = '00000'
-        dv_agencia = ' '
-        conta_debito = '000000000000'
-        dv_conta = '0'
-        dv_ag_conta = ' '
-        aviso = '0'
-        cnab_final = ' ' * 9
-        return (
-            banco
-            + lote
-            + registro
-            + seq
-            + segmento
-            + cnab
-            + movimento
-            + '0'
-            + '00000000'
-            + zeros_15
-            + '0'
-            + '00000000'
-            + zeros_15
-            + codigo_multa
-            + data_multa
-            + valor_multa
-            + info_pagador
-            + mensagem3
-            + mensagem4
-            + cnab_bloco
-            + ocorrencias
-            + banco_debito
-            + agencia_debito
-            + dv_agencia
-            + conta_debito
-            + dv_conta
-            + dv_ag_conta
-            + aviso
-            + cnab_final
+    def _campos_q(self, titulo: Titulo) -> dict:
+        tipo_inscricao = titulo.tipo_inscricao_pagador
+        if tipo_inscricao not in {'1', '2'}:
+            tipo_inscricao = self._tipo_inscricao(titulo.documento_pagador)
+        cep = _digits(titulo.cep_pagador)[:8]
+        return dict(
+            tipo_inscricao=tipo_inscricao,
+            inscricao=titulo.documento_pagador,
+            nome=titulo.nome_pagador,
+            endereco=titulo.endereco_pagador,
+            bairro=titulo.bairro_pagador,
+            cep=cep[:5],
+            cep_sufixo=cep[5:],
+            cidade=titulo.cidade_pagador,
+            uf=titulo.uf_pagador,
         )
 
-    def _trailer_lote(self, registros_lote: int, total_valor: Decimal) -> str:
-        banco = self._num(self._digits(getattr(self.conta, 'banco', '')), 3)
-        lote = '0001'
-        registro = '5'
-        cnab = ' ' * 9
-        quantidade = self._num(registros_lote, 6)
-        soma_valor = self._decimal(total_valor, 18, 2)
-        quantidade_moeda = '0' * 18
-        aviso = self._num('', 6)
-        cnab_bloco = ' ' * 165
-        ocorrencias = ' ' * 10
-        return banco + lote + registro + cnab + quantidade + soma_valor + quantidade_moeda + aviso + cnab_bloco + ocorrencias
-
-    def _trailer_arquivo(self, total_registros: int) -> str:
-        banco = self._num(self._digits(getattr(self.conta, 'banco', '')), 3)
-        lote = '9999'
-        registro = '9'
-        cnab = ' ' * 9
-        total_lotes = self._num(1, 6)
-        quantidade_registros = self._num(total_registros, 6)
-        quantidade_contas = self._num('', 6)
-        cnab_final = ' ' * 205
-        return banco + lote + registro + cnab + total_lotes + quantidade_registros + quantidade_contas + cnab_final
+    def _campos_r(self, titulo: Titulo, hoje: date) -> dict:
+        multa = Decimal(str(titulo.multa or 0))
+        if multa <= 0:
+            return dict(codigo_multa='0', data_multa=None, valor_multa=0)
+        base_data = titulo.data_vencimento or hoje
+        return dict(codigo_multa='2', data_multa=base_data + timedelta(days=1), valor_multa=multa)
 
     def _convenio(self) -> str:
-        numero = self._digits(getattr(self.conta, 'convenio', ''))
-        carteira = self._digits(getattr(self.conta, 'carteira', '17'))
-        variacao = self._digits(getattr(self.conta, 'variacao', ''))
+        numero = _digits(getattr(self.conta, 'convenio', ''))
+        carteira = _digits(getattr(self.conta, 'carteira', '17'))
+        variacao = _digits(getattr(self.conta, 'variacao', ''))
         if not numero:
             return ' ' * 20
         return (
@@ -388,23 +468,22 @@ class CNAB240Writer:
             + '  '
         )
 
-    def _juros_fields(self, titulo: Titulo, valor: Decimal, timestamp: datetime) -> tuple[str, str, str]:
+    def _juros_fields(self, titulo: Titulo, valor: Decimal, hoje: date) -> tuple[str, Optional[date], Decimal]:
         juros = Decimal(str(titulo.juros_mora or 0))
         if juros <= 0:
-            return '3', '00000000', '0' * 15
-        base_date = titulo.data_vencimento or timestamp.date()
-        data = self._date(base_date + timedelta(days=1))
+            return '3', None, Decimal('0')
+        base_date = titulo.data_vencimento or hoje
         valor_dia = (valor * juros / Decimal('100')) / Decimal('30')
-        return '1', data, self._decimal(valor_dia, 15, 2)
+        return '1', base_date + timedelta(days=1), valor_dia
 
-    def _protesto_fields(self) -> tuple[str, str]:
+    def _protesto_fields(self) -> tuple[str, int]:
         dias = int(getattr(self.conta, 'dias_protesto', 0) or 0)
         if dias > 0:
-            return '1', self._num(dias, 2)
-        return '3', '00'
+            return '1', dias
+        return '3', 0
 
     def _carteira_codigo(self) -> str:
-        carteira = self._digits(getattr(self.conta, 'carteira', ''))
+        carteira = _digits(getattr(self.conta, 'carteira', ''))
         if carteira == '31':
             return '2'
         if carteira == '51' or carteira == '11':
@@ -414,8 +493,8 @@ class CNAB240Writer:
         return (carteira[-1:] or '7')
 
     def _nosso_numero(self, titulo: Titulo) -> str:
-        convenio = self._digits(getattr(self.conta, 'convenio', ''))
-        sequencial = self._digits(titulo.nosso_numero)
+        convenio = _digits(getattr(self.conta, 'convenio', ''))
+        sequencial = _digits(titulo.nosso_numero)
 
         if len(convenio) == 7:
             numero = convenio[-7:] + sequencial.zfill(10)
@@ -425,46 +504,11 @@ class CNAB240Writer:
         return numero[:17].ljust(20)
 
     def _tipo_inscricao(self, documento: str) -> str:
-        digits = self._digits(documento)
+        digits = _digits(documento)
         if len(digits) == 14:
             return '2'
         return '1'
 
-    def _digits(self, value: Optional[str]) -> str:
-        return re.sub(r'\D', '', value or '')
-
-    def _alfa(self, value: Optional[str], length: int) -> str:
-        if not value:
-            return ' ' * length
-        normalized = unicodedata.normalize('NFKD', str(value))
-        chars = []
-        for ch in normalized.upper():
-            if unicodedata.combining(ch):
-                continue
-            if ch in ALLOWED_ALFA_CHARS:
-                chars.append(ch)
-            elif ch == ',':
-                chars.append(' ')
-        texto = ''.join(chars).strip()
-        return texto[:length].ljust(length)
-
-    def _num(self, value, length: int) -> str:
-        digits = re.sub(r'\D', '', str(value)) if value not in (None, '') else ''
-        if not digits:
-            digits = '0'
-        return digits[-length:].rjust(length, '0')
-
-    def _decimal(self, value: Decimal, length: int, decimals: int) -> str:
-        quant = Decimal('1').scaleb(-decimals)
-        valor = Decimal(value or 0).quantize(quant, rounding=ROUND_HALF_UP)
-        sem_ponto = f"{valor:.{decimals}f}".replace('.', '')
-        return sem_ponto[-length:].rjust(length, '0')
-
-    def _date(self, value: Optional[date]) -> str:
-        if not value:
-            return '00000000'
-        return value.strftime('%d%m%Y')
-
     def _split_num_dv(self, value: Optional[str]) -> tuple[str, str]:
         if not value:
             return '', ''
@@ -473,36 +517,36 @@ class CNAB240Writer:
         if match:
             numero, dv = match.groups()
             return numero, dv.upper()
-        digits = self._digits(value)
+        digits = _digits(value)
         return digits, ''
 
 
 class CNAB240Reader:
-    def __init__(self, conteudo: str):
-        self.conteudo = [linha.rstrip('\r\n') for linha in conteudo.splitlines() if linha.strip()]
+    """Lê os títulos liquidados de um retorno CNAB240.
+
+    ``conteudo`` pode ser o texto do arquivo, ``bytes`` ou um stream (o
+    upload ou um arquivo aberto); as linhas são lidas uma a uma por
+    ``cnab240.ler_registros``, sem carregar o arquivo inteiro.
+    """
+
+    def __init__(self, conteudo):
+        self.conteudo = conteudo
 
     def titulos_pagados(self):
-        for linha in self.conteudo:
-            if len(linha) < 240:
+        for nosso_numero, valor, _ in self.liquidacoes():
+            yield nosso_numero, valor
+
+    def liquidacoes(self):
+        """Como ``titulos_pagados``, incluindo o ``Registro.digest`` de cada título."""
+        for registro in ler_registros(self.conteudo):
+            if len(registro) < 240:
+                continue
+            if isinstance(registro, SegmentoP):
+                nosso_numero, valor = registro.nosso_numero, registro.valor_titulo
+            elif isinstance(registro, SegmentoT):
+                nosso_numero, valor = registro.nosso_numero, registro.valor_pago
+            else:
                 continue
-            if linha[7] != '3':
+            if not nosso_numero or valor is None:
                 continue
-            segmento = linha[13]
-            if segmento == 'P':
-                nosso_numero = linha[37:57].strip()
-                if not nosso_numero:
-                    continue
-                valor_str = re.sub(r'\D', '', linha[85:100])
-                if not valor_str:
-                    continue
-                valor = Decimal(valor_str) / Decimal('100')
-                yield nosso_numero, float(valor)
-            elif segmento == 'T':
-                nosso_numero = linha[4:24].strip()
-                if not nosso_numero:
-                    continue
-                valor_str = re.sub(r'\D', '', linha[24:37])
-                if not valor_str:
-                    continue
-                valor = Decimal(valor_str) / Decimal('100')
-                yield nosso_numero, float(valor)
+            yield nosso_numero, float(valor), registro.digest
@@ -115,7 +115,7 @@ class ContaReceber(db.Model):
     observacao = db.Column(db.Text)
     status_conta = db.Column(db.String(20), default='Aberta')
     origem_id = db.Column(db.Integer, db.ForeignKey('origens_cadastro.id'))
-    nosso_numero = db.Column(db.String(20))
+    nosso_numero = db.Column(db.String(20), unique=True, index=True)
     data_cadastro = db.Column(db.DateTime, server_default=db.func.now())
 
     receita = db.relationship(
@@ -0,0 +1,188 @@
+"""Navegador headless reaproveitado entre as renderizações de PDF.
+
+Abrir o Chromium leva mais tempo do que imprimir um boleto. ``PoolNavegador``
+mantém um navegador aberto por processo, com até ``paginas`` abas usadas em
+paralelo e devolvidas a uma lista de abas livres após cada impressão. O
+navegador roda em um loop asyncio próprio, em uma thread em segundo plano,
+de modo que o código síncrono das requisições (e dos processos de
+``pdf_processos``) apenas envia o HTML e aguarda o PDF. O navegador é
+reaberto quando o processo do Chromium morre e a cada ``max_renders``
+impressões, para limitar o consumo de memória.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import shutil
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional
+
+ARGS_PADRAO = ["--no-sandbox", "--disable-gpu", "--disable-dev-shm-usage"]
+
+OPCOES_PDF = {
+    "format": "A4",
+    "printBackground": True,
+    "preferCSSPageSize": True,
+    "margin": {"top": "0mm", "bottom": "0mm", "left": "0mm", "right": "0mm"},
+}
+
+
+class PoolNavegador:
+    """Um navegador aberto com um conjunto de abas reaproveitáveis."""
+
+    def __init__(
+        self,
+        launch: Callable,
+        *,
+        paginas: int = 2,
+        max_renders: int = 200,
+        timeout: float = 60.0,
+        opcoes_launch: Optional[Dict[str, object]] = None,
+    ) -> None:
+        self._launch = launch
+        self.paginas = max(int(paginas), 1)
+        self.max_renders = max(int(max_renders), 1)
+        self.timeout = timeout
+        self.opcoes_launch = dict(opcoes_launch or {})
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        # Estado abaixo só é acessado dentro do loop
+        self._semaforo: Optional[asyncio.Semaphore] = None
+        self._navegador = None
+        self._perfil: Optional[str] = None
+        self._livres: List[object] = []
+        self._em_uso = 0
+        self._renders = 0
+        self._reabrir = False
+        self.aberturas = 0
+
+    # --- interface síncrona ---------------------------------------------
+
+    def renderizar(self, html: str, caminho: str) -> None:
+        """Imprime ``html`` em ``caminho`` (PDF), aguardando no máximo ``timeout``."""
+        futuro = asyncio.run_coroutine_threadsafe(self._renderizar(html, caminho), self._garantir_loop())
+        try:
+            futuro.result(self.timeout)
+        except BaseException:
+            futuro.cancel()
+            raise
+
+    def fechar(self) -> None:
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._fechar_navegador(), loop).result(self.timeout)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        if thread is not None:
+            thread.join(self.timeout)
+        loop.close()
+
+    def _garantir_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._semaforo = asyncio.Semaphore(self.paginas)
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="pool-navegador", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    # --- dentro do loop -------------------------------------------------
+
+    async def _renderizar(self, html: str, caminho: str) -> None:
+        async with self._semaforo:
+            pagina = await self._obter_pagina()
+            sucesso = False
+            try:
+                await pagina.setContent(html, waitUntil="networkidle0")
+                await pagina.emulateMediaType("screen")
+                await pagina.pdf(path=caminho, **OPCOES_PDF)
+                sucesso = True
+            finally:
+                await self._devolver_pagina(pagina, sucesso)
+
+    async def _obter_pagina(self):
+        if self._navegador is None or (self._reabrir and not self._em_uso):
+            await self._abrir_navegador()
+        self._em_uso += 1
+        if self._livres:
+            return self._livres.pop()
+        try:
+            pagina = await self._navegador.newPage()
+            await pagina.setViewport({"width": 800, "height": 1200})
+        except BaseException:
+            self._em_uso -= 1
+            self._reabrir = True
+            raise
+        return pagina
+
+    async def _devolver_pagina(self, pagina, sucesso: bool) -> None:
+        self._em_uso -= 1
+        self._renders += 1
+        if not sucesso:
+            # A aba pode ter ficado em estado inconsistente; se o processo do
+            # navegador morreu, todas as abas são descartadas
+            await _fechar_silenciosamente(pagina)
+            if not self._navegador_vivo():
+                self._reabrir = True
+        else:
+            self._livres.append(pagina)
+        if self._renders >= self.max_renders:
+            self._reabrir = True
+        if self._reabrir and not self._em_uso:
+            await self._fechar_navegador()
+
+    def _navegador_vivo(self) -> bool:
+        processo = getattr(self._navegador, "process", None)
+        return processo is None or processo.poll() is None
+
+    async def _abrir_navegador(self) -> None:
+        await self._fechar_navegador()
+        self._perfil = tempfile.mkdtemp(prefix="boleto-navegador-")
+        opcoes = dict(self.opcoes_launch)
+        opcoes["args"] = ARGS_PADRAO + list(opcoes.get("args", [])) + [f"--user-data-dir={self._perfil}"]
+        self._navegador = await self._launch(
+            handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False, **opcoes
+        )
+        self.aberturas += 1
+
+    async def _fechar_navegador(self) -> None:
+        navegador, perfil = self._navegador, self._perfil
+        self._navegador = self._perfil = None
+        self._livres = []
+        self._renders = 0
+        self._reabrir = False
+        if navegador is not None:
+            await _fechar_silenciosamente(navegador)
+        if perfil:
+            shutil.rmtree(perfil, ignore_errors=True)
+
+
+async def _fechar_silenciosamente(objeto) -> None:
+    try:
+        await objeto.close()
+    except Exception:
+        pass
+
+
+_pool: Optional[PoolNavegador] = None
+_pool_lock = threading.Lock()
+
+
+def obter_pool(launch: Callable, **opcoes) -> PoolNavegador:
+    """Pool do processo, criado na primeira utilização e fechado na saída."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PoolNavegador(launch, **opcoes)
+            atexit.register(_pool.fechar)
+        return _pool
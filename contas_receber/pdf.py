@@ -5,30 +5,25 @@ O arquivo original possuía apenas uma frase solta em português, o que causava
 um ``SyntaxError`` ao importar o módulo. O texto agora fica registrado neste
 docstring, preservando a descrição e garantindo que o interpretador consiga
 executar o restante do módulo normalmente.
+
+O HTML dos boletos é montado em ``boleto_html``; este módulo cuida da
+conversão em PDF pelos mecanismos disponíveis.
 """
 
 from __future__ import annotations
 
-import asyncio
-import base64
 import os
 import shutil
 import subprocess
 import tempfile
-from datetime import datetime
+import threading
 from pathlib import Path
-from typing import Iterable
 
-from flask import current_app, render_template
+from flask import current_app
 
-from .boleto_utils import (
-    codigo_barras_html,
-    codigo_barras_numero,
-    linha_digitavel,
-    digits,
-)
-from caixa_banco.models import ContaBanco
-from .models import EmpresaLicenciada, Pessoa
+from . import navegador
+from .boleto_html import html_pdf_boleto
+from .pdf_motores import SeletorMotores
 
 try:  # WeasyPrint usa dependências nativas; pode estar ausente.
     from weasyprint import HTML  # type: ignore
@@ -38,6 +33,14 @@ except Exception as exc:  # pragma: no cover - depende do SO
 else:
     _WEASYPRINT_ERROR = None
 
+try:  # Local varia entre as versões do WeasyPrint
+    from weasyprint.text.fonts import FontConfiguration  # type: ignore
+except Exception:  # pragma: no cover - depende da versão
+    try:
+        from weasyprint.fonts import FontConfiguration  # type: ignore
+    except Exception:
+        FontConfiguration = None  # type: ignore
+
 try:
     from xhtml2pdf import pisa  # type: ignore
 except Exception:  # pragma: no cover - mantemos fallback manual
@@ -49,139 +52,50 @@ except Exception:  # pragma: no cover - execução sem pyppeteer continua válid
     launch = None  # type: ignore
 
 
-def _resolver_entidades(titulo, empresa=None, conta=None, cliente=None):
-    """Garante que todas as entidades necessárias estejam disponíveis."""
-
-    empresa_resolvida = empresa or EmpresaLicenciada.query.first()
-    conta_resolvida = conta or ContaBanco.query.first()
-    cliente_resolvido = cliente or Pessoa.query.get(titulo.cliente_id)
-
-    if not all([empresa_resolvida, conta_resolvida, cliente_resolvido]):
-        raise ValueError("Dados incompletos para gerar o boleto")
-
-    return empresa_resolvida, conta_resolvida, cliente_resolvido
-
+def gerar_pdf_boleto(titulo, empresa, conta, cliente, filepath: str) -> None:
+    """Gera o PDF do boleto reutilizando o HTML exibido na aplicação."""
 
-def _montar_contexto_boleto(titulo, empresa, conta, cliente):
-    documento = str(titulo.id)
-    valor_float = float(titulo.valor_previsto)
-    nosso_numero = titulo.nosso_numero or ""
+    converter_html_pdf(html_pdf_boleto(titulo, empresa, conta, cliente), filepath)
 
-    linha = linha_digitavel(
-        conta, nosso_numero, titulo.data_vencimento, valor_float, documento
-    )
-    barcode_num = codigo_barras_numero(
-        conta, nosso_numero, documento, valor_float, titulo.data_vencimento
-    )
 
-    banco_bruto = getattr(conta, "banco", "") or ""
-    banco_digitos = digits(banco_bruto)
-    codigo_banco = (banco_digitos[:3] or "000").zfill(3)
-    dv_banco = banco_digitos[3:4]
-    if dv_banco:
-        codigo_banco = f"{codigo_banco}-{dv_banco}"
-
-    contexto = dict(
-        titulo=titulo,
-        empresa=empresa,
-        conta=conta,
-        cliente=cliente,
-        linha_digitavel=linha,
-        barcode=codigo_barras_html(barcode_num),
-        codigo_banco=codigo_banco,
-    )
-    return contexto, barcode_num
-
-
-def render_boleto_html(
-    titulo,
-    *,
-    empresa=None,
-    conta=None,
-    cliente=None,
-    is_pdf=False,
-    template_name="financeiro/contas_a_receber/boleto.html",
-):
-    """Renderiza o boleto em HTML reutilizando o mesmo template da visualização."""
-
-    empresa, conta, cliente = _resolver_entidades(
-        titulo, empresa=empresa, conta=conta, cliente=cliente
-    )
-    contexto, _ = _montar_contexto_boleto(titulo, empresa, conta, cliente)
-    contexto["is_pdf"] = is_pdf
-    logo_bytes = _extract_logo_bytes()
-    contexto["logo_banco_b64"] = base64.b64encode(logo_bytes).decode("utf-8") if logo_bytes else ""
-    contexto["now"] = datetime.now
-    return render_template(template_name, **contexto)
+def converter_html_pdf(html: str, filepath: str) -> None:
+    """Converte o HTML em PDF com o mecanismo escolhido para o processo.
 
+    A ordem dos mecanismos vem da sondagem de ``pdf_motores`` (o mais rápido
+    primeiro, sem os rebaixados pelo disjuntor). Não acessa o banco de dados,
+    apenas ``current_app`` (logger, ``root_path`` e configurações), e por
+    isso também roda nos processos de ``pdf_processos``.
+    """
 
-def _inject_pdf_styles(html: str) -> str:
-    """Garante que o HTML possua regras de impressão adequadas."""
+    seletor_motores().converter(html, filepath)
 
-    if "@page" in html:
-        return html
 
-    styles = (
-        "<style>@page { size: A4; margin: 0; } "
-        "html, body { margin: 0; padding: 0; }""</style>"
+def _render_with_weasyprint(html: str, filepath: str) -> bool:
+    if HTML is None:
+        raise RuntimeError(f"WeasyPrint indisponível ({_WEASYPRINT_ERROR})")
+    HTML(string=html, base_url=current_app.root_path).write_pdf(
+        target=filepath, font_config=_fontes_weasyprint()
     )
-    closing_head = "</head>"
-    if closing_head in html:
-        return html.replace(closing_head, styles + closing_head, 1)
-    return styles + html
+    return True
 
 
-def gerar_pdf_boleto(titulo, empresa, conta, cliente, filepath: str) -> None:
-    """Gera o PDF do boleto reutilizando o HTML exibido na aplicação."""
+_FONTES_WEASYPRINT = None
 
-    empresa, conta, cliente = _resolver_entidades(
-        titulo, empresa=empresa, conta=conta, cliente=cliente
-    )
 
-    html = render_boleto_html(
-        titulo,
-        empresa=empresa,
-        conta=conta,
-        cliente=cliente,
-        is_pdf=True,
-    )
-    html = _inject_pdf_styles(html)
-    
-    if HTML is not None:
-        try:
-            HTML(string=html, base_url=current_app.root_path).write_pdf(target=filepath)
-            return
-        except Exception as exc:
-            current_app.logger.warning(
-                "WeasyPrint falhou (%s). Tentando outras opções.",
-                exc,
-            )
-    else:
-        current_app.logger.info(
-            "WeasyPrint indisponível (%s). Tentando outras opções.",
-            _WEASYPRINT_ERROR,
-        )
+def _fontes_weasyprint():
+    """Configuração de fontes compartilhada pelas conversões do processo."""
 
-    if _render_with_pyppeteer(html, filepath):
-        return
+    global _FONTES_WEASYPRINT
+    if _FONTES_WEASYPRINT is None and FontConfiguration is not None:
+        _FONTES_WEASYPRINT = FontConfiguration()
+    return _FONTES_WEASYPRINT
 
-    if _render_with_chromium(html, filepath):
-        return
 
-    if _render_with_wkhtmltopdf(html, filepath):
-        return
-
-    if pisa is not None:
-        try:
-            _render_with_pisa(html, filepath)
-            return
-        except Exception as exc:
-            current_app.logger.warning(
-                "xhtml2pdf falhou (%s).",
-                exc,
-            )
-
-    raise RuntimeError("Não foi possível gerar o PDF do boleto. Verifique as dependências (WeasyPrint, pyppeteer, etc.)")
+def _render_with_xhtml2pdf(html: str, filepath: str) -> bool:
+    if pisa is None:
+        raise RuntimeError("xhtml2pdf indisponível")
+    _render_with_pisa(html, filepath)
+    return True
 
 
 def _link_callback(uri: str, rel: str) -> str:
@@ -298,46 +212,43 @@ def _render_with_wkhtmltopdf(html: str, filepath: str) -> bool:
 
 
 def _render_with_pyppeteer(html: str, filepath: str) -> bool:
-    """Renderiza o boleto em PDF utilizando o Chromium embarcado do pyppeteer."""
+    """Renderiza o boleto em PDF no navegador mantido aberto pelo pool do processo."""
 
     if launch is None:
         return False
 
-    async def _gerar_pdf() -> None:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            user_data_dir = Path(tmpdir) / "user-data"
-            user_data_dir.mkdir()
-            browser = await launch(
-                args=["--no-sandbox", "--disable-gpu", f"--user-data-dir={user_data_dir}"],
-                handleSIGINT=False,
-                handleSIGTERM=False,
-                handleSIGHUP=False,
-            )
-            try:
-                page = await browser.newPage()
-                await page.setViewport({"width": 800, "height": 1200})
-                await page.setContent(html, waitUntil="networkidle0")
-                await page.emulateMediaType("screen")
-                await page.pdf(
-                    path=str(Path(filepath).resolve()),
-                    format="A4",
-                    printBackground=True,
-                    preferCSSPageSize=True,
-                    margin={"top": "0mm", "bottom": "0mm", "left": "0mm", "right": "0mm"},
-                )
-            finally:
-                await browser.close()
-
     try:
-        # Garante que um loop de eventos esteja disponível e o utiliza para rodar a função assíncrona.
-        # A criação de um novo loop ou a obtenção do existente é gerenciada pelo asyncio.
-        asyncio.run(_gerar_pdf())
+        _pool_navegador().renderizar(html, str(Path(filepath).resolve()))
     except Exception as exc:  # pragma: no cover - depende do ambiente
         current_app.logger.warning("pyppeteer não pôde gerar PDF: %s", exc)
         return False
 
     return Path(filepath).exists()
 
+
+def _pool_navegador() -> navegador.PoolNavegador:
+    config = current_app.config
+    return navegador.obter_pool(
+        launch,
+        paginas=int(config.get("BOLETO_NAVEGADOR_PAGINAS", 2)),
+        max_renders=int(config.get("BOLETO_NAVEGADOR_MAX_RENDERS", 200)),
+        opcoes_launch=_opcoes_navegador(),
+    )
+
+
+def _opcoes_navegador() -> dict:
+    """Usa o Chromium do pyppeteer se já baixado; senão, o navegador instalado."""
+
+    try:
+        from pyppeteer.chromium_downloader import check_chromium  # type: ignore
+
+        if check_chromium():
+            return {}
+    except Exception:  # pragma: no cover - depende da versão do pyppeteer
+        pass
+    comando = _chromium_executable()
+    return {"executablePath": comando[0]} if comando else {}
+
 def _chromium_executable() -> list[str] | None:
     candidatos = [
         Path(os.environ.get("PROGRAMFILES", "")) / "Google/Chrome/Application/chrome.exe",
@@ -357,41 +268,29 @@ def _chromium_executable() -> list[str] | None:
     return None
 
 
-_BANK_LOGO_BYTES: bytes | None = None
-_BANK_LOGO_FILE: Path | None = None
+# Ordem de preferência quando a sondagem empata ou não pode medir
+MOTORES = (
+    ("weasyprint", _render_with_weasyprint),
+    ("pyppeteer", _render_with_pyppeteer),
+    ("chromium", _render_with_chromium),
+    ("wkhtmltopdf", _render_with_wkhtmltopdf),
+    ("xhtml2pdf", _render_with_xhtml2pdf),
+)
 
+_seletor: SeletorMotores | None = None
+_seletor_lock = threading.Lock()
 
-def _bank_logo_path() -> str | None:
-    global _BANK_LOGO_BYTES, _BANK_LOGO_FILE
-    if _BANK_LOGO_FILE and _BANK_LOGO_FILE.exists():
-        return str(_BANK_LOGO_FILE)
-    if _BANK_LOGO_BYTES is None:
-        _BANK_LOGO_BYTES = _extract_logo_bytes()
-    if not _BANK_LOGO_BYTES:
-        return None
-    fd, caminho = tempfile.mkstemp(suffix=".jpg")
-    os.close(fd)
-    Path(caminho).write_bytes(_BANK_LOGO_BYTES)
-    _BANK_LOGO_FILE = Path(caminho)
-    return caminho
 
-def _extract_logo_bytes() -> bytes:
-    template_rel = Path("templates") / "financeiro" / "contas_a_receber" / "boleto.html"
-    template_path = Path(current_app.root_path) / template_rel
-    try:
-        conteudo = template_path.read_text(encoding="utf-8")
-    except FileNotFoundError:
-        return b""
-    marcador = "data:image/jpeg;base64,"
-    inicio = conteudo.find(marcador)
-    if inicio == -1:
-        return b""
-    inicio += len(marcador)
-    fim = conteudo.find('"', inicio)
-    if fim == -1:
-        return b""
-    encoded = conteudo[inicio:fim]
-    try:
-        return base64.b64decode(encoded)
-    except Exception:
-        return b""
\ No newline at end of file
+def seletor_motores() -> SeletorMotores:
+    """Seletor de mecanismos do processo, sondado na primeira conversão."""
+
+    global _seletor
+    with _seletor_lock:
+        if _seletor is None:
+            config = current_app.config
+            _seletor = SeletorMotores(
+                MOTORES,
+                limite_falhas=int(config.get("BOLETO_PDF_MOTOR_FALHAS", 3)),
+                espera=float(config.get("BOLETO_PDF_MOTOR_ESPERA", 300)),
+            )
+        return _seletor
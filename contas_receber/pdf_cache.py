@@ -0,0 +1,206 @@
+"""Cache dos PDFs de boleto endereçado pelo conteúdo.
+
+A chave de um boleto é o SHA-256 dos campos que alimentam o template
+(valores e datas do título, nosso número, pagador, empresa e configuração da
+conta bancária), da versão do template e de ``VERSAO_LEIAUTE``. Enquanto
+nenhum desses dados muda, gerar novamente o boleto apenas publica o PDF já
+convertido em ``boleto_{id}.pdf`` (link físico ou cópia), sem passar pelo
+navegador ou pelo xhtml2pdf.
+
+Os arquivos ficam em ``UPLOAD_FOLDER/boletos/cache``. Cada uso atualiza o
+``mtime`` do arquivo; ``limpar`` remove os que não são usados há mais de
+``BOLETO_PDF_CACHE_DIAS`` dias e, acima de ``BOLETO_PDF_CACHE_MB``, os menos
+usados recentemente. ``BOLETO_PDF_CACHE_MB = 0`` desativa o cache.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from flask import current_app
+
+from .boleto_html import TEMPLATE_BOLETO
+
+# Incremente ao alterar o contexto ou o HTML gerado em pdf.py, para que os
+# PDFs convertidos com a versão anterior deixem de ser usados
+VERSAO_LEIAUTE = "1"
+
+CAMPOS = {
+    "titulo": (
+        "id", "titulo", "data_vencimento", "valor_previsto", "valor_desconto",
+        "valor_multa", "valor_juros", "nosso_numero",
+    ),
+    "cliente": (
+        "documento", "razao_social_nome", "endereco", "bairro", "cidade", "estado", "cep",
+    ),
+    "empresa": (
+        "documento", "razao_social_nome", "nome_fantasia", "endereco", "bairro",
+        "cidade", "estado", "cep",
+    ),
+    "conta": (
+        "banco", "nome_banco", "agencia", "conta", "convenio", "carteira", "variacao",
+        "contrato", "juros_mora", "multa", "dias_protesto", "especie_documento",
+    ),
+}
+
+# Temporários mais antigos que isso são restos de conversões interrompidas
+_IDADE_TEMPORARIO = 3600
+
+_versoes: Dict[str, Tuple[object, str]] = {}
+_versoes_lock = threading.Lock()
+
+
+def _normalizar(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, (Decimal, float)) or (isinstance(valor, int) and not isinstance(valor, bool)):
+        # 100, 100.0 e Decimal('100.00') produzem a mesma chave
+        return format(Decimal(str(valor)).normalize(), "f")
+    return valor
+
+
+def _campos(objeto, nomes: Iterable[str]) -> Dict[str, object]:
+    return {nome: _normalizar(getattr(objeto, nome, None)) for nome in nomes}
+
+
+def versao_template(nome: str = TEMPLATE_BOLETO) -> str:
+    """SHA-256 do fonte do template, recalculado apenas quando o arquivo muda."""
+    ambiente = current_app.jinja_env
+    with _versoes_lock:
+        atual = _versoes.get(nome)
+        if atual is not None:
+            atualizado, versao = atual
+            if atualizado is not None and atualizado():
+                return versao
+        fonte, _, atualizado = ambiente.loader.get_source(ambiente, nome)
+        versao = hashlib.sha256(fonte.encode("utf-8")).hexdigest()
+        _versoes[nome] = (atualizado, versao)
+        return versao
+
+
+def chave_boleto(titulo, empresa, conta, cliente) -> str:
+    """Chave do PDF do boleto para os dados atuais das entidades."""
+    dados = {
+        "leiaute": VERSAO_LEIAUTE,
+        "template": versao_template(),
+        "titulo": _campos(titulo, CAMPOS["titulo"]),
+        "cliente": _campos(cliente, CAMPOS["cliente"]),
+        "empresa": _campos(empresa, CAMPOS["empresa"]),
+        "conta": _campos(conta, CAMPOS["conta"]),
+    }
+    serializado = json.dumps(dados, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serializado.encode("utf-8")).hexdigest()
+
+
+def chave_lote(chaves: Iterable[str]) -> str:
+    """Chave do PDF único de um lote, a partir das chaves dos boletos em ordem."""
+    return hashlib.sha256("lote:".join(chaves).encode("ascii")).hexdigest()
+
+
+class CachePDF:
+    """Diretório de PDFs nomeados pela chave do conteúdo."""
+
+    def __init__(self, diretorio: str, limite_bytes: int, validade_dias: float) -> None:
+        self.diretorio = diretorio
+        self.limite_bytes = limite_bytes
+        self.validade = validade_dias * 86400
+        os.makedirs(diretorio, exist_ok=True)
+
+    def caminho(self, chave: str) -> str:
+        return os.path.join(self.diretorio, f"{chave}.pdf")
+
+    def temporario(self, chave: str) -> str:
+        """Caminho onde a conversão grava o PDF antes de ``guardar``."""
+        return os.path.join(self.diretorio, f"{chave}.{uuid.uuid4().hex}.tmp")
+
+    def guardar(self, chave: str, temporario: str, destino: Optional[str] = None) -> None:
+        """Move a conversão para o cache, publicando-a antes em ``destino``."""
+        if destino is not None:
+            _vincular(temporario, destino)
+        os.replace(temporario, self.caminho(chave))
+
+    def publicar(self, chave: str, destino: str) -> bool:
+        """Publica o PDF da chave em ``destino``; ``False`` se não estiver no cache."""
+        origem = self.caminho(chave)
+        try:
+            os.utime(origem)
+            _vincular(origem, destino)
+        except FileNotFoundError:
+            # Ausente ou removido por ``limpar`` entre as duas operações
+            return False
+        return True
+
+    def descartar(self, temporario: str) -> None:
+        try:
+            os.remove(temporario)
+        except OSError:
+            pass
+
+    def limpar(self) -> int:
+        """Aplica a validade e o limite de tamanho; devolve a quantidade removida."""
+        agora = time.time()
+        pdfs = []
+        total = 0
+        removidos = 0
+        for entrada in os.scandir(self.diretorio):
+            try:
+                if not entrada.is_file():
+                    continue
+                info = entrada.stat()
+                temporario = entrada.name.endswith(".tmp")
+                idade = agora - info.st_mtime
+                if (temporario and idade > _IDADE_TEMPORARIO) or (not temporario and idade > self.validade):
+                    os.remove(entrada.path)
+                    removidos += 1
+                elif not temporario:
+                    pdfs.append((info.st_mtime, info.st_size, entrada.path))
+                    total += info.st_size
+            except FileNotFoundError:
+                continue
+        pdfs.sort()
+        for _, tamanho, caminho in pdfs:
+            if total <= self.limite_bytes:
+                break
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            else:
+                removidos += 1
+            total -= tamanho
+        return removidos
+
+
+def _vincular(origem: str, destino: str) -> None:
+    """Link físico (ou cópia) de ``origem`` em ``destino``, trocado atomicamente."""
+    provisorio = f"{destino}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(origem, provisorio)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(origem, provisorio)
+    os.replace(provisorio, destino)
+
+
+def cache_boletos() -> Optional[CachePDF]:
+    """Cache configurado na aplicação, ou ``None`` se desativado."""
+    config = current_app.config
+    limite_mb = float(config.get("BOLETO_PDF_CACHE_MB", 512))
+    if limite_mb <= 0:
+        return None
+    diretorio = os.path.join(config.get("UPLOAD_FOLDER", "."), "boletos", "cache")
+    return CachePDF(
+        diretorio,
+        int(limite_mb * 1024 * 1024),
+        float(config.get("BOLETO_PDF_CACHE_DIAS", 60)),
+    )
@@ -0,0 +1,240 @@
+"""Escolha do mecanismo de conversão HTML -> PDF de cada processo.
+
+Na primeira conversão (ou quando ``sondar`` é chamado pela tela
+``/gerencial/motores-pdf``), cada mecanismo converte um documento mínimo; os
+que funcionam são ordenados pelo tempo de uma segunda conversão, já sem o
+custo de inicialização. As conversões seguintes vão direto ao mais rápido.
+Um mecanismo que falha na sondagem fica de fora por ``espera`` segundos e
+então é sondado de novo, numa thread em segundo plano, para que nenhuma
+conversão espere pelos timeouts de um mecanismo quebrado; uma falha
+passageira na primeira conversão não o descarta até o próximo restart.
+
+Um disjuntor por mecanismo evita pagar repetidamente por um mecanismo que
+passou a falhar: após ``limite_falhas`` falhas seguidas ele é rebaixado por
+``espera`` segundos e, vencido o prazo, recebe uma nova tentativa; um
+sucesso o restabelece. Se todos estiverem rebaixados, todos são tentados,
+na ordem de ``motores``.
+
+O estado é de cada processo: os processos de ``pdf_processos`` fazem a
+própria sondagem e mantêm o próprio disjuntor.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Recebe (html, caminho do PDF); devolve True se gerou o arquivo
+Conversor = Callable[[str, str], bool]
+
+HTML_SONDAGEM = (
+    "<html><head><meta charset=\"utf-8\"><style>@page { size: A4; margin: 0; }</style></head>"
+    "<body><p>Sondagem do mecanismo de PDF</p></body></html>"
+)
+
+
+class EstadoMotor:
+    """Resultado da sondagem e situação do disjuntor de um mecanismo."""
+
+    def __init__(self, nome: str) -> None:
+        self.nome = nome
+        self.disponivel: Optional[bool] = None
+        self.tempo_ms: Optional[float] = None
+        self.erro: Optional[str] = None
+        self.falhas = 0
+        self.rebaixado_ate = 0.0
+        self.conversoes = 0
+
+    def rebaixado(self, agora: float) -> bool:
+        return self.rebaixado_ate > agora
+
+    def como_dict(self, agora: float) -> Dict[str, object]:
+        return {
+            "nome": self.nome,
+            "disponivel": self.disponivel,
+            "tempo_ms": self.tempo_ms,
+            "erro": self.erro,
+            "falhas": self.falhas,
+            "rebaixado_por": max(self.rebaixado_ate - agora, 0.0),
+            "conversoes": self.conversoes,
+        }
+
+
+class SeletorMotores:
+    """Mecanismos de PDF ordenados pela sondagem, com disjuntor por mecanismo."""
+
+    def __init__(
+        self,
+        motores: Sequence[Tuple[str, Conversor]],
+        limite_falhas: int = 3,
+        espera: float = 300.0,
+    ) -> None:
+        self.motores = list(motores)
+        self.limite_falhas = limite_falhas
+        self.espera = espera
+        self._estados = {nome: EstadoMotor(nome) for nome, _ in self.motores}
+        self._lock = threading.Lock()
+        # Serializa as sondagens sem bloquear quem só consulta o estado
+        self._sondagem_lock = threading.Lock()
+        self.sondado_em: Optional[datetime] = None
+
+    def sondar(self) -> None:
+        """Converte ``HTML_SONDAGEM`` com cada mecanismo e registra o tempo."""
+        with self._sondagem_lock:
+            self._sondar(self.motores)
+            self.sondado_em = datetime.now()
+
+    def _sondar(self, motores: Sequence[Tuple[str, Conversor]]) -> None:
+        # A sondagem roda fora de ``_lock``: conversões em andamento continuam
+        # registrando sucessos e falhas no estado anterior até a troca.
+        estados = {}
+        diretorio = tempfile.mkdtemp(prefix="sondagem-pdf-")
+        try:
+            for nome, conversor in motores:
+                estado = EstadoMotor(nome)
+                try:
+                    for tentativa in range(2):
+                        caminho = os.path.join(diretorio, f"{nome}_{tentativa}.pdf")
+                        inicio = time.perf_counter()
+                        if not conversor(HTML_SONDAGEM, caminho) or not os.path.getsize(caminho):
+                            raise RuntimeError("não instalado ou nenhum PDF gerado")
+                        estado.tempo_ms = (time.perf_counter() - inicio) * 1000
+                    estado.disponivel = True
+                except Exception as exc:
+                    estado.disponivel = False
+                    estado.tempo_ms = None
+                    estado.erro = str(exc) or exc.__class__.__name__
+                    estado.rebaixado_ate = time.monotonic() + self.espera
+                estados[nome] = estado
+                logger.info(
+                    "Mecanismo de PDF %s: %s",
+                    nome,
+                    f"{estado.tempo_ms:.0f} ms" if estado.disponivel else estado.erro,
+                )
+        finally:
+            shutil.rmtree(diretorio, ignore_errors=True)
+        with self._lock:
+            for nome, estado in estados.items():
+                estado.conversoes = self._estados[nome].conversoes
+                self._estados[nome] = estado
+
+    def _pendentes(self) -> List[Tuple[str, Conversor]]:
+        """Mecanismos que falharam na sondagem e cujo rebaixamento venceu."""
+        agora = time.monotonic()
+        with self._lock:
+            return [
+                m for m in self.motores
+                if self._estados[m[0]].disponivel is False and not self._estados[m[0]].rebaixado(agora)
+            ]
+
+    def _ressondar_em_segundo_plano(self) -> None:
+        """Sonda os pendentes numa thread; não faz nada se já há uma sondagem."""
+        if not self._sondagem_lock.acquire(blocking=False):
+            return
+
+        def executar() -> None:
+            try:
+                self._sondar(self._pendentes())
+            except Exception:
+                logger.exception("Erro ao sondar novamente os mecanismos de PDF")
+            finally:
+                self._sondagem_lock.release()
+
+        try:
+            threading.Thread(target=executar, name="sondagem-pdf", daemon=True).start()
+        except Exception:
+            self._sondagem_lock.release()
+            raise
+
+    def candidatos(self) -> List[Tuple[str, Conversor]]:
+        """Mecanismos a tentar, do mais rápido ao mais lento, fora os rebaixados.
+
+        Na primeira chamada todos são sondados. Depois disso os que falharam
+        na sondagem só voltam após uma nova sondagem, feita em segundo plano
+        quando a ``espera`` vence; até lá, só são tentados se nenhum outro
+        estiver disponível.
+        """
+        if self.sondado_em is None:
+            with self._sondagem_lock:
+                if self.sondado_em is None:
+                    self._sondar(self.motores)
+                    self.sondado_em = datetime.now()
+        if self._pendentes():
+            self._ressondar_em_segundo_plano()
+        return self._ordenados()
+
+    def _ordenados(self) -> List[Tuple[str, Conversor]]:
+        with self._lock:
+            agora = time.monotonic()
+            ordem = sorted(
+                self.motores,
+                key=lambda m: (
+                    not self._estados[m[0]].disponivel,
+                    # Sem tempo medido (restabelecido fora da sondagem): por último
+                    self._estados[m[0]].tempo_ms if self._estados[m[0]].tempo_ms is not None else float("inf"),
+                ),
+            )
+            ativos = [
+                m for m in ordem
+                if self._estados[m[0]].disponivel and not self._estados[m[0]].rebaixado(agora)
+            ]
+            return ativos or list(self.motores)
+
+    @property
+    def ativo(self) -> Optional[str]:
+        candidatos = self.candidatos()
+        return candidatos[0][0] if candidatos else None
+
+    @property
+    def ativo_atual(self) -> Optional[str]:
+        """Como ``ativo``, sem sondar: ``None`` antes da primeira sondagem."""
+        return self._ordenados()[0][0] if self.sondado_em is not None and self.motores else None
+
+    def registrar_sucesso(self, nome: str) -> None:
+        with self._lock:
+            estado = self._estados[nome]
+            estado.disponivel = True
+            estado.falhas = 0
+            estado.rebaixado_ate = 0.0
+            estado.conversoes += 1
+
+    def registrar_falha(self, nome: str, erro: str) -> None:
+        with self._lock:
+            estado = self._estados[nome]
+            estado.falhas += 1
+            estado.erro = erro
+            if estado.falhas >= self.limite_falhas:
+                # Meio aberto: vencida a espera, uma nova falha rebaixa de novo
+                estado.falhas = self.limite_falhas - 1
+                estado.rebaixado_ate = time.monotonic() + self.espera
+                logger.warning("Mecanismo de PDF %s rebaixado por %.0f s: %s", nome, self.espera, erro)
+
+    def converter(self, html: str, caminho: str) -> str:
+        """Converte com o primeiro mecanismo que funcionar e devolve o seu nome."""
+        ultimo_erro = "nenhum mecanismo de PDF disponível"
+        for nome, conversor in self.candidatos():
+            try:
+                if conversor(html, caminho):
+                    self.registrar_sucesso(nome)
+                    return nome
+                ultimo_erro = f"{nome}: nenhum PDF gerado"
+            except Exception as exc:
+                ultimo_erro = f"{nome}: {exc}"
+            self.registrar_falha(nome, ultimo_erro)
+        raise RuntimeError(
+            "Não foi possível gerar o PDF do boleto. Verifique as dependências "
+            f"(WeasyPrint, pyppeteer, etc.) - {ultimo_erro}"
+        )
+
+    def estado(self) -> List[Dict[str, object]]:
+        agora = time.monotonic()
+        with self._lock:
+            return [self._estados[nome].como_dict(agora) for nome, _ in self.motores]
@@ -0,0 +1,154 @@
+"""Conversão dos boletos em PDF distribuída entre processos.
+
+O HTML de cada boleto é montado no processo da requisição (onde estão o
+banco de dados e os templates); apenas a conversão HTML -> PDF, que pode
+levar segundos por título, é enviada a um ``ProcessPoolExecutor``. Cada
+processo do pool cria uma aplicação Flask mínima, com o mesmo ``root_path``,
+e as configurações ``BOLETO_*``, para que ``converter_html_pdf`` tenha um
+contexto de aplicação; o navegador do pyppeteer (``navegador.py``) fica
+aberto em cada processo. O pool é criado na primeira utilização, com
+``BOLETO_PDF_PROCESSOS`` processos, e compartilhado pelas requisições
+seguintes; só é substituído quando quebra (um processo morreu), sem afetar
+as conversões que outras requisições já enviaram a um pool saudável.
+
+Com o "spawn", cada processo do pool importa de novo o módulo principal (o
+``app.py``, como ``__mp_main__``, quando iniciado com ``python app.py``).
+Por isso o import do ``app.py`` não acessa o banco nem inicia threads: a
+verificação das migrações, o agendador e o recálculo das posições começam
+na primeira requisição, e o gravador de auditoria no primeiro registro.
+"""
+
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Optional, Tuple
+
+from flask import Flask, current_app
+
+from .pdf import converter_html_pdf
+
+# (identificador, html, caminho do PDF)
+Tarefa = Tuple[object, str, str]
+
+_app: Optional[Flask] = None
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def _iniciar_processo(root_path: str, config: Dict[str, object]) -> None:
+    global _app
+    _app = Flask(__name__, root_path=root_path)
+    _app.config.update(config)
+
+
+def _converter(html: str, caminho: str) -> None:
+    with _app.app_context():
+        converter_html_pdf(html, caminho)
+
+
+def _obter_executor(processos: int) -> ProcessPoolExecutor:
+    """Pool do processo; ``processos`` só é usado sem ``BOLETO_PDF_PROCESSOS``
+    na configuração, e apenas na criação."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            # "spawn" evita herdar as threads e conexões do processo web
+            _executor = ProcessPoolExecutor(
+                max_workers=max(int(current_app.config.get("BOLETO_PDF_PROCESSOS", processos)), 1),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_iniciar_processo,
+                initargs=(
+                    current_app.root_path,
+                    {k: v for k, v in current_app.config.items() if k.startswith("BOLETO_")},
+                ),
+            )
+        return _executor
+
+
+def _descartar_quebrado(executor: ProcessPoolExecutor) -> None:
+    """Descarta ``executor`` se ainda for o pool atual; outra requisição
+    pode já tê-lo substituído por um novo, que continua em uso."""
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _descartar_executor() -> None:
+    """Encerra o pool, cancelando o que estiver na fila (saída do processo)."""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+atexit.register(_descartar_executor)
+
+
+def _mensagem(exc: BaseException) -> str:
+    return str(exc) or exc.__class__.__name__
+
+
+def gerar_pdfs(tarefas: Iterable[Tarefa], processos: int = 1) -> Dict[object, str]:
+    """Converte as tarefas em PDF e devolve ``{identificador: erro}`` das que falharam.
+
+    Com ``processos`` <= 1 a conversão é feita no próprio processo. Caso
+    contrário, no máximo ``2 * processos`` documentos ficam em memória
+    aguardando conversão, de modo que ``tarefas`` pode ser um gerador.
+    """
+    erros: Dict[object, str] = {}
+    if processos <= 1:
+        for identificador, html, caminho in tarefas:
+            try:
+                converter_html_pdf(html, caminho)
+            except Exception as exc:
+                current_app.logger.warning("Falha ao gerar o PDF %s: %s", identificador, exc)
+                erros[identificador] = _mensagem(exc)
+        return erros
+
+    # futuro -> (identificador, pool que recebeu a tarefa)
+    pendentes = {}
+
+    def coletar(concluidos) -> None:
+        quebrados = set()
+        for futuro in concluidos:
+            identificador, executor = pendentes.pop(futuro)
+            exc = futuro.exception()
+            if exc is None:
+                continue
+            # Um processo que morre (falha nativa do mecanismo de PDF) inutiliza
+            # o pool; o próximo envio cria um novo
+            if isinstance(exc, BrokenProcessPool):
+                quebrados.add(executor)
+            current_app.logger.warning("Falha ao gerar o PDF %s: %s", identificador, exc)
+            erros[identificador] = _mensagem(exc)
+        for executor in quebrados:
+            _descartar_quebrado(executor)
+
+    try:
+        for identificador, html, caminho in tarefas:
+            if len(pendentes) >= 2 * processos:
+                concluidos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+                coletar(concluidos)
+            executor = _obter_executor(processos)
+            try:
+                futuro = executor.submit(_converter, html, caminho)
+            except BrokenProcessPool as exc:
+                _descartar_quebrado(executor)
+                erros[identificador] = _mensagem(exc)
+            else:
+                pendentes[futuro] = (identificador, executor)
+        if pendentes:
+            concluidos, _ = wait(pendentes)
+            coletar(concluidos)
+    except BaseException:
+        for futuro in pendentes:
+            futuro.cancel()
+        raise
+    return erros
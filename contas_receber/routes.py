@@ -2,9 +2,10 @@ import os
 from flask import Blueprint, request, jsonify, render_template, url_for, current_app
 from sqlalchemy import bindparam, text
 from caixa_banco import db
+from caixa_banco.arquivos import ArquivoJaProcessado
 from .models import ContaReceber, EmpresaLicenciada, Pessoa
 from .services import gerar_boletos, importar_retorno
-from .pdf import render_boleto_html
+from .boleto_html import render_boleto_html
 
 bp = Blueprint('contas_receber', __name__)
 
@@ -63,6 +64,16 @@ def _append_download_links(payload):
     }
 
 
+def _resposta_boletos(resultado):
+    """Resposta de ``gerar_boletos``: 500 apenas se nenhum PDF foi gerado."""
+    payload = _append_download_links(resultado)
+    erros = resultado.get('erros') or []
+    if erros and not resultado.get('pdfs'):
+        payload['error'] = erros[0]['erro']
+        return jsonify(payload), 500
+    return jsonify(payload)
+
+
 def _format_contrato_label(row):
     partes = [f"#{row['id']}"]
     nome = row.get('nome_inquilino') or ''
@@ -262,7 +273,7 @@ def gerar_boleto(conta_id):
         return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    return jsonify(_append_download_links(resultado))
+    return _resposta_boletos(resultado)
 
 
 @bp.post('/contas-receber/boleto/lote')
@@ -274,13 +285,14 @@ def gerar_boletos_lote():
         return jsonify({'error': 'ids invalidos'}), 400
     if not ids:
         return jsonify({'error': 'Informe ao menos um titulo'}), 400
+    # saida='lote' gera um unico PDF com todos os titulos, um por pagina
     try:
-        resultado = gerar_boletos(ids)
+        resultado = gerar_boletos(ids, data.get('saida') or 'individual')
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    return jsonify(_append_download_links(resultado))
+    return _resposta_boletos(resultado)
 
 
 @bp.post('/contas-receber/retorno')
@@ -288,8 +300,11 @@ def importar_retorno_endpoint():
     arquivo = request.files.get('arquivo')
     if not arquivo:
         return jsonify({'error': 'arquivo obrigatorio'}), 400
-    conteudo = arquivo.read().decode('utf-8')
-    resultado = importar_retorno(conteudo)
+    # O retorno é lido direto do stream do upload, linha a linha
+    try:
+        resultado = importar_retorno(arquivo, request.form.get('conta_id', type=int))
+    except ArquivoJaProcessado as e:
+        return jsonify({'error': str(e)}), 409
     return jsonify(resultado)
 
 
@@ -1,12 +1,25 @@
 ﻿import os
 import re
-from datetime import datetime
+from datetime import date, datetime
+from decimal import Decimal
 from flask import current_app
+from sqlalchemy import bindparam, case, cast, func, select, update
 from caixa_banco import db
+from caixa_banco.arquivos import (
+    ChavesRegistros,
+    registrar_arquivo,
+    registrar_registros,
+    registros_processados,
+    sha256_conteudo,
+    verificar_arquivo,
+)
 from caixa_banco.models import ContaBanco
+from caixa_banco.services import lancar_movimentos
 from .models import EmpresaLicenciada, ContaReceber, Pessoa
 from .cnab import CNAB240Writer, CNAB240Reader, Titulo
-from .pdf import gerar_pdf_boleto
+from .boleto_html import html_pdf_boletos, renderizador
+from .pdf_cache import cache_boletos, chave_boleto, chave_lote
+from .pdf_processos import gerar_pdfs
 
 
 def _digits(value):
@@ -18,7 +31,13 @@ def _tipo_inscricao(value):
     return '2' if len(doc) == 14 else '1'
 
 
-def gerar_boletos(ids):
+# Saídas de ``gerar_boletos``: um PDF por título ou um único PDF com o lote
+SAIDAS_BOLETO = ('individual', 'lote')
+
+
+def gerar_boletos(ids, saida='individual'):
+    if saida not in SAIDAS_BOLETO:
+        raise ValueError("Saida de boletos invalida")
     empresa = EmpresaLicenciada.query.first()
     if not empresa:
         raise ValueError("Empresa licenciada nao cadastrada")
@@ -30,43 +49,17 @@ def gerar_boletos(ids):
         raise ValueError("Nenhum titulo encontrado")
 
     clientes = {}
-    cnab_titulos = []
-    hoje = datetime.now().date()
-
     for titulo in titulos:
         if not titulo.nosso_numero:
             titulo.nosso_numero = f"{titulo.id:010d}"
-        cliente = clientes.get(titulo.cliente_id)
-        if cliente is None:
+        if titulo.cliente_id not in clientes:
             cliente = Pessoa.query.get(titulo.cliente_id)
             if not cliente:
                 raise ValueError("Cliente nao encontrado")
             clientes[titulo.cliente_id] = cliente
-        numero_documento = (titulo.titulo or f"{titulo.id:06d}")[:15]
-        uso_empresa = (titulo.titulo or f"{titulo.id:06d}")[:25]
-        cnab_titulos.append(
-            Titulo(
-                nosso_numero=titulo.nosso_numero,
-                valor=float(titulo.valor_previsto),
-                numero_documento=numero_documento,
-                data_vencimento=titulo.data_vencimento,
-                data_emissao=hoje,
-                juros_mora=float(conta.juros_mora or 0),
-                multa=float(conta.multa or 0),
-                tipo_inscricao_pagador=_tipo_inscricao(getattr(cliente, 'documento', '')),
-                documento_pagador=_digits(getattr(cliente, 'documento', '')),
-                nome_pagador=cliente.razao_social_nome or '',
-                endereco_pagador=cliente.endereco or '',
-                bairro_pagador=cliente.bairro or '',
-                cep_pagador=cliente.cep or '',
-                cidade_pagador=cliente.cidade or '',
-                uf_pagador=cliente.estado or '',
-                uso_empresa=uso_empresa,
-            )
-        )
 
-    writer = CNAB240Writer(empresa, conta)
-    remessa = writer.gerar(cnab_titulos)
+    # Gravada só no fim, direto no arquivo, se todos os PDFs forem gerados
+    remessa = CNAB240Writer(empresa, conta), _titulos_remessa(titulos, clientes, conta)
 
     base = current_app.config.get('UPLOAD_FOLDER', '.')
     boletos_dir = os.path.join(base, 'boletos')
@@ -74,30 +67,264 @@ def gerar_boletos(ids):
     os.makedirs(boletos_dir, exist_ok=True)
     os.makedirs(rem_dir, exist_ok=True)
 
-    pdfs = []
+    carimbo = datetime.now().strftime('%Y%m%d%H%M%S')
+    caminhos = {}
+    erros = {}
+    # PDFs já convertidos são reaproveitados enquanto os dados do boleto não
+    # mudam; as conversões novas vão para o cache (id -> (chave, temporário))
+    cache = cache_boletos()
+    convertidos = {}
+
+    def destino_conversao(identificador, chave, pdf_path):
+        if cache is None:
+            return pdf_path
+        temporario = cache.temporario(chave)
+        convertidos[identificador] = (chave, temporario)
+        return temporario
+
+    if saida == 'lote':
+        # Um único documento, convertido de uma vez; uma falha na conversão
+        # vale para todos os títulos
+        pdf_path = os.path.join(boletos_dir, f"boletos_lote_{carimbo}.pdf")
+        chave = None
+        if cache is not None:
+            chave = chave_lote(
+                chave_boleto(titulo, empresa, conta, clientes[titulo.cliente_id]) for titulo in titulos
+            )
+        if cache is not None and cache.publicar(chave, pdf_path):
+            caminhos['lote'] = pdf_path
+        else:
+            html = html_pdf_boletos(titulos, empresa, conta, clientes, erros)
+            if not erros:
+                destino = destino_conversao('lote', chave, pdf_path)
+                erro = gerar_pdfs([('lote', html, destino)]).get('lote')
+                if erro:
+                    erros.update((titulo.id, erro) for titulo in titulos)
+                    if cache is not None:
+                        cache.descartar(destino)
+                else:
+                    caminhos['lote'] = pdf_path
+                    _guardar_no_cache(cache, convertidos, caminhos, erros)
+        return _concluir_boletos(remessa, rem_dir, carimbo, caminhos, erros)
+
+    # O HTML é montado aqui; a conversão em PDF é distribuída entre
+    # BOLETO_PDF_PROCESSOS processos e as falhas são reportadas por título.
+    def tarefas():
+        chaves = {}
+        a_converter = []
+        for titulo in titulos:
+            if cache is not None:
+                pdf_path = os.path.join(boletos_dir, f"boleto_{titulo.id}.pdf")
+                chaves[titulo.id] = chave_boleto(titulo, empresa, conta, clientes[titulo.cliente_id])
+                if cache.publicar(chaves[titulo.id], pdf_path):
+                    caminhos[titulo.id] = pdf_path
+                    continue
+            a_converter.append(titulo)
+        html_titulos = renderizador().render_many(a_converter, empresa, conta, clientes, erros=erros)
+        for titulo, html in html_titulos:
+            pdf_path = os.path.join(boletos_dir, f"boleto_{titulo.id}.pdf")
+            caminhos[titulo.id] = pdf_path
+            yield titulo.id, html, destino_conversao(titulo.id, chaves.get(titulo.id), pdf_path)
+
+    erros.update(gerar_pdfs(tarefas(), int(current_app.config.get('BOLETO_PDF_PROCESSOS', 1))))
+    _guardar_no_cache(cache, convertidos, caminhos, erros)
+    return _concluir_boletos(remessa, rem_dir, carimbo, caminhos, erros)
+
+
+def _titulos_remessa(titulos, clientes, conta):
+    """Títulos da remessa, montados à medida que o writer os grava."""
+    hoje = datetime.now().date()
+    juros_mora = float(conta.juros_mora or 0)
+    multa = float(conta.multa or 0)
     for titulo in titulos:
         cliente = clientes[titulo.cliente_id]
-        pdf_path = os.path.join(boletos_dir, f"boleto_{titulo.id}.pdf")
-        gerar_pdf_boleto(titulo, empresa, conta, cliente, pdf_path)
-        pdfs.append(pdf_path)
+        numero_documento = (titulo.titulo or f"{titulo.id:06d}")[:15]
+        uso_empresa = (titulo.titulo or f"{titulo.id:06d}")[:25]
+        yield Titulo(
+            nosso_numero=titulo.nosso_numero,
+            valor=float(titulo.valor_previsto),
+            numero_documento=numero_documento,
+            data_vencimento=titulo.data_vencimento,
+            data_emissao=hoje,
+            juros_mora=juros_mora,
+            multa=multa,
+            tipo_inscricao_pagador=_tipo_inscricao(getattr(cliente, 'documento', '')),
+            documento_pagador=_digits(getattr(cliente, 'documento', '')),
+            nome_pagador=cliente.razao_social_nome or '',
+            endereco_pagador=cliente.endereco or '',
+            bairro_pagador=cliente.bairro or '',
+            cep_pagador=cliente.cep or '',
+            cidade_pagador=cliente.cidade or '',
+            uf_pagador=cliente.estado or '',
+            uso_empresa=uso_empresa,
+        )
+
+
+def _guardar_no_cache(cache, convertidos, caminhos, erros):
+    """Move as conversões bem-sucedidas para o cache e as publica em ``caminhos``."""
+    if not convertidos:
+        return
+    for identificador, (chave, temporario) in convertidos.items():
+        if identificador in erros:
+            cache.descartar(temporario)
+        else:
+            cache.guardar(chave, temporario, caminhos[identificador])
+    cache.limpar()
+
 
-    rem_path = os.path.join(rem_dir, f"remessa_{datetime.now().strftime('%Y%m%d%H%M%S')}.rem")
-    with open(rem_path, 'wb') as arquivo:
-        arquivo.write(remessa.encode('ascii'))
+def _concluir_boletos(remessa, rem_dir, carimbo, caminhos, erros):
+    """Grava a remessa e confirma a transação se todos os PDFs foram gerados.
+
+    ``remessa`` é o par ``(CNAB240Writer, títulos)``; os registros vão direto
+    para o arquivo temporário, publicado com ``os.replace`` ao final.
+    """
+    pdfs = [caminho for chave, caminho in caminhos.items() if chave not in erros]
+    if erros:
+        # Sem remessa parcial: nada é gravado e os títulos podem ser reenviados
+        db.session.rollback()
+        return {
+            'pdfs': pdfs,
+            'remessa': None,
+            'erros': [{'id': titulo_id, 'erro': erro} for titulo_id, erro in erros.items()],
+        }
+
+    writer, titulos_remessa = remessa
+    rem_path = os.path.join(rem_dir, f"remessa_{carimbo}.rem")
+    tmp_path = rem_path + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='ascii', newline='') as arquivo:
+            writer.escrever(arquivo, titulos_remessa)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, rem_path)
     db.session.commit()
-    return {'pdfs': pdfs, 'remessa': rem_path}
+    return {'pdfs': pdfs, 'remessa': rem_path, 'erros': []}
 
 
-def importar_retorno(conteudo: str):
-    reader = CNAB240Reader(conteudo)
-    baixados = []
-    erros = []
-    for nosso_numero, valor in reader.titulos_pagados():
-        titulo = ContaReceber.query.filter_by(nosso_numero=nosso_numero).first()
-        if not titulo:
+# Quantidade de títulos resolvidos por consulta/UPDATE na baixa do retorno
+LOTE_RETORNO = 1000
+
+
+# Tipo da coluna em produção (ver "SQL Criação Banco de Dados.txt"); no
+# PostgreSQL um CASE só de literais é ``text``, que não é atribuível ao enum.
+STATUS_CONTA_ENUM = db.Enum(
+    'Aberta', 'Parcial', 'Paga', 'Vencida', 'Cancelada', 'Negociado',
+    name='status_conta_enum',
+    create_constraint=False,
+)
+
+
+def _update_baixa(hoje):
+    """UPDATE executemany (``b_id``, ``b_valor``) com a regra de ContaReceber.marcar_pago."""
+    tabela = ContaReceber.__table__
+    pago = func.coalesce(tabela.c.valor_pago, 0) + bindparam('b_valor')
+    restante = tabela.c.valor_previsto - pago
+    return (
+        update(tabela)
+        .where(tabela.c.id == bindparam('b_id'))
+        .values(
+            valor_pago=pago,
+            data_pagamento=hoje,
+            valor_pendente=case((restante > 0, restante), else_=0),
+            status_conta=cast(case((restante > 0, 'Parcial'), else_='Paga'), STATUS_CONTA_ENUM),
+        )
+    )
+
+
+def _baixar_lote(lote, arquivo, conta, hoje, resultado):
+    """Baixa um lote de ``(nosso_numero, valor, chave)`` com uma consulta e um UPDATE.
+
+    Registros já baixados por outro arquivo (mesma ``chave``) são ignorados.
+    """
+    processados = registros_processados('retorno', [chave for _, _, chave in lote])
+    lote = [item for item in lote if item[2] not in processados]
+    resultado['ignorados'] += len(processados)
+    if not lote:
+        return
+    baixados = resultado['baixados']
+    erros = resultado['erros']
+    encontrados = {
+        linha.nosso_numero: linha
+        for linha in db.session.execute(
+            select(
+                ContaReceber.id,
+                ContaReceber.nosso_numero,
+                ContaReceber.receita_id,
+                ContaReceber.valor_previsto,
+            ).where(ContaReceber.nosso_numero.in_({nosso_numero for nosso_numero, _, _ in lote}))
+        )
+    }
+
+    pagamentos = {}
+    movimentos = []
+    chaves = []
+    for nosso_numero, valor, chave in lote:
+        titulo = encontrados.get(nosso_numero)
+        if titulo is None:
             erros.append({'nosso_numero': nosso_numero, 'erro': 'Titulo nao encontrado'})
             continue
-        titulo.marcar_pago(valor)
+        valor_decimal = Decimal(str(valor))
+        pagamentos[titulo.id] = pagamentos.get(titulo.id, Decimal('0')) + valor_decimal
         baixados.append({'id': titulo.id, 'valor_pago': valor})
-    db.session.commit()
-    return {'baixados': baixados, 'erros': erros}
+        chaves.append(chave)
+        if conta is not None:
+            movimentos.append({
+                'conta_origem_id': conta.id,
+                'conta_origem_tipo': 'banco',
+                'tipo': 'entrada',
+                'valor': valor_decimal,
+                'historico': f'Retorno CNAB - nosso numero {nosso_numero}',
+                'receita_id': titulo.receita_id,
+                'data_movimento': hoje,
+                'valor_previsto': titulo.valor_previsto,
+                'valor_pago': valor_decimal,
+                # associa o lançamento à conta a receber para permitir reversão
+                'documento': f'CR-{titulo.id}',
+            })
+
+    if pagamentos:
+        db.session.execute(
+            _update_baixa(hoje),
+            [{'b_id': titulo_id, 'b_valor': valor} for titulo_id, valor in pagamentos.items()],
+        )
+    lancar_movimentos(movimentos, commit=False)
+    registrar_registros(arquivo, chaves)
+
+
+def importar_retorno(conteudo, conta_id=None):
+    """Baixa os títulos pagos de um retorno CNAB240 (texto, bytes ou stream).
+
+    Os títulos são localizados por ``nosso_numero`` em lotes de
+    ``LOTE_RETORNO`` (uma consulta ``IN`` e um UPDATE por lote) e cada baixa
+    gera a entrada correspondente em ``movimento_financeiro`` na conta
+    bancária ``conta_id`` (por padrão a mesma usada em ``gerar_boletos``).
+    Tudo é gravado em uma única transação.
+
+    Um retorno já importado levanta ``ArquivoJaProcessado`` antes da
+    leitura; liquidações já baixadas por outro arquivo são contadas em
+    ``ignorados``.
+    """
+    sha256 = sha256_conteudo(conteudo)
+    verificar_arquivo('retorno', sha256)
+    conta = ContaBanco.query.get(conta_id) if conta_id else ContaBanco.query.first()
+    hoje = date.today()
+    reader = CNAB240Reader(conteudo)
+    chaves = ChavesRegistros()
+    resultado = {'baixados': [], 'erros': [], 'ignorados': 0}
+    lote = []
+    try:
+        arquivo = registrar_arquivo('retorno', sha256, getattr(conteudo, 'filename', None))
+        for nosso_numero, valor, digest in reader.liquidacoes():
+            lote.append((nosso_numero, valor, chaves.chave(digest)))
+            if len(lote) >= LOTE_RETORNO:
+                _baixar_lote(lote, arquivo, conta, hoje, resultado)
+                lote = []
+        if lote:
+            _baixar_lote(lote, arquivo, conta, hoje, resultado)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return resultado
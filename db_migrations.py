@@ -0,0 +1,213 @@
+"""Migrações versionadas do esquema do banco de dados.
+
+Cada arquivo ``migrations/NNN_descricao.sql`` é uma migração identificada
+pelo número ``NNN``. As versões já aplicadas ficam registradas na tabela
+``schema_migrations``; ``aplicar_migracoes`` executa apenas as pendentes, em
+ordem, e é chamado pelo comando ``flask migrar-banco``. Na inicialização da
+aplicação basta ``migracoes_pendentes``, que faz uma única consulta.
+
+Por padrão cada migração roda em uma transação própria. Arquivos que começam
+com o comentário ``-- migrate: no-transaction`` (necessário para
+``ALTER TYPE ... ADD VALUE`` no PostgreSQL anterior ao 12) são executados
+em autocommit, um comando por vez, e por isso devem ser idempotentes.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Chave arbitrária e fixa do advisory lock ("SIGM" em ASCII)
+ADVISORY_LOCK_KEY = 0x5349474D
+
+SEM_TRANSACAO = "-- migrate: no-transaction"
+
+_NOME_ARQUIVO = re.compile(r"^(\d+)_([\w\-]+)\.sql$")
+_TAG_DOLAR = re.compile(r"\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Migracao:
+    versao: int
+    nome: str
+    caminho: str
+
+    def ler(self) -> str:
+        with open(self.caminho, encoding="utf-8-sig") as arquivo:
+            return arquivo.read()
+
+    @property
+    def transacional(self) -> bool:
+        for linha in self.ler().splitlines():
+            linha = linha.strip()
+            if not linha:
+                continue
+            if not linha.startswith("--"):
+                break
+            if linha.lower() == SEM_TRANSACAO:
+                return False
+        return True
+
+
+def descobrir_migracoes(diretorio: str = MIGRATIONS_DIR) -> List[Migracao]:
+    """Lista as migrações do diretório ordenadas pela versão."""
+    migracoes = {}
+    for arquivo in sorted(os.listdir(diretorio)):
+        encontrado = _NOME_ARQUIVO.match(arquivo)
+        if not encontrado:
+            continue
+        versao = int(encontrado.group(1))
+        if versao in migracoes:
+            raise ValueError(
+                f"Versão de migração duplicada {versao}: "
+                f"{os.path.basename(migracoes[versao].caminho)} e {arquivo}"
+            )
+        migracoes[versao] = Migracao(versao, encontrado.group(2), os.path.join(diretorio, arquivo))
+    return [migracoes[versao] for versao in sorted(migracoes)]
+
+
+def dividir_comandos(script: str) -> List[str]:
+    """Divide um script SQL em comandos, respeitando aspas e blocos ``$$``."""
+    comandos: List[str] = []
+    atual: List[str] = []
+    delimitador: Optional[str] = None
+    i, n = 0, len(script)
+    while i < n:
+        if delimitador:
+            if script.startswith(delimitador, i):
+                atual.append(delimitador)
+                i += len(delimitador)
+                delimitador = None
+            else:
+                atual.append(script[i])
+                i += 1
+            continue
+        char = script[i]
+        if script.startswith("--", i):
+            fim = script.find("\n", i)
+            i = n if fim == -1 else fim
+            continue
+        if char in ("'", '"'):
+            delimitador = char
+        elif char == "$":
+            tag = _TAG_DOLAR.match(script, i)
+            if tag:
+                delimitador = tag.group(0)
+                atual.append(delimitador)
+                i = tag.end()
+                continue
+        elif char == ";":
+            comando = "".join(atual).strip()
+            if comando:
+                comandos.append(comando)
+            atual = []
+            i += 1
+            continue
+        atual.append(char)
+        i += 1
+    comando = "".join(atual).strip()
+    if comando:
+        comandos.append(comando)
+    return comandos
+
+
+def _versoes_aplicadas(cur) -> Set[int]:
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migracoes_pendentes(get_connection: Callable, diretorio: str = MIGRATIONS_DIR) -> List[Migracao]:
+    """Retorna as migrações ainda não aplicadas com uma única consulta."""
+    migracoes = descobrir_migracoes(diretorio)
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        try:
+            aplicadas = _versoes_aplicadas(cur)
+        except Exception as exc:
+            # 42P01 (undefined_table): banco ainda sem nenhuma migração aplicada
+            if getattr(exc, "pgcode", None) != "42P01":
+                raise
+            aplicadas = set()
+        conn.rollback()
+    finally:
+        cur.close()
+        conn.close()
+    return [m for m in migracoes if m.versao not in aplicadas]
+
+
+def aplicar_migracoes(
+    get_connection: Callable,
+    diretorio: str = MIGRATIONS_DIR,
+    *,
+    antes: Optional[Callable[[], None]] = None,
+) -> List[Migracao]:
+    """Aplica, em ordem, as migrações pendentes e retorna as aplicadas.
+
+    Um advisory lock de sessão impede que dois processos migrem ao mesmo
+    tempo; quem espera pelo lock encontra as versões já registradas e não
+    repete nada. ``antes`` é chamado sob o lock, antes das migrações (usado
+    para o ``create_all`` dos modelos do SQLAlchemy).
+    """
+    migracoes = descobrir_migracoes(diretorio)
+    conn = get_connection()
+    cur = conn.cursor()
+    aplicadas_agora: List[Migracao] = []
+    try:
+        conn.rollback()
+        conn.autocommit = True
+        cur.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+        try:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    nome VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+                )
+                """
+            )
+            aplicadas = _versoes_aplicadas(cur)
+            if antes is not None:
+                antes()
+            for migracao in migracoes:
+                if migracao.versao in aplicadas:
+                    continue
+                logger.info("Aplicando migração %03d_%s", migracao.versao, migracao.nome)
+                script = migracao.ler()
+                if migracao.transacional:
+                    conn.autocommit = False
+                    try:
+                        cur.execute(script)
+                        _registrar(cur, migracao)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    finally:
+                        conn.autocommit = True
+                else:
+                    for comando in dividir_comandos(script):
+                        cur.execute(comando)
+                    _registrar(cur, migracao)
+                aplicadas_agora.append(migracao)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+    finally:
+        cur.close()
+        conn.close()
+    return aplicadas_agora
+
+
+def _registrar(cur, migracao: Migracao) -> None:
+    cur.execute(
+        "INSERT INTO schema_migrations (version, nome) VALUES (%s, %s)",
+        (migracao.versao, migracao.nome),
+    )
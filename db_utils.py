@@ -2,7 +2,9 @@
 
 from __future__ import annotations
 
-from typing import Union
+import threading
+import time
+from typing import Callable, List, Optional, Tuple, Union
 
 
 def decode_psycopg_unicode_error(err: UnicodeDecodeError) -> str:
@@ -13,4 +15,311 @@ def decode_psycopg_unicode_error(err: UnicodeDecodeError) -> str:
             return raw.decode("latin-1")
         except Exception:
             return repr(raw)
-    return str(err)
+    return str(err)
+
+
+class PoolExhaustedError(RuntimeError):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class _ConnectionProxy:
+    """Forwards attribute access to a psycopg2 connection until ``close()``."""
+
+    __slots__ = ("_conn", "__weakref__")
+
+    def __init__(self, conn) -> None:
+        object.__setattr__(self, "_conn", conn)
+
+    def __getattr__(self, name):
+        conn = object.__getattribute__(self, "_conn")
+        if conn is None:
+            if name == "closed":
+                return 1
+            raise RuntimeError("Connection already closed")
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value) -> None:
+        conn = object.__getattribute__(self, "_conn")
+        if conn is None:
+            raise RuntimeError("Connection already closed")
+        setattr(conn, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # Same semantics as psycopg2: the block ends the transaction only.
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def _detach(self):
+        conn = object.__getattribute__(self, "_conn")
+        object.__setattr__(self, "_conn", None)
+        return conn
+
+
+class PooledConnection(_ConnectionProxy):
+    """Proxy that returns the wrapped psycopg2 connection to its pool on close.
+
+    The legacy views call ``conn.close()`` when they are done; keeping that
+    contract lets ``get_db_connection`` hand out pooled connections without
+    touching every call site.
+    """
+
+    __slots__ = ("_pool",)
+
+    def __init__(self, pool: "ConnectionPool", conn) -> None:
+        super().__init__(conn)
+        object.__setattr__(self, "_pool", pool)
+
+    def close(self) -> None:
+        conn = self._detach()
+        if conn is not None:
+            object.__getattribute__(self, "_pool").putconn(conn)
+
+    def __del__(self) -> None:
+        # A view that forgets ``conn.close()`` must not leak a pool slot.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class SharedConnectionHandle(_ConnectionProxy):
+    """Handle on a :class:`RequestConnection`; ``close()`` keeps it open."""
+
+    __slots__ = ("_owner",)
+
+    def __init__(self, owner: "RequestConnection", conn) -> None:
+        super().__init__(conn)
+        object.__setattr__(self, "_owner", owner)
+
+    def close(self) -> None:
+        if self._detach() is not None:
+            object.__getattribute__(self, "_owner")._handle_closed()
+
+
+class RequestConnection:
+    """Unit of work that shares one connection among every caller of a request.
+
+    ``acquire`` is only called when the first handle is requested. Closing a
+    handle used to close a private connection, discarding whatever had not
+    been committed; to keep that behaviour the transaction is rolled back
+    once the last open handle is closed. ``release`` is meant for the
+    teardown handler and hands the connection back through ``release_fn``
+    (by default ``close()``, which returns a :class:`PooledConnection` to
+    its pool).
+    """
+
+    def __init__(self, acquire: Callable[[], object], release_fn: Optional[Callable[[object], None]] = None) -> None:
+        self._acquire = acquire
+        self._release_fn = release_fn
+        self._conn = None
+        self._open_handles = 0
+        self.checkouts = 0
+
+    @property
+    def active(self) -> bool:
+        return self._conn is not None
+
+    def handle(self) -> SharedConnectionHandle:
+        if self._conn is None:
+            self._conn = self._acquire()
+            self.checkouts += 1
+        self._open_handles += 1
+        return SharedConnectionHandle(self, self._conn)
+
+    def _handle_closed(self) -> None:
+        self._open_handles = max(self._open_handles - 1, 0)
+        if self._open_handles == 0 and self._conn is not None:
+            try:
+                if not self._conn.autocommit:
+                    self._conn.rollback()
+            except Exception:
+                pass
+
+    def release(self) -> None:
+        conn, self._conn = self._conn, None
+        self._open_handles = 0
+        if conn is None:
+            return
+        try:
+            if not getattr(conn, "closed", 0) and not conn.autocommit:
+                conn.rollback()
+        except Exception:
+            pass
+        if self._release_fn is not None:
+            self._release_fn(conn)
+        else:
+            conn.close()
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Connections idle for longer than ``idle_timeout`` are closed (down to
+    ``min_size``) and a connection that has been idle for more than
+    ``health_check_interval`` seconds is pinged with ``SELECT 1`` before
+    being handed out, so a database restart does not surface as an error in
+    the first request after it.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        *,
+        min_size: int = 1,
+        max_size: int = 10,
+        idle_timeout: float = 300.0,
+        checkout_timeout: float = 30.0,
+        health_check_interval: float = 5.0,
+        connect: Optional[Callable[[str], object]] = None,
+    ) -> None:
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.dsn = dsn
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self._connect_fn = connect
+        self._idle: List[Tuple[object, float]] = []
+        self._size = 0
+        self._lock = threading.Condition(threading.Lock())
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        """Number of open connections, idle or checked out."""
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def _connect(self):
+        if self._connect_fn is not None:
+            return self._connect_fn(self.dsn)
+        import psycopg2
+
+        try:
+            return psycopg2.connect(self.dsn)
+        except UnicodeDecodeError as exc:
+            message = decode_psycopg_unicode_error(exc)
+            raise RuntimeError(f"Database connection failed: {message}") from exc
+
+    @staticmethod
+    def _discard(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_since: float, now: float) -> bool:
+        if getattr(conn, "closed", 0):
+            return False
+        if now - idle_since < self.health_check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            finally:
+                cur.close()
+            conn.rollback()
+        except Exception:
+            return False
+        return True
+
+    def _prune_idle(self, now: float) -> List[object]:
+        """Remove idle connections past ``idle_timeout``; caller holds the lock."""
+        expired = []
+        if self.idle_timeout is None or self.idle_timeout <= 0:
+            return expired
+        keep = []
+        for conn, since in self._idle:
+            if now - since > self.idle_timeout and self._size - len(expired) > self.min_size:
+                expired.append(conn)
+            else:
+                keep.append((conn, since))
+        self._idle = keep
+        self._size -= len(expired)
+        return expired
+
+    def getconn(self) -> PooledConnection:
+        """Check out a connection, opening a new one while below ``max_size``."""
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            candidate = None
+            expired: List[object] = []
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                now = time.monotonic()
+                expired = self._prune_idle(now)
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise PoolExhaustedError(
+                            f"No database connection available after {self.checkout_timeout}s "
+                            f"(max_size={self.max_size})"
+                        )
+                    self._lock.wait(remaining)
+                    continue
+            for conn in expired:
+                self._discard(conn)
+
+            if candidate is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+                return PooledConnection(self, conn)
+
+            conn, since = candidate
+            if self._is_healthy(conn, since, time.monotonic()):
+                return PooledConnection(self, conn)
+            self._discard(conn)
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+
+    def putconn(self, conn) -> None:
+        """Return a raw connection, resetting any open transaction first."""
+        reusable = not getattr(conn, "closed", 0)
+        if reusable:
+            try:
+                if conn.autocommit:
+                    conn.autocommit = False
+                else:
+                    conn.rollback()
+            except Exception:
+                reusable = False
+        with self._lock:
+            if reusable and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+            self._lock.notify()
+        if not reusable or self._closed:
+            self._discard(conn)
+
+    def closeall(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._lock.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
@@ -0,0 +1,230 @@
+"""Instrumentação opcional das consultas SQL executadas por requisição.
+
+Quando ativada (``QUERY_INSTRUMENTATION=1``), cada requisição recebe um
+``ColetorConsultas`` que soma a quantidade e o tempo dos comandos executados
+tanto pelos cursores psycopg2 de ``get_db_connection`` (via
+``ConexaoInstrumentada``, que troca o ``cursor_factory`` por uma subclasse
+cronometrada) quanto pelo SQLAlchemy (eventos do engine). Comandos com o
+mesmo formato repetidos muitas vezes na mesma requisição são marcados como
+suspeitas de N+1. Os resumos das últimas requisições ficam em memória no
+processo para a tela de administração.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Tuple
+
+_coletor_atual: ContextVar[Optional["ColetorConsultas"]] = ContextVar(
+    "coletor_consultas", default=None
+)
+
+_LITERAL_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_LITERAL_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMETRO = re.compile(r"%\(\w+\)s|%s|\?|:\w+")
+_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_ESPACOS = re.compile(r"\s+")
+
+
+def formato_sql(comando) -> str:
+    """Normaliza o comando trocando literais e parâmetros por ``?``.
+
+    Duas execuções do mesmo comando com valores diferentes (o padrão N+1)
+    produzem o mesmo formato.
+    """
+    if isinstance(comando, bytes):
+        comando = comando.decode("utf-8", "replace")
+    texto = _LITERAL_TEXTO.sub("?", str(comando))
+    texto = _PARAMETRO.sub("?", texto)
+    texto = _LITERAL_NUMERO.sub("?", texto)
+    texto = _LISTA.sub("(?)", texto)
+    return _ESPACOS.sub(" ", texto).strip()
+
+
+class ColetorConsultas:
+    """Estatísticas das consultas de uma requisição."""
+
+    def __init__(self, *, limite_lentas: int = 5, limiar_repeticao: int = 5) -> None:
+        self.limite_lentas = limite_lentas
+        self.limiar_repeticao = limiar_repeticao
+        self.quantidade = 0
+        self.tempo_total = 0.0
+        self.formatos: Counter = Counter()
+        self._tempos_por_formato: Dict[str, float] = {}
+        self._lentas: List[Tuple[float, str]] = []
+
+    def registrar(self, comando, duracao: float) -> None:
+        formato = formato_sql(comando)
+        self.quantidade += 1
+        self.tempo_total += duracao
+        self.formatos[formato] += 1
+        self._tempos_por_formato[formato] = self._tempos_por_formato.get(formato, 0.0) + duracao
+        self._lentas.append((duracao, formato))
+        if len(self._lentas) > self.limite_lentas * 4:
+            self._lentas = sorted(self._lentas, reverse=True)[: self.limite_lentas]
+
+    @property
+    def mais_lentas(self) -> List[Tuple[float, str]]:
+        return sorted(self._lentas, reverse=True)[: self.limite_lentas]
+
+    @property
+    def repetidas(self) -> List[Tuple[str, int, float]]:
+        """Formatos executados ``limiar_repeticao`` vezes ou mais (suspeitas de N+1)."""
+        return [
+            (formato, vezes, self._tempos_por_formato[formato])
+            for formato, vezes in self.formatos.most_common()
+            if vezes >= self.limiar_repeticao
+        ]
+
+    def resumo(self, **extras) -> Dict[str, object]:
+        dados = {
+            "quantidade": self.quantidade,
+            "tempo_ms": round(self.tempo_total * 1000, 2),
+            "mais_lentas": [(round(d * 1000, 2), f) for d, f in self.mais_lentas],
+            "repetidas": [(f, n, round(t * 1000, 2)) for f, n, t in self.repetidas],
+        }
+        dados.update(extras)
+        return dados
+
+
+def iniciar_coleta(**opcoes) -> ColetorConsultas:
+    coletor = ColetorConsultas(**opcoes)
+    _coletor_atual.set(coletor)
+    return coletor
+
+
+def encerrar_coleta() -> Optional[ColetorConsultas]:
+    coletor = _coletor_atual.get()
+    _coletor_atual.set(None)
+    return coletor
+
+
+def coletor_atual() -> Optional[ColetorConsultas]:
+    return _coletor_atual.get()
+
+
+def _registrar(comando, inicio: float) -> None:
+    coletor = _coletor_atual.get()
+    if coletor is not None:
+        coletor.registrar(comando, time.perf_counter() - inicio)
+
+
+# --- psycopg2 ---------------------------------------------------------------
+
+_fabricas: Dict[type, type] = {}
+_fabricas_lock = threading.Lock()
+
+
+def fabrica_instrumentada(base: type) -> type:
+    """Subclasse de ``base`` (um cursor psycopg2) que cronometra cada execução."""
+    fabrica = _fabricas.get(base)
+    if fabrica is not None:
+        return fabrica
+
+    class CursorInstrumentado(base):
+        def execute(self, query, vars=None):
+            inicio = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                _registrar(query, inicio)
+
+        def executemany(self, query, vars_list):
+            inicio = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                _registrar(query, inicio)
+
+    CursorInstrumentado.__name__ = f"{base.__name__}Instrumentado"
+    with _fabricas_lock:
+        return _fabricas.setdefault(base, CursorInstrumentado)
+
+
+def _cursor_padrao() -> type:
+    from psycopg2.extensions import cursor
+
+    return cursor
+
+
+class ConexaoInstrumentada:
+    """Envolve uma conexão para que todo cursor criado seja instrumentado.
+
+    Respeita o ``cursor_factory`` pedido (``DictCursor`` etc.), apenas
+    trocando-o pela subclasse cronometrada correspondente.
+    """
+
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn) -> None:
+        object.__setattr__(self, "_conn", conn)
+
+    def cursor(self, *args, **kwargs):
+        conn = object.__getattribute__(self, "_conn")
+        base = kwargs.get("cursor_factory") or conn.cursor_factory or _cursor_padrao()
+        kwargs["cursor_factory"] = fabrica_instrumentada(base)
+        return conn.cursor(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(object.__getattribute__(self, "_conn"), name)
+
+    def __setattr__(self, name, value) -> None:
+        setattr(object.__getattribute__(self, "_conn"), name, value)
+
+    def __enter__(self):
+        object.__getattribute__(self, "_conn").__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return object.__getattribute__(self, "_conn").__exit__(exc_type, exc, tb)
+
+
+# --- SQLAlchemy -------------------------------------------------------------
+
+_CHAVE_INICIO = "instrumentacao_inicio"
+
+
+def _antes_execucao(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_CHAVE_INICIO, []).append(time.perf_counter())
+
+
+def _depois_execucao(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get(_CHAVE_INICIO)
+    if inicios:
+        _registrar(statement, inicios.pop())
+
+
+def instrumentar_engine(engine) -> None:
+    """Registra os eventos de execução no engine (uma única vez)."""
+    from sqlalchemy import event
+
+    if not event.contains(engine, "before_cursor_execute", _antes_execucao):
+        event.listen(engine, "before_cursor_execute", _antes_execucao)
+        event.listen(engine, "after_cursor_execute", _depois_execucao)
+
+
+# --- Histórico --------------------------------------------------------------
+
+
+class HistoricoConsultas:
+    """Resumos das últimas requisições instrumentadas deste processo."""
+
+    def __init__(self, tamanho: int = 200) -> None:
+        self._itens: Deque[Dict[str, object]] = deque(maxlen=tamanho)
+        self._lock = threading.Lock()
+
+    def adicionar(self, resumo: Dict[str, object]) -> None:
+        with self._lock:
+            self._itens.appendleft(resumo)
+
+    def listar(self) -> List[Dict[str, object]]:
+        with self._lock:
+            return list(self._itens)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._itens.clear()
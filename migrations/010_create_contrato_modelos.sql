@@ -14,16 +14,16 @@ BEGIN
         SELECT 1 FROM pg_trigger WHERE tgname = 'trg_contrato_modelos_updated_at'
     ) THEN
         CREATE OR REPLACE FUNCTION set_contrato_modelos_updated_at()
-        RETURNS TRIGGER AS $$
+        RETURNS TRIGGER AS $fn$
         BEGIN
             NEW.data_atualizacao := NOW();
             RETURN NEW;
         END;
-        $$ LANGUAGE plpgsql;
+        $fn$ LANGUAGE plpgsql;
 
         CREATE TRIGGER trg_contrato_modelos_updated_at
         BEFORE UPDATE ON contrato_modelos
-        FOR EACH ROW EXECUTE FUNCTION set_contrato_modelos_updated_at();
+        FOR EACH ROW EXECUTE PROCEDURE set_contrato_modelos_updated_at();
     END IF;
 END $$;
 
@@ -0,0 +1,35 @@
+-- migrate: no-transaction
+-- ALTER TYPE ... ADD VALUE não pode rodar dentro de uma transação no
+-- PostgreSQL anterior ao 12; por isso esta migração roda em autocommit.
+ALTER TYPE status_contrato_enum ADD VALUE IF NOT EXISTS 'Finalizado';
+ALTER TYPE status_contrato_enum ADD VALUE IF NOT EXISTS 'Renovar';
+
+ALTER TYPE status_conta_enum ADD VALUE IF NOT EXISTS 'Negociado';
+
+ALTER TYPE tipo_pessoa_enum ADD VALUE IF NOT EXISTS 'Cliente/Fornecedor';
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'status_imovel_enum') THEN
+        CREATE TYPE status_imovel_enum AS ENUM ('Ativo', 'Vendido', 'Loteado');
+    END IF;
+END $$;
+ALTER TYPE status_imovel_enum ADD VALUE IF NOT EXISTS 'Ativo';
+ALTER TYPE status_imovel_enum ADD VALUE IF NOT EXISTS 'Vendido';
+ALTER TYPE status_imovel_enum ADD VALUE IF NOT EXISTS 'Loteado';
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'finalidade_contrato_enum') THEN
+        CREATE TYPE finalidade_contrato_enum AS ENUM ('Comercial', 'Residencial', 'Comodato');
+    END IF;
+END $$;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'prestacao_item_tipo') THEN
+        CREATE TYPE prestacao_item_tipo AS ENUM ('credito', 'debito', 'despesa');
+    END IF;
+END $$;
+ALTER TYPE prestacao_item_tipo ADD VALUE IF NOT EXISTS 'credito_extra';
+ALTER TYPE prestacao_item_tipo ADD VALUE IF NOT EXISTS 'debito_cancelado';
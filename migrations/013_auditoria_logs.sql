@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS auditoria_logs (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER,
+    username VARCHAR(150),
+    modulo VARCHAR(150),
+    acao VARCHAR(50),
+    descricao TEXT,
+    ip VARCHAR(45),
+    criado_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Remove coluna "dados" de instalações antigas
+ALTER TABLE auditoria_logs DROP COLUMN IF EXISTS dados;
@@ -0,0 +1,54 @@
+ALTER TABLE imoveis ADD COLUMN IF NOT EXISTS max_contratos INTEGER DEFAULT 1;
+ALTER TABLE imoveis ADD COLUMN IF NOT EXISTS video_url TEXT;
+
+-- Status e disponibilidade dos imóveis
+ALTER TABLE imoveis ADD COLUMN IF NOT EXISTS status status_imovel_enum NOT NULL DEFAULT 'Ativo';
+ALTER TABLE imoveis ALTER COLUMN status SET DEFAULT 'Ativo';
+ALTER TABLE imoveis ADD COLUMN IF NOT EXISTS disponivel BOOLEAN NOT NULL DEFAULT TRUE;
+UPDATE imoveis SET disponivel = TRUE WHERE disponivel IS NULL;
+
+CREATE TABLE IF NOT EXISTS imoveis_vendas (
+    id SERIAL PRIMARY KEY,
+    imovel_id INTEGER NOT NULL REFERENCES imoveis(id),
+    cliente_id INTEGER NOT NULL REFERENCES pessoas(id),
+    usuario_id INTEGER REFERENCES usuarios(id),
+    data_venda DATE NOT NULL,
+    valor_total NUMERIC(15,2) NOT NULL,
+    quantidade_parcelas INTEGER NOT NULL DEFAULT 1,
+    valor_parcela NUMERIC(15,2) NOT NULL,
+    observacao TEXT,
+    data_cadastro TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS imovel_venda_anexos (
+    id SERIAL PRIMARY KEY,
+    venda_id INTEGER NOT NULL REFERENCES imoveis_vendas(id) ON DELETE CASCADE,
+    nome_arquivo VARCHAR(255) NOT NULL,
+    caminho_arquivo VARCHAR(500) NOT NULL,
+    data_upload TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS loteamentos (
+    id SERIAL PRIMARY KEY,
+    imovel_id INTEGER NOT NULL REFERENCES imoveis(id) ON DELETE CASCADE,
+    autorizado BOOLEAN NOT NULL DEFAULT FALSE,
+    quantidade_lotes INTEGER,
+    mascara_lote VARCHAR(120),
+    autorizado_em TIMESTAMP,
+    autorizado_por INTEGER REFERENCES usuarios(id),
+    loteado_em TIMESTAMP,
+    planta_nome_arquivo VARCHAR(255),
+    planta_caminho_arquivo VARCHAR(500)
+);
+
+CREATE TABLE IF NOT EXISTS loteamentos_lotes (
+    id SERIAL PRIMARY KEY,
+    loteamento_id INTEGER NOT NULL REFERENCES loteamentos(id) ON DELETE CASCADE,
+    imovel_id INTEGER NOT NULL REFERENCES imoveis(id) ON DELETE CASCADE,
+    nome_lote VARCHAR(120) NOT NULL
+);
+
+-- Categoria de receita usada nas vendas de imóveis
+INSERT INTO receitas_cadastro (descricao)
+SELECT 'Venda de Imóvel'
+WHERE NOT EXISTS (SELECT 1 FROM receitas_cadastro WHERE descricao = 'Venda de Imóvel');
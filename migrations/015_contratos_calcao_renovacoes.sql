@@ -0,0 +1,29 @@
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'contratos_aluguel' AND column_name = 'finalidade'
+    ) THEN
+        ALTER TABLE contratos_aluguel
+            ADD COLUMN finalidade finalidade_contrato_enum NOT NULL DEFAULT 'Residencial';
+        ALTER TABLE contratos_aluguel ALTER COLUMN finalidade DROP DEFAULT;
+    END IF;
+END $$;
+
+ALTER TABLE contratos_aluguel
+    ADD COLUMN IF NOT EXISTS quantidade_calcao INTEGER,
+    ADD COLUMN IF NOT EXISTS valor_calcao NUMERIC(10,2);
+
+CREATE TABLE IF NOT EXISTS contrato_renovacoes (
+    id SERIAL PRIMARY KEY,
+    contrato_id INTEGER NOT NULL REFERENCES contratos_aluguel(id) ON DELETE CASCADE,
+    data_inicio_anterior DATE,
+    data_fim_anterior DATE,
+    valor_parcela_anterior NUMERIC(10,2),
+    data_inicio_novo DATE NOT NULL,
+    data_fim_novo DATE NOT NULL,
+    valor_parcela_novo NUMERIC(10,2) NOT NULL,
+    observacao TEXT,
+    usuario_id INTEGER REFERENCES usuarios(id),
+    data_renovacao TIMESTAMP NOT NULL DEFAULT NOW()
+);
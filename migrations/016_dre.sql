@@ -0,0 +1,40 @@
+CREATE TABLE IF NOT EXISTS dre_mascaras (
+    id SERIAL PRIMARY KEY,
+    nome VARCHAR(255) NOT NULL,
+    descricao TEXT,
+    ordem INTEGER NOT NULL DEFAULT 0,
+    eh_formula BOOLEAN NOT NULL DEFAULT FALSE,
+    formula TEXT,
+    ativo BOOLEAN NOT NULL DEFAULT TRUE,
+    data_cadastro TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Colunas adicionadas depois da primeira versão da tabela
+ALTER TABLE dre_mascaras
+    ADD COLUMN IF NOT EXISTS ordem INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS eh_formula BOOLEAN NOT NULL DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS formula TEXT;
+
+-- Nós da máscara (hierarquia)
+CREATE TABLE IF NOT EXISTS dre_nos (
+    id SERIAL PRIMARY KEY,
+    mascara_id INTEGER NOT NULL REFERENCES dre_mascaras(id) ON DELETE CASCADE,
+    parent_id INTEGER REFERENCES dre_nos(id) ON DELETE CASCADE,
+    titulo VARCHAR(255) NOT NULL,
+    tipo VARCHAR(20) NOT NULL DEFAULT 'grupo',
+    ordem INTEGER NOT NULL DEFAULT 0,
+    CONSTRAINT dre_nos_tipo_chk CHECK (tipo IN ('grupo','receita','despesa'))
+);
+
+-- Mapeamentos de categorias de receitas/despesas para nós
+CREATE TABLE IF NOT EXISTS dre_no_receitas (
+    no_id INTEGER NOT NULL REFERENCES dre_nos(id) ON DELETE CASCADE,
+    receita_id INTEGER NOT NULL REFERENCES receitas_cadastro(id) ON DELETE CASCADE,
+    PRIMARY KEY (no_id, receita_id)
+);
+
+CREATE TABLE IF NOT EXISTS dre_no_despesas (
+    no_id INTEGER NOT NULL REFERENCES dre_nos(id) ON DELETE CASCADE,
+    despesa_id INTEGER NOT NULL REFERENCES despesas_cadastro(id) ON DELETE CASCADE,
+    PRIMARY KEY (no_id, despesa_id)
+);
@@ -0,0 +1,46 @@
+CREATE TABLE IF NOT EXISTS ordens_pagamento (
+    id SERIAL PRIMARY KEY,
+    data_emissao TIMESTAMP NOT NULL DEFAULT NOW(),
+    imovel_id INTEGER REFERENCES imoveis(id),
+    fornecedor_id INTEGER NOT NULL REFERENCES pessoas(id),
+    forma_pagamento VARCHAR(30),
+    data_vencimento DATE,
+    descricao_servico TEXT,
+    valor_servico NUMERIC(12,2) NOT NULL DEFAULT 0,
+    desconto_manual NUMERIC(12,2) NOT NULL DEFAULT 0,
+    subtotal_servicos NUMERIC(12,2) NOT NULL DEFAULT 0,
+    subtotal_produtos NUMERIC(12,2) NOT NULL DEFAULT 0,
+    desconto_produtos NUMERIC(12,2) NOT NULL DEFAULT 0,
+    total NUMERIC(12,2) NOT NULL DEFAULT 0,
+    observacoes TEXT
+);
+
+-- Colunas auxiliares para integração com contas a pagar
+ALTER TABLE ordens_pagamento
+    ADD COLUMN IF NOT EXISTS despesa_id INTEGER REFERENCES despesas_cadastro(id),
+    ADD COLUMN IF NOT EXISTS origem_id INTEGER REFERENCES origens_cadastro(id);
+
+-- Itens de produtos da OP
+CREATE TABLE IF NOT EXISTS ordem_pagamento_itens (
+    id SERIAL PRIMARY KEY,
+    ordem_id INTEGER NOT NULL REFERENCES ordens_pagamento(id) ON DELETE CASCADE,
+    codigo_produto VARCHAR(50),
+    descricao_produto TEXT,
+    quantidade NUMERIC(12,2) NOT NULL DEFAULT 0,
+    valor_unitario NUMERIC(12,2) NOT NULL DEFAULT 0,
+    valor_desconto NUMERIC(12,2) NOT NULL DEFAULT 0,
+    valor_total NUMERIC(12,2) NOT NULL DEFAULT 0
+);
+
+-- Parcelas (títulos) da OP
+CREATE TABLE IF NOT EXISTS ordem_pagamento_parcelas (
+    id SERIAL PRIMARY KEY,
+    ordem_id INTEGER NOT NULL REFERENCES ordens_pagamento(id) ON DELETE CASCADE,
+    numero INTEGER,
+    data_vencimento DATE NOT NULL,
+    valor NUMERIC(12,2) NOT NULL DEFAULT 0
+);
+
+-- Relacionamento com contas a pagar para evitar duplicidades
+ALTER TABLE contas_a_pagar
+    ADD COLUMN IF NOT EXISTS ordem_pagamento_id INTEGER REFERENCES ordens_pagamento(id);
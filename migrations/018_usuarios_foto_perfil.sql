@@ -0,0 +1 @@
+ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS foto_perfil VARCHAR(255);
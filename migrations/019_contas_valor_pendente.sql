@@ -0,0 +1,18 @@
+-- contas_a_receber: colunas usadas pelo módulo de boletos (antes criadas em
+-- contas_receber.init_app)
+ALTER TABLE contas_a_receber ADD COLUMN IF NOT EXISTS nosso_numero VARCHAR(20);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'contas_a_receber' AND column_name = 'valor_pendente'
+    ) THEN
+        ALTER TABLE contas_a_receber ADD COLUMN valor_pendente NUMERIC(10,2) DEFAULT 0;
+        UPDATE contas_a_receber SET valor_pendente = valor_previsto - COALESCE(valor_pago, 0);
+    END IF;
+END $$;
+
+ALTER TABLE contas_a_pagar ADD COLUMN IF NOT EXISTS valor_pendente NUMERIC(10,2) DEFAULT 0;
+UPDATE contas_a_pagar
+   SET valor_pendente = GREATEST(valor_previsto - COALESCE(valor_pago, 0), 0);
@@ -0,0 +1,61 @@
+-- Mantém status_conta/valor_pendente calculados na gravação dos títulos.
+-- As triggers aplicam, linha a linha, a mesma regra que antes era aplicada à
+-- tabela inteira a cada acesso às telas; somente a virada diária para
+-- 'Vencida' (atualizar_status_contas_a_*) ainda precisa de UPDATE em lote.
+CREATE OR REPLACE FUNCTION contas_a_receber_calcular_status()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.status_conta IN ('Cancelada', 'Negociado') THEN
+        NEW.valor_pendente := 0;
+        RETURN NEW;
+    END IF;
+    NEW.valor_pendente := NEW.valor_previsto - COALESCE(NEW.valor_pago, 0);
+    IF NEW.valor_pago IS NOT NULL AND NEW.valor_pago >= NEW.valor_previsto THEN
+        NEW.status_conta := 'Paga';
+    ELSIF NEW.valor_pago > 0 THEN
+        NEW.status_conta := 'Parcial';
+    ELSIF NEW.data_vencimento < CURRENT_DATE THEN
+        NEW.status_conta := 'Vencida';
+    ELSE
+        NEW.status_conta := 'Aberta';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION contas_a_pagar_calcular_status()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.data_pagamento IS NOT NULL THEN
+        NEW.status_conta := 'Paga';
+    ELSIF NEW.data_vencimento < CURRENT_DATE THEN
+        NEW.status_conta := 'Vencida';
+    ELSE
+        NEW.status_conta := 'Aberta';
+    END IF;
+    NEW.valor_pendente := GREATEST(NEW.valor_previsto - COALESCE(NEW.valor_pago, 0), 0);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE INDEX IF NOT EXISTS idx_contas_a_receber_status_vencimento
+    ON contas_a_receber (status_conta, data_vencimento);
+CREATE INDEX IF NOT EXISTS idx_contas_a_pagar_status_vencimento
+    ON contas_a_pagar (status_conta, data_vencimento);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_contas_a_receber_status') THEN
+        CREATE TRIGGER trg_contas_a_receber_status
+        BEFORE INSERT OR UPDATE ON contas_a_receber
+        FOR EACH ROW EXECUTE PROCEDURE contas_a_receber_calcular_status();
+        -- Recalcula uma única vez as linhas existentes
+        UPDATE contas_a_receber SET status_conta = status_conta;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_contas_a_pagar_status') THEN
+        CREATE TRIGGER trg_contas_a_pagar_status
+        BEFORE INSERT OR UPDATE ON contas_a_pagar
+        FOR EACH ROW EXECUTE PROCEDURE contas_a_pagar_calcular_status();
+        UPDATE contas_a_pagar SET status_conta = status_conta;
+    END IF;
+END $$;
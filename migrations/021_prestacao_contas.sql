@@ -0,0 +1,45 @@
+CREATE TABLE IF NOT EXISTS prestacoes_contas (
+    id SERIAL PRIMARY KEY,
+    contrato_id INTEGER NOT NULL REFERENCES contratos_aluguel(id) ON DELETE CASCADE,
+    data_encerramento DATE NOT NULL,
+    total_creditos NUMERIC(10,2) NOT NULL DEFAULT 0,
+    total_debitos NUMERIC(10,2) NOT NULL DEFAULT 0,
+    total_despesas NUMERIC(10,2) NOT NULL DEFAULT 0,
+    saldo_final NUMERIC(10,2) NOT NULL DEFAULT 0,
+    observacoes TEXT,
+    conta_pagar_id INTEGER REFERENCES contas_a_pagar(id),
+    conta_receber_id INTEGER REFERENCES contas_a_receber(id),
+    criado_em TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+    atualizado_em TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS prestacoes_contas_itens (
+    id SERIAL PRIMARY KEY,
+    prestacao_id INTEGER NOT NULL REFERENCES prestacoes_contas(id) ON DELETE CASCADE,
+    conta_receber_id INTEGER REFERENCES contas_a_receber(id),
+    tipo prestacao_item_tipo NOT NULL,
+    descricao TEXT NOT NULL,
+    valor NUMERIC(10,2) NOT NULL DEFAULT 0,
+    status_original status_conta_enum,
+    valor_pago_original NUMERIC(10,2),
+    valor_pendente_original NUMERIC(10,2),
+    data_pagamento_original DATE
+);
+
+ALTER TABLE prestacoes_contas
+    ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'Pendente',
+    ADD COLUMN IF NOT EXISTS conta_pagar_id INTEGER REFERENCES contas_a_pagar(id),
+    ADD COLUMN IF NOT EXISTS conta_receber_id INTEGER REFERENCES contas_a_receber(id),
+    ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW();
+
+ALTER TABLE prestacoes_contas_itens
+    ADD COLUMN IF NOT EXISTS status_original status_conta_enum,
+    ADD COLUMN IF NOT EXISTS valor_pago_original NUMERIC(10,2),
+    ADD COLUMN IF NOT EXISTS valor_pendente_original NUMERIC(10,2),
+    ADD COLUMN IF NOT EXISTS data_pagamento_original DATE;
+
+-- Prestações já convertidas em títulos antes da coluna status existir
+UPDATE prestacoes_contas
+SET status = 'Aprovada'
+WHERE status = 'Pendente'
+  AND (conta_pagar_id IS NOT NULL OR conta_receber_id IS NOT NULL);
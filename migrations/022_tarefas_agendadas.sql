@@ -0,0 +1,5 @@
+-- Última execução de cada tarefa diária (ver agendador.py)
+CREATE TABLE IF NOT EXISTS tarefas_agendadas (
+    nome VARCHAR(100) PRIMARY KEY,
+    ultima_execucao TIMESTAMP WITH TIME ZONE NOT NULL
+);
@@ -0,0 +1,84 @@
+-- auditoria_logs passa a ser particionada por mês (PostgreSQL 11+). Cada mês
+-- fica em auditoria_logs_AAAAMM; linhas fora das partições existentes caem em
+-- auditoria_logs_padrao até a partição do mês ser criada.
+
+-- Cria a partição do mês informado, movendo para ela as linhas do mês que
+-- tenham caído na partição padrão. Chamada diariamente pelo agendador.
+CREATE OR REPLACE FUNCTION auditoria_logs_criar_particao(mes DATE)
+RETURNS VOID AS $$
+DECLARE
+    inicio DATE := date_trunc('month', mes)::date;
+    fim DATE := (date_trunc('month', mes) + INTERVAL '1 month')::date;
+    nome TEXT := 'auditoria_logs_' || to_char(mes, 'YYYYMM');
+BEGIN
+    IF to_regclass(nome) IS NOT NULL THEN
+        RETURN;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE auditoria_logs INCLUDING DEFAULTS)', nome);
+    IF to_regclass('auditoria_logs_padrao') IS NOT NULL THEN
+        EXECUTE format(
+            'WITH movidas AS (DELETE FROM auditoria_logs_padrao '
+            'WHERE criado_em >= %L AND criado_em < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM movidas',
+            inicio, fim, nome
+        );
+    END IF;
+    EXECUTE format(
+        'ALTER TABLE auditoria_logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        nome, inicio, fim
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    mes DATE;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'auditoria_logs'::regclass
+    ) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE auditoria_logs RENAME TO auditoria_logs_legado;
+    ALTER TABLE auditoria_logs_legado RENAME CONSTRAINT auditoria_logs_pkey TO auditoria_logs_legado_pkey;
+    ALTER SEQUENCE auditoria_logs_id_seq OWNED BY NONE;
+
+    -- A chave de partição precisa fazer parte da chave primária
+    CREATE TABLE auditoria_logs (
+        id INTEGER NOT NULL DEFAULT nextval('auditoria_logs_id_seq'),
+        user_id INTEGER,
+        username VARCHAR(150),
+        modulo VARCHAR(150),
+        acao VARCHAR(50),
+        descricao TEXT,
+        ip VARCHAR(45),
+        criado_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, criado_em)
+    ) PARTITION BY RANGE (criado_em);
+    ALTER SEQUENCE auditoria_logs_id_seq OWNED BY auditoria_logs.id;
+
+    CREATE TABLE auditoria_logs_padrao PARTITION OF auditoria_logs DEFAULT;
+
+    FOR mes IN
+        SELECT g::date
+        FROM generate_series(
+            (SELECT date_trunc('month', COALESCE(MIN(criado_em), NOW())) FROM auditoria_logs_legado),
+            date_trunc('month', NOW()) + INTERVAL '2 months',
+            INTERVAL '1 month'
+        ) AS g
+    LOOP
+        PERFORM auditoria_logs_criar_particao(mes);
+    END LOOP;
+
+    INSERT INTO auditoria_logs (id, user_id, username, modulo, acao, descricao, ip, criado_em)
+    SELECT id, user_id, username, modulo, acao, descricao, ip, COALESCE(criado_em, NOW())
+    FROM auditoria_logs_legado;
+
+    DROP TABLE auditoria_logs_legado;
+END $$;
+
+-- B-tree para a paginação por cursor (criado_em, id) e BRIN, bem menor, para
+-- os filtros por período
+CREATE INDEX IF NOT EXISTS idx_auditoria_logs_criado_em_id ON auditoria_logs (criado_em, id);
+CREATE INDEX IF NOT EXISTS idx_auditoria_logs_criado_em_brin ON auditoria_logs USING brin (criado_em);
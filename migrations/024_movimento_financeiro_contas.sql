@@ -0,0 +1,6 @@
+-- movimento_financeiro: índices por conta usados no recálculo das posições
+-- diárias restrito às contas de um movimento (caixa_banco.services)
+CREATE INDEX IF NOT EXISTS idx_movimento_origem_data
+    ON movimento_financeiro (conta_origem_tipo, conta_origem_id, data_movimento);
+CREATE INDEX IF NOT EXISTS idx_movimento_destino_data
+    ON movimento_financeiro (conta_destino_tipo, conta_destino_id, data_movimento);
@@ -0,0 +1,18 @@
+-- contas_a_receber.nosso_numero: índice único usado na baixa dos retornos
+-- (contas_receber.services.importar_retorno). Se já houver números
+-- repetidos o índice é criado sem unicidade até que sejam corrigidos.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM contas_a_receber
+        WHERE nosso_numero IS NOT NULL
+        GROUP BY nosso_numero HAVING COUNT(*) > 1
+    ) THEN
+        RAISE WARNING 'contas_a_receber possui nosso_numero repetido; criando índice não único';
+        CREATE INDEX IF NOT EXISTS ix_contas_a_receber_nosso_numero
+            ON contas_a_receber (nosso_numero);
+    ELSE
+        CREATE UNIQUE INDEX IF NOT EXISTS ix_contas_a_receber_nosso_numero
+            ON contas_a_receber (nosso_numero);
+    END IF;
+END $$;
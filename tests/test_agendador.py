@@ -0,0 +1,89 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import agendador
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._result = None
+
+    def execute(self, sql, params=None):
+        self.conn.statements.append(sql.strip())
+        if 'pg_try_advisory_xact_lock' in sql:
+            self._result = [(self.conn.lock_free,)]
+        elif 'FROM tarefas_agendadas' in sql:
+            self._result = [(nome,) for nome in self.conn.concluidas]
+        else:
+            self._result = []
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, lock_free=True, concluidas=()):
+        self.lock_free = lock_free
+        self.concluidas = list(concluidas)
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def registrar(monkeypatch, chamadas):
+    monkeypatch.setattr(agendador, '_tarefas', agendador.OrderedDict())
+    agendador.registrar_tarefa('a', lambda cur: chamadas.append('a'))
+    agendador.registrar_tarefa('b', lambda cur: chamadas.append('b'))
+
+
+def test_executa_apenas_tarefas_pendentes_do_dia(monkeypatch):
+    chamadas = []
+    registrar(monkeypatch, chamadas)
+    conn = FakeConnection(concluidas=['a'])
+    resultado = agendador.executar_tarefas(lambda: conn)
+    assert resultado == {'status': 'executado', 'executadas': ['b']}
+    assert chamadas == ['b']
+    assert conn.commits == 1
+    assert conn.closed
+
+
+def test_forcar_executa_todas(monkeypatch):
+    chamadas = []
+    registrar(monkeypatch, chamadas)
+    conn = FakeConnection(concluidas=['a', 'b'])
+    resultado = agendador.executar_tarefas(lambda: conn, forcar=True)
+    assert resultado['executadas'] == ['a', 'b']
+    assert chamadas == ['a', 'b']
+
+
+def test_lock_ocupado_nao_executa(monkeypatch):
+    chamadas = []
+    registrar(monkeypatch, chamadas)
+    conn = FakeConnection(lock_free=False)
+    resultado = agendador.executar_tarefas(lambda: conn)
+    assert resultado == {'status': 'ocupado', 'executadas': []}
+    assert chamadas == []
+    assert conn.rollbacks == 1
+    assert conn.commits == 0
@@ -6,8 +6,13 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from caixa_banco import init_app as init_caixa, db
-from caixa_banco.models import ContaCaixa
-from caixa_banco.services import criar_movimento, atualizar_movimento
+from caixa_banco.models import ContaBanco, ContaCaixa, MovimentoFinanceiro
+from caixa_banco.services import (
+    atualizar_movimento,
+    criar_movimento,
+    deletar_movimento,
+    lancar_movimentos,
+)
 
 
 def setup_app():
@@ -41,4 +46,54 @@ def test_atualizar_movimento_data_string():
             }
         )
         atualizar_movimento(movimento, {'data_movimento': '2024-01-03'})
-        assert movimento.data_movimento == date(2024, 1, 3)
\ No newline at end of file
+        assert movimento.data_movimento == date(2024, 1, 3)
+
+
+def saldo(model, conta_id):
+    db.session.expire_all()
+    return float(db.session.get(model, conta_id).saldo_atual)
+
+
+def test_saldos_ajustados_na_alteracao_e_exclusao():
+    app = setup_app()
+    with app.app_context():
+        db.session.add(ContaBanco(banco='001', agencia='1', conta='1', saldo_inicial=0.0))
+        db.session.commit()
+        movimento = criar_movimento(
+            {
+                'conta_origem_id': 1,
+                'conta_origem_tipo': 'caixa',
+                'conta_destino_id': 1,
+                'conta_destino_tipo': 'banco',
+                'data_movimento': date(2024, 1, 5),
+                'tipo': 'transferencia',
+                'valor': 40.0,
+            }
+        )
+        assert (saldo(ContaCaixa, 1), saldo(ContaBanco, 1)) == (60.0, 40.0)
+
+        atualizar_movimento(movimento, {'tipo': 'saida', 'valor': 25.0})
+        assert (saldo(ContaCaixa, 1), saldo(ContaBanco, 1)) == (75.0, 0.0)
+
+        deletar_movimento(movimento)
+        assert (saldo(ContaCaixa, 1), saldo(ContaBanco, 1)) == (100.0, 0.0)
+
+
+def test_lancar_movimentos_em_lote():
+    app = setup_app()
+    with app.app_context():
+        dados = [
+            {
+                'conta_origem_id': 1,
+                'conta_origem_tipo': 'caixa',
+                'data_movimento': date(2024, 1, dia),
+                'tipo': 'entrada' if dia % 2 else 'saida',
+                'valor': 10.0,
+            }
+            for dia in range(1, 6)
+        ]
+        movimentos = lancar_movimentos(dados)
+        assert [m.data_movimento.day for m in movimentos] == [1, 2, 3, 4, 5]
+        assert all(m.id for m in movimentos)
+        assert MovimentoFinanceiro.query.count() == 5
+        assert saldo(ContaCaixa, 1) == 110.0
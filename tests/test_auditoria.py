@@ -0,0 +1,190 @@
+import gzip
+import sys
+import threading
+from datetime import date
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from auditoria import (
+    COLUNAS,
+    GravadorAuditoria,
+    aplicar_retencao,
+    criar_particoes,
+    gravar_registros,
+    novo_registro,
+)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.falhar:
+            raise RuntimeError('connection lost')
+        self.conn.inserts.append((sql, list(params)))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.inserts = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.falhar = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+def registro(n):
+    return novo_registro(1, 'admin', 'Imoveis', 'Editar', f'item {n}', '127.0.0.1')
+
+
+def test_gravar_registros_usa_um_insert_de_varias_linhas():
+    conn = FakeConnection()
+    gravar_registros(lambda: conn, [registro(1), registro(2), registro(3)])
+    assert len(conn.inserts) == 1
+    sql, params = conn.inserts[0]
+    assert sql.count('(%s, %s, %s, %s, %s, %s, %s)') == 3
+    assert len(params) == 3 * len(COLUNAS)
+    assert conn.commits == 1
+
+
+def test_registros_sao_gravados_em_lotes_pela_thread():
+    conn = FakeConnection()
+    gravador = GravadorAuditoria(lambda: conn, tamanho_lote=4, intervalo=0.05)
+    for n in range(10):
+        gravador.registrar(registro(n))
+    gravador.esvaziar()
+    total = sum(len(params) for _, params in conn.inserts) // len(COLUNAS)
+    assert total == 10
+    assert len(conn.inserts) < 10
+    gravador.parar()
+
+
+def test_fila_cheia_grava_de_forma_sincrona():
+    conn = FakeConnection()
+    bloqueio = threading.Event()
+    chamadas = []
+
+    def get_connection():
+        chamadas.append(threading.current_thread().name)
+        if threading.current_thread().name == 'gravador-auditoria':
+            bloqueio.wait(1)
+        return conn
+
+    gravador = GravadorAuditoria(get_connection, tamanho_lote=1, intervalo=0.01, capacidade=1)
+    for n in range(4):
+        gravador.registrar(registro(n))
+    assert threading.current_thread().name in chamadas
+    bloqueio.set()
+    gravador.parar()
+    total = sum(len(params) for _, params in conn.inserts) // len(COLUNAS)
+    assert total == 4
+
+
+def test_parar_grava_registros_pendentes():
+    conn = FakeConnection()
+    gravador = GravadorAuditoria(lambda: conn, tamanho_lote=100, intervalo=10)
+    gravador.registrar(registro(1))
+    gravador.registrar(registro(2))
+    gravador.parar(timeout=0.1)
+    total = sum(len(params) for _, params in conn.inserts) // len(COLUNAS)
+    assert total == 2
+
+
+def test_falha_na_gravacao_nao_propaga():
+    conn = FakeConnection()
+    conn.falhar = True
+    gravador = GravadorAuditoria(lambda: conn, intervalo=0.01)
+    gravador.registrar(registro(1))
+    gravador.esvaziar()
+    assert conn.rollbacks == 1
+    gravador.parar()
+
+
+class CatalogoCursor:
+    def __init__(self, particoes, desanexadas=()):
+        self.particoes = particoes
+        self.desanexadas = desanexadas
+        self.comandos = []
+
+    def execute(self, sql, params=None):
+        self.comandos.append((sql.strip(), params))
+
+    def fetchall(self):
+        nomes = self.desanexadas if 'relispartition' in self.comandos[-1][0] else self.particoes
+        return [(nome,) for nome in nomes]
+
+    def copy_expert(self, sql, arquivo):
+        arquivo.write('id,modulo\n1,Imoveis\n')
+
+    def close(self):
+        pass
+
+
+class CatalogoConnection(FakeConnection):
+    def __init__(self, particoes, desanexadas=()):
+        super().__init__()
+        self.cur = CatalogoCursor(particoes, desanexadas)
+
+    def cursor(self):
+        return self.cur
+
+
+def test_criar_particoes_do_mes_atual_e_seguintes():
+    cur = CatalogoCursor([])
+    criar_particoes(cur, meses_a_frente=2)
+    meses = [params[0] for _, params in cur.comandos]
+    inicio = date.today().replace(day=1)
+    assert meses[0] == inicio
+    assert len(meses) == 3
+    assert all(mes.day == 1 for mes in meses)
+    assert meses == sorted(meses)
+
+
+def test_retencao_desanexa_apenas_particoes_antigas():
+    conn = CatalogoConnection(
+        ['auditoria_logs_202403', 'auditoria_logs_padrao', 'auditoria_logs_202401', 'auditoria_logs_202402']
+    )
+    processadas = aplicar_retencao(lambda: conn, 1, hoje=date(2024, 3, 15))
+    assert processadas == ['auditoria_logs_202401']
+    comandos = [sql for sql, _ in conn.cur.comandos]
+    assert 'ALTER TABLE auditoria_logs DETACH PARTITION "auditoria_logs_202401"' in comandos
+    assert not any('DROP TABLE' in sql for sql in comandos)
+    assert conn.commits == 1
+
+
+def test_retencao_arquiva_e_remove(tmp_path):
+    conn = CatalogoConnection(['auditoria_logs_202312', 'auditoria_logs_202403'])
+    processadas = aplicar_retencao(lambda: conn, 2, pasta_arquivo=str(tmp_path), hoje=date(2024, 3, 1))
+    assert processadas == ['auditoria_logs_202312']
+    with gzip.open(tmp_path / 'auditoria_logs_202312.csv.gz', 'rt', encoding='utf-8') as arquivo:
+        assert arquivo.read().startswith('id,modulo')
+    assert any(sql == 'DROP TABLE "auditoria_logs_202312"' for sql, _ in conn.cur.comandos)
+
+
+def test_retencao_arquiva_particoes_ja_desanexadas(tmp_path):
+    conn = CatalogoConnection(
+        ['auditoria_logs_202403'],
+        desanexadas=['auditoria_logs_202311', 'auditoria_logs_202402', 'auditoria_logs_backup'],
+    )
+    processadas = aplicar_retencao(lambda: conn, 2, pasta_arquivo=str(tmp_path), hoje=date(2024, 3, 1))
+    assert processadas == ['auditoria_logs_202311']
+    assert (tmp_path / 'auditoria_logs_202311.csv.gz').exists()
+    comandos = [sql for sql, _ in conn.cur.comandos]
+    assert 'DROP TABLE "auditoria_logs_202311"' in comandos
+    assert not any('DETACH' in sql for sql in comandos)
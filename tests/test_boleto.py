@@ -3,17 +3,23 @@ import sys
 from pathlib import Path
 from datetime import date
 from flask import Flask
+import pytest
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from caixa_banco import init_app as init_caixa, db
 from contas_receber import init_app as init_contas
-from caixa_banco.models import ContaBanco
+from caixa_banco.arquivos import ArquivoJaProcessado
+from caixa_banco.models import ContaBanco, MovimentoFinanceiro
 from contas_receber.models import EmpresaLicenciada, ContaReceber, Pessoa, ReceitaCadastro
+import contas_receber.services
 from contas_receber.services import gerar_boletos, importar_retorno
+from contas_receber.boleto_html import html_pdf_boleto, renderizador
 from contas_receber.boleto_utils import codigo_barras_html as _barcode_html
 from contas_receber.boleto_utils import linha_digitavel, codigo_barras_numero, digits
+from contas_receber.boleto_utils import CalculadoraCodigos
 from contas_receber.cnab import CNAB240Writer, Titulo
+from sqlalchemy.dialects import postgresql
 
 
 def setup_app(tmp_path):
@@ -80,6 +86,102 @@ def test_gerar_boletos(tmp_path):
         assert b'00000000000' in conteudo
 
 
+def test_gerar_boletos_saida_lote(tmp_path):
+    app = setup_app(tmp_path)
+    with app.app_context():
+        db.session.add(
+            ContaReceber(
+                cliente_id=1,
+                receita_id=1,
+                titulo='Teste 2',
+                data_vencimento=date.today(),
+                valor_previsto=50.00,
+            )
+        )
+        db.session.commit()
+        resultado = gerar_boletos([1, 2], saida='lote')
+        assert resultado['erros'] == []
+        assert os.path.exists(resultado['remessa'])
+        assert len(resultado['pdfs']) == 1
+        with open(resultado['pdfs'][0], 'rb') as f:
+            conteudo = f.read()
+        assert conteudo.startswith(b'%PDF')
+        assert conteudo.count(b'/Type /Page\n') >= 2
+        with pytest.raises(ValueError):
+            gerar_boletos([1], saida='zip')
+
+
+def _contar_conversoes(monkeypatch):
+    convertidos = []
+    original = contas_receber.services.gerar_pdfs
+
+    def gerar_pdfs(tarefas, processos=1):
+        tarefas = list(tarefas)
+        convertidos.extend(identificador for identificador, _, _ in tarefas)
+        return original(tarefas, processos)
+
+    monkeypatch.setattr(contas_receber.services, 'gerar_pdfs', gerar_pdfs)
+    return convertidos
+
+
+def test_gerar_boletos_reaproveita_pdf_em_cache(tmp_path, monkeypatch):
+    app = setup_app(tmp_path)
+    convertidos = _contar_conversoes(monkeypatch)
+    with app.app_context():
+        primeiro = gerar_boletos([1])
+        conteudo = Path(primeiro['pdfs'][0]).read_bytes()
+        segundo = gerar_boletos([1])
+        assert convertidos == [1]
+        assert Path(segundo['pdfs'][0]).read_bytes() == conteudo
+
+        gerar_boletos([1], saida='lote')
+        gerar_boletos([1], saida='lote')
+        assert convertidos == [1, 'lote']
+
+        # Alterar um campo impresso no boleto invalida o PDF em cache
+        titulo = ContaReceber.query.get(1)
+        titulo.valor_previsto = 150
+        db.session.commit()
+        gerar_boletos([1])
+        assert convertidos == [1, 'lote', 1]
+    cache = tmp_path / 'boletos' / 'cache'
+    assert len(list(cache.glob('*.pdf'))) == 3
+    assert not list(cache.glob('*.tmp'))
+
+
+def test_gerar_boletos_sem_cache(tmp_path, monkeypatch):
+    app = setup_app(tmp_path)
+    app.config['BOLETO_PDF_CACHE_MB'] = 0
+    convertidos = _contar_conversoes(monkeypatch)
+    with app.app_context():
+        gerar_boletos([1])
+        gerar_boletos([1])
+    assert convertidos == [1, 1]
+    assert not (tmp_path / 'boletos' / 'cache').exists()
+
+
+def test_render_many_igual_ao_render_individual(tmp_path):
+    app = setup_app(tmp_path)
+    with app.app_context():
+        db.session.add(
+            ContaReceber(
+                cliente_id=99,
+                receita_id=1,
+                titulo='Sem cliente',
+                data_vencimento=date.today(),
+                valor_previsto=10.00,
+            )
+        )
+        db.session.commit()
+        titulos = ContaReceber.query.order_by(ContaReceber.id).all()
+        erros = {}
+        lote = list(renderizador().render_many(titulos, erros=erros))
+        assert [titulo.id for titulo, _ in lote] == [1]
+        assert lote[0][1] == html_pdf_boleto(titulos[0])
+        assert '@page' in lote[0][1]
+        assert set(erros) == {2}
+
+
 def test_preview_boleto_html(tmp_path):
     app = setup_app(tmp_path)
     with app.app_context():
@@ -105,6 +207,52 @@ def test_importar_retorno(tmp_path):
         assert resultado['baixados'][0]['id'] == 1
 
 
+def _segmento_p(nosso_numero, centavos):
+    linha = list('00100013' + '00001P' + ' ' * 226)
+    linha[37:57] = nosso_numero.ljust(20)
+    linha[85:100] = str(centavos).zfill(15)
+    return ''.join(linha)
+
+
+def test_importar_retorno_em_lote(tmp_path):
+    app = setup_app(tmp_path)
+    with app.app_context():
+        gerar_boletos([1])
+        nosso_numero = ContaReceber.query.get(1).nosso_numero
+        retorno = '\n'.join(
+            [
+                _segmento_p(nosso_numero, 4000),
+                _segmento_p('9999999999', 1000),
+                _segmento_p(nosso_numero, 6000),
+            ]
+        )
+        resultado = importar_retorno(retorno.encode('ascii'))
+        assert [b['valor_pago'] for b in resultado['baixados']] == [40.0, 60.0]
+        assert resultado['erros'] == [{'nosso_numero': '9999999999', 'erro': 'Titulo nao encontrado'}]
+
+        db.session.expire_all()
+        titulo = ContaReceber.query.get(1)
+        assert titulo.status_conta == 'Paga'
+        assert float(titulo.valor_pago) == 100.0
+        assert float(titulo.valor_pendente) == 0.0
+        movimentos = MovimentoFinanceiro.query.filter_by(documento='CR-1').all()
+        assert sorted(float(m.valor) for m in movimentos) == [40.0, 60.0]
+        assert float(ContaBanco.query.first().saldo_atual) == 100.0
+
+        # O mesmo arquivo não é processado de novo
+        with pytest.raises(ArquivoJaProcessado):
+            importar_retorno(retorno.encode('ascii'))
+
+
+def test_baixa_em_lote_converte_status_para_o_enum_do_postgresql():
+    # Em produção status_conta é status_conta_enum; sem o CAST o PostgreSQL
+    # recusa o CASE de literais (text)
+    sql = str(contas_receber.services._update_baixa(date(2024, 1, 1)).compile(dialect=postgresql.dialect()))
+    atribuicao = sql.split('status_conta=', 1)[1]
+    assert atribuicao.startswith('CAST(CASE')
+    assert 'AS status_conta_enum)' in atribuicao
+
+
 def test_pagamento_parcial(tmp_path):
     app = setup_app(tmp_path)
     with app.app_context():
@@ -142,6 +290,16 @@ def test_barcode_html_interleaved():
     assert _barcode_html('12') == expected
 
 
+def test_calculadora_de_lote_igual_ao_individual():
+    conta = ContaBanco(banco='001', agencia='1234', conta='5678', carteira='17')
+    calculadora = CalculadoraCodigos(conta)
+    for i in range(50):
+        nosso, documento, vencimento, valor = f'{i:010d}', str(i), date(2026, 1, 1 + i % 28), 100.0 + i / 7
+        codigo = calculadora.codigo(nosso, documento, vencimento, valor)
+        assert codigo.codigo_barras == codigo_barras_numero(conta, nosso, documento, valor, vencimento)
+        assert codigo.linha_digitavel == linha_digitavel(conta, nosso, vencimento, valor, documento)
+
+
 def test_linha_digitavel_and_barcode_alignment(tmp_path):
     app = setup_app(tmp_path)
     with app.app_context():
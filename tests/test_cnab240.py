@@ -0,0 +1,140 @@
+from datetime import date
+from decimal import Decimal
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from cnab240 import HeaderArquivo, LancamentoExtrato, SegmentoP, SegmentoU, TrailerArquivo, ler_registros
+import pytest
+
+from contas_receber.cnab import CNAB240Reader, CNAB240Writer, Campo, Leiaute, Titulo
+
+
+def registro(tipo, segmento=' ', campos=()):
+    linha = list('00100013' + '00001' + segmento + ' ' * 226)
+    linha[7] = tipo
+    for inicio, valor in campos:
+        linha[inicio:inicio + len(valor)] = valor
+    return ''.join(linha)
+
+
+def retorno():
+    return '\r\n'.join(
+        [
+            registro('0'),
+            registro('1'),
+            registro('3', 'P', [(37, '123'.ljust(20)), (85, '000000000012345')]),
+            registro('3', 'Q'),
+            registro('3', 'T'),
+            registro('3', 'U', [(137, '05022024')]),
+            '',
+            registro('5'),
+            registro('9'),
+        ]
+    ) + '\r\n'
+
+
+def test_registros_tipados_de_stream_binario():
+    conteudo = b'\xef\xbb\xbf' + retorno().encode('ascii')
+    registros = list(ler_registros(BytesIO(conteudo)))
+    assert [r.categoria for r in registros] == [
+        'header_arquivo',
+        'header_lote',
+        'segmento_P',
+        'segmento_Q',
+        'segmento_T',
+        'segmento_U',
+        'trailer_lote',
+        'trailer_arquivo',
+    ]
+    assert all(len(r) == 240 for r in registros)
+    assert isinstance(registros[0], HeaderArquivo)
+    assert isinstance(registros[2], SegmentoP)
+    assert isinstance(registros[5], SegmentoU)
+    assert isinstance(registros[7], TrailerArquivo)
+    assert registros[2].nosso_numero == '123'
+    assert registros[2].valor_titulo == Decimal('123.45')
+    assert registros[2].sequencial == '00001'
+    assert registros[5].data_ocorrencia == date(2024, 2, 5)
+    assert registros[5].data_credito is None
+
+
+def test_reader_aceita_texto_e_stream():
+    esperado = [('123', 123.45)]
+    assert list(CNAB240Reader(retorno()).titulos_pagados()) == esperado
+    stream = BytesIO(retorno().encode('ascii'))
+    assert list(CNAB240Reader(stream).titulos_pagados()) == esperado
+
+
+def test_writer_grava_titulos_sob_demanda():
+    empresa = SimpleNamespace(documento='12345678000190', razao_social_nome='Empresa Ação')
+    conta = SimpleNamespace(banco='001', agencia='1234-5', conta='98765-4', convenio='1234567', carteira='17')
+    arquivo = StringIO(newline='')
+    linhas_gravadas = []
+
+    def titulos():
+        for i in range(1000):
+            linhas_gravadas.append(arquivo.getvalue().count('\r\n'))
+            yield Titulo(nosso_numero=str(i + 1), valor=1.5, nome_pagador='José')
+
+    CNAB240Writer(empresa, conta).escrever(arquivo, titulos())
+    # O primeiro título é lido antes dos headers; os seguintes, depois de o
+    # anterior ter sido gravado
+    assert linhas_gravadas[:3] == [0, 5, 8]
+    assert linhas_gravadas[-1] == 2 + 3 * 999
+
+    registros = list(ler_registros(arquivo.getvalue()))
+    assert len(registros) == 3004
+    assert all(len(r) == 240 for r in registros)
+    assert [r.categoria for r in registros[2:5]] == ['segmento_P', 'segmento_Q', 'segmento_R']
+    assert registros[0].data_geracao == date.today()
+    assert registros[2].nosso_numero == '1234567' + '1'.zfill(10)
+    assert registros[-2].quantidade_registros == '003002'
+    assert registros[-2].valor_total == Decimal('1500.00')
+    assert registros[-1].quantidade_registros == '003004'
+    assert CNAB240Writer(empresa, conta).gerar([Titulo('1', 1.5)]).endswith('\r\n')
+
+
+def test_writer_sem_titulos_nao_grava_nada():
+    arquivo = StringIO()
+    with pytest.raises(ValueError):
+        CNAB240Writer(SimpleNamespace(), SimpleNamespace()).escrever(arquivo, iter(()))
+    assert arquivo.getvalue() == ''
+
+
+def test_leiaute_valida_posicoes():
+    with pytest.raises(ValueError):
+        Leiaute('teste', [Campo('banco', 1, 3, 'N'), Campo('resto', 5, 236, 'A', '')])
+    registro = Leiaute('teste', [Campo('banco', 1, 3, 'N'), Campo('resto', 4, 237, 'A', '')]).preparar()
+    assert registro.formatar(banco='1') == '001' + ' ' * 237
+
+
+def test_digest_ignora_lote_e_numero_sequencial():
+    campos = [(37, '123'.ljust(20)), (85, '000000000012345')]
+    original, renumerado, outro = ler_registros(
+        '\n'.join(
+            [
+                registro('3', 'P', campos),
+                registro('3', 'P', campos).replace('00100013' + '00001', '00100073' + '00042', 1),
+                registro('3', 'P', [(37, '124'.ljust(20)), (85, '000000000012345')]),
+            ]
+        )
+    )
+    assert renumerado.digitos(3, 7) == '0007'
+    assert original.digest == renumerado.digest
+    assert original.digest != outro.digest
+
+
+def test_leiaute_informado_vale_para_todas_as_linhas():
+    linha = [' '] * 240
+    linha[7] = '3'
+    linha[70:90] = 'TED RECEBIDA'.ljust(20)
+    linha[143:151] = '20240301'
+    linha[152:167] = '000000000001250'
+    (registro,) = ler_registros(''.join(linha), leiaute=LancamentoExtrato)
+    assert registro.historico == 'TED RECEBIDA'
+    assert registro.data_lancamento == date(2024, 3, 1)
+    assert registro.valor_lancamento == Decimal('12.50')
@@ -0,0 +1,156 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import db_migrations
+from db_migrations import (
+    aplicar_migracoes,
+    descobrir_migracoes,
+    dividir_comandos,
+    migracoes_pendentes,
+)
+
+
+class UndefinedTable(Exception):
+    pgcode = '42P01'
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self.conn.executados.append((sql.strip(), params, self.conn.autocommit))
+        if sql.startswith('SELECT version FROM schema_migrations'):
+            if self.conn.aplicadas is None:
+                raise UndefinedTable('relation "schema_migrations" does not exist')
+            self._rows = [(v,) for v in sorted(self.conn.aplicadas)]
+        elif sql.startswith('INSERT INTO schema_migrations'):
+            self.conn.aplicadas.add(params[0])
+        elif 'CREATE TABLE IF NOT EXISTS schema_migrations' in sql:
+            if self.conn.aplicadas is None:
+                self.conn.aplicadas = set()
+        elif 'falha' in sql:
+            raise RuntimeError('syntax error')
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, aplicadas=None):
+        self.aplicadas = aplicadas
+        self.autocommit = False
+        self.executados = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+    def scripts(self):
+        return [sql for sql, _, _ in self.executados]
+
+
+@pytest.fixture
+def pasta(tmp_path):
+    (tmp_path / '001_inicial.sql').write_text('CREATE TABLE a (id INT);\n', encoding='utf-8')
+    (tmp_path / '010_enum.sql').write_text(
+        "-- migrate: no-transaction\n"
+        "ALTER TYPE t ADD VALUE IF NOT EXISTS 'x';\n"
+        "DO $$ BEGIN PERFORM 1; END $$;\n",
+        encoding='utf-8',
+    )
+    (tmp_path / '002_coluna.sql').write_text('ALTER TABLE a ADD COLUMN b INT;\n', encoding='utf-8')
+    (tmp_path / 'LEIAME.txt').write_text('ignorado', encoding='utf-8')
+    return tmp_path
+
+
+def test_descobre_migracoes_em_ordem_de_versao(pasta):
+    migracoes = descobrir_migracoes(str(pasta))
+    assert [m.versao for m in migracoes] == [1, 2, 10]
+    assert [m.transacional for m in migracoes] == [True, True, False]
+
+
+def test_versao_duplicada_e_rejeitada(pasta):
+    (pasta / '002_outra.sql').write_text('SELECT 1;', encoding='utf-8')
+    with pytest.raises(ValueError):
+        descobrir_migracoes(str(pasta))
+
+
+def test_dividir_comandos_respeita_aspas_e_dolar():
+    script = (
+        "-- comentario; com ponto e virgula\n"
+        "INSERT INTO t VALUES ('a;b');\n"
+        "CREATE FUNCTION f() RETURNS TRIGGER AS $fn$ BEGIN RETURN NEW; END; $fn$ LANGUAGE plpgsql;\n"
+        "DO $$ BEGIN PERFORM 1; END $$"
+    )
+    assert dividir_comandos(script) == [
+        "INSERT INTO t VALUES ('a;b')",
+        "CREATE FUNCTION f() RETURNS TRIGGER AS $fn$ BEGIN RETURN NEW; END; $fn$ LANGUAGE plpgsql",
+        "DO $$ BEGIN PERFORM 1; END $$",
+    ]
+
+
+def test_verificacao_sem_tabela_considera_tudo_pendente(pasta):
+    conn = FakeConnection(aplicadas=None)
+    pendentes = migracoes_pendentes(lambda: conn, str(pasta))
+    assert [m.versao for m in pendentes] == [1, 2, 10]
+    assert len(conn.executados) == 1
+    assert conn.closed
+
+
+def test_aplica_apenas_pendentes_e_registra_versoes(pasta):
+    conn = FakeConnection(aplicadas={1})
+    chamadas = []
+    aplicadas = aplicar_migracoes(lambda: conn, str(pasta), antes=lambda: chamadas.append(1))
+    assert [m.versao for m in aplicadas] == [2, 10]
+    assert conn.aplicadas == {1, 2, 10}
+    assert chamadas == [1]
+    scripts = conn.scripts()
+    assert not any('CREATE TABLE a' in sql for sql in scripts)
+    assert scripts[0].startswith('SELECT pg_advisory_lock')
+    assert scripts[-1].startswith('SELECT pg_advisory_unlock')
+    # migração sem transação roda comando a comando em autocommit
+    enum = [(sql, auto) for sql, _, auto in conn.executados if 'ALTER TYPE' in sql or 'DO $$' in sql]
+    assert enum == [
+        ("ALTER TYPE t ADD VALUE IF NOT EXISTS 'x'", True),
+        ('DO $$ BEGIN PERFORM 1; END $$', True),
+    ]
+    assert conn.commits == 1
+    assert aplicar_migracoes(lambda: conn, str(pasta)) == []
+
+
+def test_falha_desfaz_migracao_e_libera_lock(pasta):
+    (pasta / '003_quebrada.sql').write_text('SELECT falha;', encoding='utf-8')
+    conn = FakeConnection(aplicadas=set())
+    with pytest.raises(RuntimeError):
+        aplicar_migracoes(lambda: conn, str(pasta))
+    assert conn.aplicadas == {1, 2}
+    assert conn.scripts()[-1].startswith('SELECT pg_advisory_unlock')
+    assert conn.closed
+
+
+def test_migracoes_do_projeto_tem_versoes_unicas():
+    migracoes = descobrir_migracoes(db_migrations.MIGRATIONS_DIR)
+    assert migracoes
+    for migracao in migracoes:
+        if not migracao.transacional:
+            assert dividir_comandos(migracao.ler())
@@ -0,0 +1,138 @@
+from datetime import date
+from io import BytesIO
+import sys
+from pathlib import Path
+
+from flask import Flask
+import pytest
+from werkzeug.datastructures import FileStorage
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from caixa_banco import init_app as init_caixa, db
+from caixa_banco.arquivos import ArquivoJaProcessado
+from caixa_banco.models import Conciliacao, ContaBanco, MovimentoFinanceiro
+from caixa_banco.services import criar_movimento, importar_cnab
+
+
+def setup_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_caixa(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(
+            ContaBanco(banco='001', agencia='1', conta='1', saldo_inicial=0.0)
+        )
+        db.session.commit()
+    return app
+
+
+def linha_cnab(data, centavos, historico, lote='', sequencial=''):
+    linha = [' '] * 240
+    linha[3:7] = lote.rjust(4)
+    linha[8:13] = sequencial.rjust(5)
+    linha[70:90] = historico.ljust(20)[:20]
+    linha[143:151] = data.strftime('%Y%m%d')
+    linha[152:167] = str(centavos).zfill(15)
+    return ''.join(linha)
+
+
+def arquivo_cnab(linhas):
+    conteudo = '\n'.join(linhas).encode('utf-8')
+    return FileStorage(stream=BytesIO(conteudo), filename='extrato.ret')
+
+
+def test_importar_cnab_concilia_existentes_e_cria_novos():
+    app = setup_app()
+    with app.app_context():
+        existente = criar_movimento(
+            {
+                'conta_origem_id': 1,
+                'conta_origem_tipo': 'banco',
+                'data_movimento': date(2024, 2, 1),
+                'tipo': 'entrada',
+                'valor': 12.5,
+            }
+        )
+        arquivo = arquivo_cnab(
+            [
+                linha_cnab(date(2024, 2, 1), 1250, 'JA LANCADO'),
+                linha_cnab(date(2024, 2, 2), 3000, 'TED RECEBIDA'),
+                linha_cnab(date(2024, 2, 2), 3000, 'TED REPETIDA'),
+                linha_cnab(date(2024, 2, 3), 999, 'PIX'),
+            ]
+        )
+        resultados = importar_cnab(arquivo, 1, 'banco')
+
+        ids = [r['movimento_id'] for r in resultados]
+        assert ids[0] == existente.id
+        assert ids[1] == ids[2]
+        assert len(set(ids)) == 3
+        assert MovimentoFinanceiro.query.count() == 3
+        assert Conciliacao.query.count() == 4
+        db.session.expire_all()
+        assert float(db.session.get(ContaBanco, 1).saldo_atual) == 12.5 + 30.0 + 9.99
+
+
+def test_reimportacao_ignora_arquivo_e_registros_ja_processados():
+    app = setup_app()
+    with app.app_context():
+        primeiro = [
+            linha_cnab(date(2024, 3, 1), 1000, 'PIX A'),
+            linha_cnab(date(2024, 3, 1), 1000, 'PIX A'),
+            linha_cnab(date(2024, 3, 2), 2000, 'PIX B'),
+        ]
+        assert len(importar_cnab(arquivo_cnab(primeiro), 1, 'banco')) == 3
+
+        with pytest.raises(ArquivoJaProcessado):
+            importar_cnab(arquivo_cnab(primeiro), 1, 'banco')
+        assert Conciliacao.query.count() == 3
+
+        # Repete o primeiro arquivo e acrescenta uma nova ocorrência de "PIX A"
+        # e um lançamento novo: só esses dois são processados
+        segundo = primeiro + [
+            linha_cnab(date(2024, 3, 1), 1000, 'PIX A'),
+            linha_cnab(date(2024, 3, 3), 3000, 'PIX C'),
+        ]
+        assert len(importar_cnab(arquivo_cnab(segundo), 1, 'banco')) == 2
+        assert Conciliacao.query.count() == 5
+        db.session.expire_all()
+        assert float(db.session.get(ContaBanco, 1).saldo_atual) == 60.0
+
+
+def test_envio_simultaneo_do_mesmo_arquivo(monkeypatch):
+    app = setup_app()
+    with app.app_context():
+        linhas = [linha_cnab(date(2024, 4, 1), 500, 'PIX D')]
+        assert len(importar_cnab(arquivo_cnab(linhas), 1, 'banco')) == 1
+        # O segundo envio passou pela verificação antes de o primeiro gravar
+        monkeypatch.setattr('caixa_banco.services.verificar_arquivo', lambda tipo, sha256: None)
+        with pytest.raises(ArquivoJaProcessado):
+            importar_cnab(arquivo_cnab(linhas), 1, 'banco')
+        db.session.rollback()
+        assert Conciliacao.query.count() == 1
+
+
+def test_arquivo_sobreposto_com_outra_numeracao():
+    app = setup_app()
+    with app.app_context():
+        primeiro = [
+            linha_cnab(date(2024, 5, 1), 1000, 'PIX E', '0001', '00001'),
+            linha_cnab(date(2024, 5, 2), 2000, 'PIX F', '0001', '00002'),
+        ]
+        assert len(importar_cnab(arquivo_cnab(primeiro), 1, 'banco')) == 2
+
+        # O extrato seguinte repete o dia 2 com outro lote e outra numeração
+        segundo = [
+            linha_cnab(date(2024, 5, 2), 2000, 'PIX F', '0003', '00001'),
+            linha_cnab(date(2024, 5, 3), 3000, 'PIX G', '0003', '00002'),
+        ]
+        assert len(importar_cnab(arquivo_cnab(segundo), 1, 'banco')) == 1
+        assert Conciliacao.query.count() == 3
+        assert [m.historico for m in MovimentoFinanceiro.query.order_by(MovimentoFinanceiro.id)] == [
+            'PIX E',
+            'PIX F',
+            'PIX G',
+        ]
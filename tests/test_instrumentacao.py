@@ -0,0 +1,91 @@
+import sys
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import instrumentacao
+from instrumentacao import (
+    ColetorConsultas,
+    ConexaoInstrumentada,
+    encerrar_coleta,
+    formato_sql,
+    iniciar_coleta,
+    instrumentar_engine,
+)
+
+
+class BaseCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, vars=None):
+        self.conn.executados.append((query, vars))
+
+
+class FakeConnection:
+    cursor_factory = None
+
+    def __init__(self):
+        self.executados = []
+        self.autocommit = False
+
+    def cursor(self, cursor_factory=None):
+        return (cursor_factory or BaseCursor)(self)
+
+
+def test_formato_ignora_valores_literais_e_parametros():
+    assert formato_sql("SELECT * FROM pessoas WHERE id = 10") == formato_sql(
+        "SELECT  *\n FROM pessoas WHERE id = %s"
+    )
+    assert formato_sql("SELECT 1 FROM t WHERE nome = 'Ana' AND x IN (1, 2, 3)") == (
+        "SELECT ? FROM t WHERE nome = ? AND x IN (?)"
+    )
+
+
+def test_coletor_marca_formatos_repetidos():
+    coletor = ColetorConsultas(limiar_repeticao=3, limite_lentas=2)
+    for n in range(4):
+        coletor.registrar(f"SELECT * FROM pessoas WHERE id = {n}", 0.001)
+    coletor.registrar("SELECT COUNT(*) FROM contas", 0.5)
+    assert coletor.quantidade == 5
+    assert coletor.repetidas == [("SELECT * FROM pessoas WHERE id = ?", 4, coletor.repetidas[0][2])]
+    assert coletor.mais_lentas[0] == (0.5, "SELECT COUNT(*) FROM contas")
+    assert len(coletor.mais_lentas) == 2
+
+
+def test_conexao_instrumentada_respeita_cursor_factory():
+    conn = FakeConnection()
+    instrumentada = ConexaoInstrumentada(conn)
+    coletor = iniciar_coleta()
+    try:
+        cur = instrumentada.cursor(cursor_factory=BaseCursor)
+        assert isinstance(cur, BaseCursor)
+        cur.execute("SELECT 1")
+        cur.execute("SELECT 2")
+    finally:
+        assert encerrar_coleta() is coletor
+    assert coletor.quantidade == 2
+    assert conn.executados == [("SELECT 1", None), ("SELECT 2", None)]
+    instrumentada.autocommit = True
+    assert conn.autocommit is True
+    # fora de uma coleta o cursor continua funcionando sem registrar nada
+    instrumentada.cursor(cursor_factory=BaseCursor).execute("SELECT 3")
+    assert coletor.quantidade == 2
+    assert instrumentacao.fabrica_instrumentada(BaseCursor) is instrumentacao.fabrica_instrumentada(BaseCursor)
+
+
+def test_eventos_do_sqlalchemy_sao_contados():
+    engine = create_engine("sqlite://")
+    instrumentar_engine(engine)
+    instrumentar_engine(engine)
+    coletor = iniciar_coleta(limiar_repeticao=3)
+    try:
+        with engine.connect() as conn:
+            for n in range(3):
+                conn.execute(text(f"SELECT {n}"))
+    finally:
+        encerrar_coleta()
+    assert coletor.quantidade == 3
+    assert coletor.repetidas[0][1] == 3
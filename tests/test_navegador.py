@@ -0,0 +1,112 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from contas_receber.navegador import PoolNavegador
+
+
+class FakeProcesso:
+    def __init__(self):
+        self.codigo = None
+
+    def poll(self):
+        return self.codigo
+
+
+class FakePagina:
+    def __init__(self, navegador):
+        self.navegador = navegador
+        self.fechada = False
+
+    async def setViewport(self, viewport):
+        pass
+
+    async def setContent(self, html, waitUntil=None):
+        if 'falha' in html:
+            raise RuntimeError('falha na página')
+        if 'morre' in html:
+            self.navegador.process.codigo = -9
+            raise RuntimeError('navegador encerrado')
+
+    async def emulateMediaType(self, tipo):
+        pass
+
+    async def pdf(self, path, **opcoes):
+        Path(path).write_bytes(b'%PDF-fake')
+
+    async def close(self):
+        self.fechada = True
+
+
+class FakeNavegador:
+    def __init__(self):
+        self.process = FakeProcesso()
+        self.paginas = []
+        self.fechado = False
+
+    async def newPage(self):
+        pagina = FakePagina(self)
+        self.paginas.append(pagina)
+        return pagina
+
+    async def close(self):
+        self.fechado = True
+
+
+class FakeLaunch:
+    def __init__(self):
+        self.navegadores = []
+        self.opcoes = []
+
+    async def __call__(self, **opcoes):
+        self.opcoes.append(opcoes)
+        navegador = FakeNavegador()
+        self.navegadores.append(navegador)
+        return navegador
+
+
+def test_pool_reaproveita_navegador_e_abas(tmp_path):
+    launch = FakeLaunch()
+    pool = PoolNavegador(launch, paginas=2, max_renders=100)
+    try:
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(
+                lambda i: pool.renderizar('<p>ok</p>', str(tmp_path / f'{i}.pdf')), range(10)
+            ))
+    finally:
+        pool.fechar()
+    assert len(launch.navegadores) == 1
+    assert len(launch.navegadores[0].paginas) <= 2
+    assert launch.navegadores[0].fechado
+    assert all((tmp_path / f'{i}.pdf').exists() for i in range(10))
+    assert any(a.startswith('--user-data-dir=') for a in launch.opcoes[0]['args'])
+
+
+def test_pool_reabre_navegador_apos_limite_e_queda(tmp_path):
+    launch = FakeLaunch()
+    pool = PoolNavegador(launch, paginas=1, max_renders=4)
+    try:
+        for i in range(4):
+            pool.renderizar('<p>ok</p>', str(tmp_path / f'{i}.pdf'))
+        assert len(launch.navegadores) == 1
+        assert launch.navegadores[0].fechado
+
+        # Falha de uma página descarta apenas a aba
+        try:
+            pool.renderizar('<p>falha</p>', str(tmp_path / 'x.pdf'))
+        except RuntimeError:
+            pass
+        pool.renderizar('<p>ok</p>', str(tmp_path / 'y.pdf'))
+        assert len(launch.navegadores) == 2
+
+        # Processo do navegador encerrado: o próximo PDF abre outro
+        try:
+            pool.renderizar('<p>morre</p>', str(tmp_path / 'z.pdf'))
+        except RuntimeError:
+            pass
+        pool.renderizar('<p>ok</p>', str(tmp_path / 'w.pdf'))
+        assert len(launch.navegadores) == 3
+    finally:
+        pool.fechar()
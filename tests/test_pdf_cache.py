@@ -0,0 +1,24 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from contas_receber.pdf_cache import CachePDF
+
+
+def test_limpar_remove_antigos_e_menos_usados(tmp_path):
+    cache = CachePDF(str(tmp_path), limite_bytes=25, validade_dias=30)
+    agora = time.time()
+    idades = {'a': 40 * 86400, 'b': 300, 'c': 200, 'd': 100}
+    for chave, idade in idades.items():
+        caminho = cache.caminho(chave)
+        Path(caminho).write_bytes(b'x' * 10)
+        os.utime(caminho, (agora - idade, agora - idade))
+    temporario = cache.temporario('e')
+    Path(temporario).write_bytes(b'x')
+    os.utime(temporario, (agora - 7200, agora - 7200))
+
+    assert cache.limpar() == 3
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['c.pdf', 'd.pdf']
@@ -0,0 +1,153 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from contas_receber.pdf_motores import SeletorMotores
+
+
+class FakeMotor:
+    def __init__(self, atraso=0.0, disponivel=True):
+        self.atraso = atraso
+        self.disponivel = disponivel
+        self.falhar = False
+        self.chamadas = 0
+
+    def __call__(self, html, caminho):
+        self.chamadas += 1
+        if not self.disponivel:
+            return False
+        if self.falhar:
+            raise RuntimeError('quebrado')
+        time.sleep(self.atraso)
+        Path(caminho).write_bytes(b'%PDF-fake')
+        return True
+
+
+def test_sondagem_escolhe_o_mais_rapido(tmp_path):
+    lento, rapido, ausente = FakeMotor(0.05), FakeMotor(), FakeMotor(disponivel=False)
+    seletor = SeletorMotores([('lento', lento), ('ausente', ausente), ('rapido', rapido)])
+    assert seletor.ativo == 'rapido'
+    assert seletor.converter('<p>x</p>', str(tmp_path / 'a.pdf')) == 'rapido'
+    estados = {e['nome']: e for e in seletor.estado()}
+    assert estados['ausente']['disponivel'] is False
+    assert estados['rapido']['conversoes'] == 1
+    # Mecanismos indisponíveis não são tentados nas conversões
+    assert ausente.chamadas == 1
+
+
+def test_disjuntor_rebaixa_e_restabelece(tmp_path):
+    principal, reserva = FakeMotor(), FakeMotor(0.02)
+    seletor = SeletorMotores([('principal', principal), ('reserva', reserva)], limite_falhas=2, espera=0.2)
+    seletor.sondar()
+    principal.falhar = True
+    for i in range(2):
+        assert seletor.converter('<p>x</p>', str(tmp_path / f'{i}.pdf')) == 'reserva'
+    chamadas = principal.chamadas
+    assert seletor.ativo == 'reserva'
+    seletor.converter('<p>x</p>', str(tmp_path / 'r.pdf'))
+    assert principal.chamadas == chamadas
+
+    # Vencida a espera, o principal volta a ser tentado e um sucesso o restabelece
+    time.sleep(0.25)
+    principal.falhar = False
+    assert seletor.converter('<p>x</p>', str(tmp_path / 'p.pdf')) == 'principal'
+    assert seletor.estado()[0]['falhas'] == 0
+
+
+def test_sem_mecanismo_disponivel(tmp_path):
+    seletor = SeletorMotores([('ausente', FakeMotor(disponivel=False))])
+    with pytest.raises(RuntimeError):
+        seletor.converter('<p>x</p>', str(tmp_path / 'a.pdf'))
+
+
+def aguardar_sondagens():
+    for thread in threading.enumerate():
+        if thread.name == 'sondagem-pdf':
+            thread.join(2)
+
+
+def test_falha_na_sondagem_e_sondada_de_novo_em_segundo_plano(tmp_path):
+    instavel, reserva = FakeMotor(), FakeMotor(0.02)
+    instavel.falhar = True
+    seletor = SeletorMotores([('instavel', instavel), ('reserva', reserva)], espera=0.2)
+    assert seletor.converter('<p>x</p>', str(tmp_path / 'a.pdf')) == 'reserva'
+    assert seletor.estado()[0]['rebaixado_por'] > 0
+
+    time.sleep(0.25)
+    instavel.falhar = False
+    # A conversão não espera pela nova sondagem, que roda em segundo plano
+    assert seletor.converter('<p>x</p>', str(tmp_path / 'b.pdf')) == 'reserva'
+    aguardar_sondagens()
+    assert seletor.estado()[0]['disponivel'] is True
+    assert seletor.converter('<p>x</p>', str(tmp_path / 'c.pdf')) == 'instavel'
+
+
+def test_nova_sondagem_nao_bloqueia_conversoes(tmp_path):
+    liberar = threading.Event()
+    iniciada = threading.Event()
+    quebrado = {'sondagens': 0}
+
+    def lento(html, caminho):
+        quebrado['sondagens'] += 1
+        if quebrado['sondagens'] > 1:
+            iniciada.set()
+            liberar.wait(2)
+        raise RuntimeError('timeout')
+
+    seletor = SeletorMotores([('lento', lento), ('rapido', FakeMotor())], espera=0.05)
+    seletor.sondar()
+    time.sleep(0.1)
+    try:
+        assert seletor.converter('<p>x</p>', str(tmp_path / 'a.pdf')) == 'rapido'
+        assert iniciada.wait(1)
+        assert seletor.converter('<p>x</p>', str(tmp_path / 'b.pdf')) == 'rapido'
+    finally:
+        liberar.set()
+        aguardar_sondagens()
+    assert quebrado['sondagens'] == 2
+
+
+def test_sem_mecanismo_disponivel_tenta_todos_em_ordem(tmp_path):
+    primeiro, segundo = FakeMotor(), FakeMotor()
+    primeiro.falhar = segundo.falhar = True
+    seletor = SeletorMotores([('primeiro', primeiro), ('segundo', segundo)])
+    seletor.sondar()
+    assert [nome for nome, _ in seletor.candidatos()] == ['primeiro', 'segundo']
+    segundo.falhar = False
+    assert seletor.converter('<p>x</p>', str(tmp_path / 'a.pdf')) == 'segundo'
+
+
+def test_estado_nao_espera_a_sondagem():
+    liberar = threading.Event()
+    iniciada = threading.Event()
+
+    def lento(html, caminho):
+        iniciada.set()
+        liberar.wait(1)
+        Path(caminho).write_bytes(b'%PDF-fake')
+        return True
+
+    seletor = SeletorMotores([('lento', lento)])
+    sondagem = threading.Thread(target=seletor.sondar)
+    sondagem.start()
+    iniciada.wait(1)
+    try:
+        assert seletor.estado()[0]['disponivel'] is None
+    finally:
+        liberar.set()
+        sondagem.join()
+    assert seletor.estado()[0]['disponivel'] is True
+
+
+def test_ativo_atual_nao_sonda():
+    motor = FakeMotor()
+    seletor = SeletorMotores([('motor', motor)])
+    assert seletor.ativo_atual is None
+    assert motor.chamadas == 0
+    seletor.sondar()
+    assert seletor.ativo_atual == 'motor'
@@ -6,8 +6,13 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from caixa_banco import init_app as init_caixa, db
-from caixa_banco.models import ContaCaixa, PosicaoDiaria
-from caixa_banco.services import criar_movimento, recalcular_posicoes
+from caixa_banco.models import ContaBanco, ContaCaixa, PosicaoDiaria, PosicaoPendente
+from caixa_banco.services import (
+    criar_movimento,
+    deletar_movimento,
+    processar_posicoes_pendentes,
+    recalcular_posicoes,
+)
 
 
 def setup_app():
@@ -66,3 +71,83 @@ def test_recalculo_posicoes():
             conta_id=1, conta_tipo='caixa', data=date(2024, 1, 5)
         ).first()
         assert float(pos.saldo) == 130.0
+
+
+def test_recalculo_restrito_as_contas_do_movimento():
+    app = setup_app()
+    with app.app_context():
+        db.session.add(
+            ContaCaixa(nome='Caixa Filial', saldo_inicial=10.0, data_saldo_inicial=date(2024, 1, 1))
+        )
+        db.session.add(
+            ContaBanco(
+                banco='001', agencia='1', conta='1', saldo_inicial=0.0,
+                data_saldo_inicial=date(2024, 1, 1),
+            )
+        )
+        db.session.commit()
+        recalcular_posicoes(date(2024, 1, 1))
+        filial = PosicaoDiaria.query.filter_by(conta_id=2, conta_tipo='caixa').count()
+
+        # Posição adulterada da filial: não deve ser regravada
+        PosicaoDiaria.query.filter_by(conta_id=2, conta_tipo='caixa').update({'saldo': 999})
+        db.session.commit()
+
+        movimento = criar_movimento(
+            {
+                'conta_origem_id': 1,
+                'conta_origem_tipo': 'caixa',
+                'conta_destino_id': 1,
+                'conta_destino_tipo': 'banco',
+                'data_movimento': date(2024, 1, 3),
+                'tipo': 'transferencia',
+                'valor': 30.0,
+            }
+        )
+        processar_posicoes_pendentes()
+
+        def saldo(tipo, conta_id):
+            pos = PosicaoDiaria.query.filter_by(
+                conta_id=conta_id, conta_tipo=tipo, data=date(2024, 1, 5)
+            ).first()
+            return float(pos.saldo)
+
+        assert saldo('caixa', 1) == 70.0
+        assert saldo('banco', 1) == 30.0
+        assert saldo('caixa', 2) == 999.0
+        assert PosicaoDiaria.query.filter_by(conta_id=2, conta_tipo='caixa').count() == filial
+
+        deletar_movimento(movimento)
+        processar_posicoes_pendentes()
+        assert saldo('caixa', 1) == 100.0
+        assert saldo('banco', 1) == 0.0
+        assert saldo('caixa', 2) == 999.0
+
+
+def test_lancamentos_seguidos_recalculam_uma_vez():
+    app = setup_app()
+    with app.app_context():
+        for dia, valor in ((10, 5.0), (4, 7.0), (8, 11.0)):
+            criar_movimento(
+                {
+                    'conta_origem_id': 1,
+                    'conta_origem_tipo': 'caixa',
+                    'data_movimento': date(2024, 1, dia),
+                    'tipo': 'entrada',
+                    'valor': valor,
+                }
+            )
+
+        # Nenhuma posição gravada ainda: só a marca, na menor data
+        assert PosicaoDiaria.query.count() == 0
+        pendente = PosicaoPendente.query.one()
+        assert (pendente.conta_tipo, pendente.conta_id) == ('caixa', 1)
+        assert pendente.data_inicio == date(2024, 1, 4)
+
+        assert processar_posicoes_pendentes() > 0
+        assert PosicaoPendente.query.count() == 0
+        pos = PosicaoDiaria.query.filter_by(
+            conta_id=1, conta_tipo='caixa', data=date(2024, 1, 10)
+        ).first()
+        assert float(pos.saldo) == 123.0
+        assert processar_posicoes_pendentes() == 0